@@ -0,0 +1,160 @@
+import re
+import struct
+
+from volumes import fat_geometry, ntfs_geometry
+from ntfs_mft import MftParser, BITMAP_RECORD
+
+
+FAT_SLICE = 4 * 1024 * 1024  # FAT entries decoded per pass, a multiple of 8
+
+# Runs of fully free bytes, runs of fully allocated bytes, or one mixed byte.
+_RUNS = re.compile(rb'\x00+|\xff+|.', re.DOTALL)
+
+# Per-bit translation tables: any non-zero input byte becomes (1 << bit).
+_BIT_TABLES = [bytes([0] + [1 << bit] * 255) for bit in range(8)]
+_LOW_NIBBLE = bytes(value & 0x0F for value in range(256))
+_HIGH_NIBBLE = bytes(value & 0xF0 for value in range(256))
+
+
+def pack_bits(flags):
+    """Pack one flag byte per cluster (non-zero = allocated) into a bitmap, LSB first.
+
+    Works on whole byte strings: each of the eight bit lanes is translated
+    and OR-ed in as one big integer, so there is no per-cluster Python loop.
+    """
+    flags = bytes(flags) + bytes(-len(flags) % 8)
+    packed = 0
+    for bit in range(8):
+        packed |= int.from_bytes(flags[bit::8].translate(_BIT_TABLES[bit]), 'little')
+    return packed.to_bytes(len(flags) // 8, 'little')
+
+
+def _or_lanes(*lanes):
+    value = 0
+    for lane in lanes:
+        value |= int.from_bytes(lane, 'little')
+    return value.to_bytes(len(lanes[0]), 'little')
+
+
+def fat_entry_flags(fat, fat_type):
+    """One byte per FAT entry in `fat`, non-zero when the entry is in use."""
+    if fat_type == 'FAT32':
+        fat = fat[:len(fat) // 4 * 4]
+        # The top four bits of a FAT32 entry are reserved.
+        return _or_lanes(fat[0::4], fat[1::4], fat[2::4], fat[3::4].translate(_LOW_NIBBLE))
+    if fat_type == 'FAT16':
+        fat = fat[:len(fat) // 2 * 2]
+        return _or_lanes(fat[0::2], fat[1::2])
+    # FAT12 packs two entries into three bytes.
+    fat = fat[:len(fat) // 3 * 3]
+    flags = bytearray(len(fat) // 3 * 2)
+    flags[0::2] = _or_lanes(fat[0::3], fat[1::3].translate(_LOW_NIBBLE))
+    flags[1::2] = _or_lanes(fat[1::3].translate(_HIGH_NIBBLE), fat[2::3])
+    return bytes(flags)
+
+
+class AllocationBitmap:
+    """One bit per cluster, set when the cluster is allocated (LSB first, like NTFS $Bitmap)."""
+    def __init__(self, bits, count):
+        self.bits = bytearray(bits)
+        self.count = count
+        # Padding past the last cluster never counts as free.
+        for cluster in range(count, len(self.bits) * 8):
+            self.bits[cluster >> 3] |= 1 << (cluster & 7)
+
+    def is_allocated(self, cluster):
+        return bool(self.bits[cluster >> 3] >> (cluster & 7) & 1)
+
+    def free_runs(self):
+        """Yield (first cluster, cluster count) for every run of free clusters."""
+        start = None
+        for match in _RUNS.finditer(self.bits):
+            value = match.group()[0]
+            base = match.start() * 8
+            if value == 0x00:
+                if start is None:
+                    start = base
+            elif value == 0xFF:
+                if start is not None:
+                    yield start, base - start
+                    start = None
+            else:
+                for bit in range(8):
+                    if value >> bit & 1:
+                        if start is not None:
+                            yield start, base + bit - start
+                            start = None
+                    elif start is None:
+                        start = base + bit
+        if start is not None:
+            yield start, min(self.count, len(self.bits) * 8) - start
+
+    def free_count(self):
+        return sum(count for _, count in self.free_runs())
+
+
+def fat_allocation(reader, geometry):
+    """AllocationBitmap of a FAT volume's clusters, decoded from the first FAT.
+
+    Entries 0 and 1 are reserved, so bit n is data cluster n as in the FAT.
+    The FAT is decoded FAT_SLICE entries at a time to keep memory bounded.
+    """
+    entries = geometry.cluster_count + 2
+    entry_bits = {'FAT12': 12, 'FAT16': 16, 'FAT32': 32}[geometry.fat_type]
+    bits = bytearray()
+    for first in range(0, entries, FAT_SLICE):
+        count = min(FAT_SLICE, entries - first)
+        start = geometry.fat_offset + first * entry_bits // 8
+        size = (count * entry_bits + 7) // 8
+        data = reader.view(start, size)
+        flags = fat_entry_flags(bytes(data) if data is not None else b'', geometry.fat_type)[:count]
+        # A truncated FAT leaves the remaining clusters marked allocated.
+        flags += b'\x01' * (count - len(flags))
+        bits += pack_bits(flags)
+    bits[0] |= 0x03  # reserved entries 0 and 1
+    return AllocationBitmap(bits, entries)
+
+
+def ntfs_allocation(reader, geometry):
+    """AllocationBitmap of an NTFS volume's clusters, read from the $Bitmap file."""
+    parser = MftParser(reader, geometry)
+    record = parser.record(BITMAP_RECORD)
+    if record is None or record['size'] is None:
+        return None
+    return AllocationBitmap(parser.read_data(record), geometry.cluster_count)
+
+
+def unallocated_extents(reader, volume):
+    """Absolute (start, end) byte extents of unallocated space in `volume`.
+
+    FAT volumes are read from the first FAT, NTFS volumes from $Bitmap. The
+    result covers free clusters plus the volume slack after the last
+    cluster. Returns None when the filesystem isn't supported or its
+    allocation metadata can't be parsed.
+    """
+    geometry = fat_geometry(reader, volume)
+    if geometry is not None:
+        allocation = fat_allocation(reader, geometry)
+        heap_end = geometry.cluster_offset(geometry.cluster_count + 2)
+    else:
+        geometry = ntfs_geometry(reader, volume)
+        if geometry is None:
+            return None
+        try:
+            allocation = ntfs_allocation(reader, geometry)
+        except (ValueError, struct.error, IndexError):
+            allocation = None  # corrupt $MFT or $Bitmap: carve the whole volume
+        if allocation is None:
+            return None
+        heap_end = geometry.cluster_offset(geometry.cluster_count)
+
+    extents = []
+    for cluster, count in allocation.free_runs():
+        start = geometry.cluster_offset(cluster)
+        extents.append((start, min(start + count * geometry.cluster_size, volume.end)))
+    if volume.end > heap_end:
+        if extents and extents[-1][1] == heap_end:
+            extents[-1] = (extents[-1][0], volume.end)
+        else:
+            extents.append((heap_end, volume.end))
+    return extents
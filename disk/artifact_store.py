@@ -0,0 +1,254 @@
+import json
+import sqlite3
+import time
+import atexit
+from threading import Thread, Lock
+from queue import Queue, Empty
+
+
+INSERT_CARVED_FILE = '''
+    INSERT INTO carved_files (file_type, offset, size, md5, sha1, sha256, blob, duplicate, fragments,
+                              known, recovery_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_YARA_MATCH = '''
+    INSERT INTO yara_matches (source, rule, namespace, tags, string_id, offset, length, file_offset, blob,
+                              match_time)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+INSERT_PACKED_BLOB = '''
+    INSERT OR IGNORE INTO pack_index (blob, md5, segment, offset, length) VALUES (?, ?, ?, ?, ?)
+'''
+
+SAVE_PROGRESS = '''
+    INSERT OR REPLACE INTO carve_progress (evidence, range_start, range_end, next_offset, completed, updated)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+COLLISION_DIGITS = 16  # SHA-256 digits appended to a blob name whose MD5 is taken
+
+_STOP = object()
+
+
+class ArtifactWriter:
+    """Single-connection, batched writer for the case database.
+
+    Rows are handed over through a queue by the carving code (any thread) and
+    written by one background thread that owns the SQLite connection. The
+    database runs in WAL mode and rows are flushed with executemany inside one
+    transaction per batch, instead of one connect/commit per row.
+    """
+    def __init__(self, db_path, batch_size=1000, flush_interval=1.0, queue_size=10000):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = Queue(maxsize=queue_size)
+        self.thread = None
+        self.error = None
+        self.rows_written = 0
+        self.batches_written = 0
+        self.write_time = 0.0
+        self.started_at = None
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.thread = Thread(target=self._run, name="artifact-writer", daemon=True)
+        self.thread.start()
+        # Flush whatever is buffered if the interpreter exits without close().
+        atexit.register(self.close)
+        return self
+
+    def put(self, statement, row):
+        """Queue one row for `statement` (blocks when the queue is full)."""
+        if self.error:
+            raise RuntimeError(f"artifact writer failed: {self.error}")
+        self.queue.put((statement, row))
+
+    def add_carved_file(self, record, recovery_time):
+        hashes = record['hashes']
+        fragments = record.get('fragments')
+        self.put(INSERT_CARVED_FILE, (
+            record['file_type'], record['offset'], record['size'],
+            hashes.get('md5'), hashes.get('sha1'), hashes.get('sha256'),
+            record['blob'], int(record['duplicate']),
+            json.dumps(fragments) if fragments else None, record.get('known'), recovery_time
+        ))
+
+    def add_yara_match(self, source, match, match_time, file_offset=None, blob=None):
+        """Queue a YARA match; `source` is 'image' (absolute offset) or 'carved'
+        (offset within the carved file at `file_offset`)."""
+        self.put(INSERT_YARA_MATCH, (
+            source, match['rule'], match['namespace'], match['tags'], match['string'],
+            match['offset'], match['length'], file_offset, blob, match_time
+        ))
+
+    def add_packed_blob(self, record):
+        """Queue the pack_index row of a blob stored in an evidence pack."""
+        pack = record['pack']
+        self.put(INSERT_PACKED_BLOB, (record['blob'], record['hashes'].get('md5'), pack['segment'],
+                                      pack['offset'], pack['length']))
+
+    def save_progress(self, evidence, range_start, range_end, next_offset, completed, updated):
+        """Queue a checkpoint; it commits in the same or a later transaction than
+        every row queued before it, so it never gets ahead of the data."""
+        self.put(SAVE_PROGRESS, (evidence, range_start, range_end, next_offset, int(completed), updated))
+
+    def close(self):
+        """Flush all queued rows and stop the writer thread."""
+        if self.thread is None:
+            return
+        self.queue.put(_STOP)
+        self.thread.join()
+        self.thread = None
+        atexit.unregister(self.close)
+        if self.error:
+            print(f"Error writing artifacts: {self.error}")
+        print(self.report())
+
+    def throughput(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def report(self):
+        return (f"Artifact store: {self.rows_written} rows in {self.batches_written} batches, "
+                f"{self.throughput():.0f} rows/s overall, {self.write_time:.2f}s in SQLite")
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _run(self):
+        conn = sqlite3.connect(self.db_path)
+        stopping = False
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            pending = []
+            last_flush = time.perf_counter()
+            while not stopping:
+                try:
+                    item = self.queue.get(timeout=self.flush_interval)
+                except Empty:
+                    item = None
+                if item is _STOP:
+                    stopping = True
+                elif item is not None:
+                    pending.append(item)
+
+                now = time.perf_counter()
+                if pending and (stopping or len(pending) >= self.batch_size
+                                or now - last_flush >= self.flush_interval):
+                    self._flush(conn, pending)
+                    pending = []
+                    last_flush = now
+        except Exception as e:
+            self.error = e
+            # Keep draining so producers never block on a dead writer.
+            while not stopping:
+                stopping = self.queue.get() is _STOP
+        finally:
+            conn.close()
+
+    def _flush(self, conn, pending):
+        start = time.perf_counter()
+        groups = {}
+        for statement, row in pending:
+            groups.setdefault(statement, []).append(row)
+        with conn:
+            for statement, rows in groups.items():
+                conn.executemany(statement, rows)
+        self.rows_written += len(pending)
+        self.batches_written += 1
+        self.write_time += time.perf_counter() - start
+
+
+def collision_name(blob, sha256):
+    """The {md5}-{sha256 prefix}.{ext} name of a blob whose MD5 name is taken."""
+    stem, dot, ext = blob.partition('.')
+    return f"{stem.split('-')[0]}-{sha256[:COLLISION_DIGITS]}{dot}{ext}"
+
+
+class DedupIndex:
+    """Content-addressed index of stored blobs, keyed by SHA-256.
+
+    claim() is checked before a carved file is written: the first caller for
+    a hash gets to store it, later callers get the existing blob name back and
+    only record their offset. Thread-safe; seeded from the case database so
+    re-runs and resumed runs keep deduplicating against earlier output.
+
+    Blobs are still named by MD5; a file whose MD5 matches a stored blob of
+    different content is named {md5}-{sha256 prefix}.{ext} instead, so an
+    MD5 collision never overwrites evidence. For packed output the index
+    also keeps where each blob was packed (place()/location()), so
+    duplicates can point at it.
+    """
+    def __init__(self, db_path=None):
+        self.lock = Lock()
+        self.blobs = {}  # sha256 -> blob name
+        self.names = set()
+        self.packs = {}  # blob name -> pack location
+        if db_path:
+            self.load(db_path)
+
+    def load(self, db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            rows = conn.execute(
+                'SELECT sha256, blob FROM carved_files WHERE duplicate = 0 AND blob IS NOT NULL'
+            )
+            with self.lock:
+                for sha256, blob in rows:
+                    self.blobs.setdefault(sha256, blob)
+                    self.names.add(blob)
+            rows = conn.execute('SELECT blob, segment, offset, length FROM pack_index')
+            with self.lock:
+                for blob, segment, offset, length in rows:
+                    self.packs[blob] = {'segment': segment, 'offset': offset, 'length': length}
+        except sqlite3.OperationalError:
+            pass  # No case database (or no packed output) yet
+        finally:
+            conn.close()
+
+    def claim(self, sha256, blob):
+        """Return (blob name, duplicate) for content hashing to `sha256`.
+
+        A known hash returns its stored blob; otherwise `blob` (or its
+        collision name) is registered and returned for the caller to store.
+        """
+        with self.lock:
+            existing = self.blobs.get(sha256)
+            if existing is not None:
+                return existing, True
+            if blob in self.names:
+                blob = collision_name(blob, sha256)
+            self.blobs[sha256] = blob
+            self.names.add(blob)
+            return blob, False
+
+    def place(self, blob, pack):
+        """Record where a claimed blob was packed."""
+        with self.lock:
+            self.packs[blob] = pack
+
+    def location(self, blob):
+        """Pack location of `blob`, or None if it isn't packed (or not yet)."""
+        with self.lock:
+            return self.packs.get(blob)
+
+    def rename(self, sha256):
+        """Move the blob claimed for `sha256` to its collision name; returns it.
+
+        For a blob whose MD5 name turned out to be taken by a file written
+        by another process.
+        """
+        with self.lock:
+            blob = self.blobs[sha256] = collision_name(self.blobs[sha256], sha256)
+            self.names.add(blob)
+            return blob
+
+    def __len__(self):
+        return len(self.blobs)
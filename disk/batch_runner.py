@@ -0,0 +1,322 @@
+"""Non-interactive batch analysis of many evidence images.
+
+A manifest lists the jobs; each job is one evidence file analyzed into its
+own output directory and case database, in a child process of its own:
+
+    {
+        "defaults": {"workers": 2, "report": "json"},
+        "device_budgets": {"nas": 2},
+        "jobs": [
+            {"case_id": "2024-001", "evidence": "/mnt/nas/a.E01", "output": "/cases/2024-001", "device": "nas"},
+            {"case_id": "2024-002", "evidence": "/mnt/usb/b.dd", "output": "/cases/2024-002"}
+        ]
+    }
+
+Any other job key is passed to ForensicAnalyzer as a keyword argument;
+"report" picks the report format written after the analysis (null for
+none). Jobs are scheduled on at most --jobs slots, and at most the
+device's budget (default 1) of them read from the same source device at
+once. "device" defaults to the filesystem device of the evidence file.
+Failed jobs are retried with resume enabled, so they continue from their
+checkpoints. Job status lives in a status database, so rerunning a
+manifest skips the jobs that are already done:
+
+    python batch_runner.py run manifest.json --jobs 3 --status-db batch.db
+    python batch_runner.py status --status-db batch.db
+"""
+import os
+import sys
+import json
+import time
+import sqlite3
+import inspect
+import argparse
+import datetime
+import subprocess
+
+
+MAX_JOBS = 2
+DEVICE_BUDGET = 1  # concurrent jobs per source device unless the manifest says otherwise
+MAX_ATTEMPTS = 3
+RETRY_DELAY = 30.0  # seconds before a failed job is retried, times the attempts so far
+POLL_INTERVAL = 1.0
+STATUS_DB = 'batch_status.db'
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+# Job keys consumed by the runner rather than passed to ForensicAnalyzer.
+JOB_KEYS = ('case_id', 'evidence', 'output', 'device', 'report')
+
+
+def analyzer_options():
+    """Keyword arguments ForensicAnalyzer accepts from a manifest."""
+    from disk_forensic import ForensicAnalyzer
+    parameters = inspect.signature(ForensicAnalyzer.__init__).parameters
+    return set(parameters) - {'self', 'evidence_path', 'case_id', 'output_path', 'db_path', 'resume'}
+
+
+def source_device(path):
+    """Device id of the filesystem holding `path`, used as the default I/O group."""
+    try:
+        return f"dev-{os.stat(path).st_dev}"
+    except OSError:
+        return os.path.dirname(os.path.abspath(path))
+
+
+def load_manifest(path):
+    """(jobs, device budgets) from a manifest file; raises ValueError on a bad manifest."""
+    with open(path) as f:
+        manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {'jobs': manifest}
+    defaults = manifest.get('defaults', {})
+    budgets = manifest.get('device_budgets', {})
+    allowed = analyzer_options()
+
+    jobs = []
+    seen = set()
+    for number, entry in enumerate(manifest.get('jobs', []), 1):
+        job = dict(defaults, **entry)
+        for key in ('case_id', 'evidence', 'output'):
+            if not job.get(key):
+                raise ValueError(f"job {number} has no {key}")
+        job['case_id'] = str(job['case_id'])
+        if job['case_id'] in seen:
+            raise ValueError(f"case id {job['case_id']} appears twice")
+        seen.add(job['case_id'])
+        unknown = set(job) - allowed - set(JOB_KEYS)
+        if unknown:
+            raise ValueError(f"job {job['case_id']}: unknown options {', '.join(sorted(unknown))}")
+        job['evidence'] = os.path.abspath(job['evidence'])
+        job['output'] = os.path.abspath(job['output'])
+        job.setdefault('device', source_device(job['evidence']))
+        job.setdefault('report', 'json')
+        jobs.append(job)
+    return jobs, budgets
+
+
+class JobStatus:
+    """Status database of a batch: one row per job, updated as jobs move along."""
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS batch_jobs (
+                case_id TEXT PRIMARY KEY,
+                evidence TEXT,
+                device TEXT,
+                status TEXT,
+                attempts INTEGER DEFAULT 0,
+                started TEXT,
+                finished TEXT,
+                exit_code INTEGER,
+                log TEXT
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, case_id):
+        return self.conn.execute('SELECT status, attempts FROM batch_jobs WHERE case_id = ?',
+                                 (case_id,)).fetchone()
+
+    def queue(self, job):
+        self.conn.execute('''
+            INSERT INTO batch_jobs (case_id, evidence, device, status) VALUES (?, ?, ?, ?)
+            ON CONFLICT (case_id) DO UPDATE SET evidence = excluded.evidence, device = excluded.device,
+                status = CASE WHEN status = 'done' THEN status ELSE excluded.status END
+        ''', (job['case_id'], job['evidence'], job['device'], QUEUED))
+        self.conn.commit()
+
+    def update(self, case_id, **fields):
+        assignments = ', '.join(f"{name} = ?" for name in fields)
+        self.conn.execute(f'UPDATE batch_jobs SET {assignments} WHERE case_id = ?',
+                          (*fields.values(), case_id))
+        self.conn.commit()
+
+    def rows(self):
+        return self.conn.execute('SELECT case_id, status, attempts, device, started, finished, exit_code, log '
+                                 'FROM batch_jobs ORDER BY case_id').fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+class BatchRunner:
+    """Schedules manifest jobs across `max_jobs` child processes.
+
+    A job starts only when a slot is free and its source device is below
+    its budget; otherwise later jobs on other devices go first. A job whose
+    process exits non-zero is queued again after RETRY_DELAY * attempts
+    seconds with resume enabled, until it has had `max_attempts` runs in
+    this batch. Any job with an earlier attempt (failed, or interrupted in a
+    previous batch) resumes from its checkpoints.
+    """
+    def __init__(self, jobs, status, max_jobs=MAX_JOBS, device_budgets=None, max_attempts=MAX_ATTEMPTS,
+                 retry_delay=RETRY_DELAY, poll_interval=POLL_INTERVAL):
+        self.jobs = jobs
+        self.status = status
+        self.max_jobs = max_jobs
+        self.device_budgets = device_budgets or {}
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.poll_interval = poll_interval
+        self.running = {}  # case id -> (job, process, log file)
+        self.retries = []  # failed jobs going back to the queue
+
+    def budget(self, device):
+        return self.device_budgets.get(device, DEVICE_BUDGET)
+
+    def run(self):
+        """Run every job that isn't done yet; returns the number of failed jobs."""
+        pending = []
+        for job in self.jobs:
+            self.status.queue(job)
+            state, attempts = self.status.get(job['case_id'])
+            if state == DONE:
+                print(f"[{job['case_id']}] already done, skipping")
+                continue
+            job['attempts'] = attempts
+            job['tries'] = 0
+            job['ready_at'] = 0.0
+            pending.append(job)
+
+        failed = 0
+        try:
+            while pending or self.running:
+                failed += self.poll()
+                now = time.monotonic()
+                busy = {}
+                for job, _, _ in self.running.values():
+                    busy[job['device']] = busy.get(job['device'], 0) + 1
+                for job in list(pending):
+                    if len(self.running) >= self.max_jobs:
+                        break
+                    if job['ready_at'] > now or busy.get(job['device'], 0) >= self.budget(job['device']):
+                        continue
+                    pending.remove(job)
+                    busy[job['device']] = busy.get(job['device'], 0) + 1
+                    self.start(job)
+                pending.extend(self.retries)
+                self.retries = []
+                time.sleep(self.poll_interval)
+        except KeyboardInterrupt:
+            print("Interrupted, stopping running jobs (they resume on the next run).")
+            for case_id, (job, process, log) in self.running.items():
+                process.terminate()
+                process.wait()
+                log.close()
+                self.status.update(case_id, status=QUEUED, finished=datetime.datetime.now().isoformat())
+            self.running = {}
+            raise
+        return failed
+
+    def start(self, job):
+        job['attempts'] += 1
+        job['tries'] += 1
+        os.makedirs(job['output'], exist_ok=True)
+        log_path = os.path.join(job['output'], f"case_{job['case_id']}_batch.log")
+        log = open(log_path, 'a')
+        log.write(f"=== attempt {job['attempts']} at {datetime.datetime.now().isoformat()} ===\n")
+        log.flush()
+        spec = {key: value for key, value in job.items() if key not in ('attempts', 'tries', 'ready_at')}
+        spec['resume'] = job['attempts'] > 1
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'job', json.dumps(spec)],
+                                   stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT)
+        self.running[job['case_id']] = (job, process, log)
+        self.status.update(job['case_id'], status=RUNNING, attempts=job['attempts'],
+                           started=datetime.datetime.now().isoformat(), finished=None, exit_code=None,
+                           log=log_path)
+        print(f"[{job['case_id']}] started attempt {job['attempts']} on {job['device']}")
+
+    def poll(self):
+        """Collect finished jobs; returns how many failed for good."""
+        failed = 0
+        for case_id, (job, process, log) in list(self.running.items()):
+            code = process.poll()
+            if code is None:
+                continue
+            del self.running[case_id]
+            log.close()
+            finished = datetime.datetime.now().isoformat()
+            if code == 0:
+                self.status.update(case_id, status=DONE, finished=finished, exit_code=code)
+                print(f"[{case_id}] done")
+            elif job['tries'] < self.max_attempts:
+                self.status.update(case_id, status=QUEUED, finished=finished, exit_code=code)
+                job['ready_at'] = time.monotonic() + self.retry_delay * job['tries']
+                self.retries.append(job)
+                print(f"[{case_id}] failed with exit code {code}, retrying")
+            else:
+                self.status.update(case_id, status=FAILED, finished=finished, exit_code=code)
+                failed += 1
+                print(f"[{case_id}] failed with exit code {code} after {job['tries']} attempts")
+        return failed
+
+
+def run_job(spec):
+    """Child process: analyze one evidence file and write its report; returns the exit code.
+
+    A job only succeeds when carve_progress has no range left short of its
+    end, so partial failures are retried (with resume) like crashes.
+    """
+    from disk_forensic import ForensicAnalyzer
+    options = {key: value for key, value in spec.items() if key not in JOB_KEYS}
+    options.setdefault('metrics_path', os.path.join(spec['output'], f"case_{spec['case_id']}_metrics.json"))
+    analyzer = ForensicAnalyzer(spec['evidence'], spec['case_id'], spec['output'],
+                                db_path=os.path.join(spec['output'], f"case_{spec['case_id']}.db"),
+                                **options)
+    if not analyzer.analyze_disk():
+        return 1
+    incomplete = analyzer.incomplete_ranges()
+    if incomplete:
+        for start, end in incomplete:
+            print(f"Range [{start}, {end}) was not carved to its end.")
+        return 1
+    if spec['report']:
+        analyzer.generate_report(spec['report'])
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run disk analysis jobs from a manifest.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="run the jobs of a manifest")
+    run.add_argument('manifest')
+    run.add_argument('--jobs', type=int, default=MAX_JOBS, help="jobs running at once")
+    run.add_argument('--status-db', default=STATUS_DB)
+    run.add_argument('--attempts', type=int, default=MAX_ATTEMPTS, help="runs per job before giving up")
+    run.add_argument('--retry-delay', type=float, default=RETRY_DELAY)
+    status = commands.add_parser('status', help="show job status")
+    status.add_argument('--status-db', default=STATUS_DB)
+    job = commands.add_parser('job', help=argparse.SUPPRESS)
+    job.add_argument('spec')
+    args = parser.parse_args(argv)
+
+    if args.command == 'job':
+        return run_job(json.loads(args.spec))
+
+    job_status = JobStatus(args.status_db)
+    try:
+        if args.command == 'status':
+            for case_id, state, attempts, device, started, finished, code, log in job_status.rows():
+                print(f"{case_id}\t{state}\tattempts={attempts}\tdevice={device}\t"
+                      f"started={started}\tfinished={finished}\texit={code}\tlog={log}")
+            return 0
+        try:
+            jobs, budgets = load_manifest(args.manifest)
+        except (OSError, ValueError) as e:
+            print(f"Invalid manifest: {e}")
+            return 2
+        runner = BatchRunner(jobs, job_status, max_jobs=max(1, args.jobs), device_budgets=budgets,
+                             max_attempts=max(1, args.attempts), retry_delay=args.retry_delay)
+        try:
+            failed = runner.run()
+        except KeyboardInterrupt:
+            return 130
+        print(f"Batch finished: {len(jobs)} jobs, {failed} failed.")
+        return 1 if failed else 0
+    finally:
+        job_status.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
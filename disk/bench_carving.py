@@ -0,0 +1,351 @@
+"""Carving throughput benchmark on reproducible synthetic disk images.
+
+Builds a RAW image with an MBR partition table and a known set of embedded
+JPG/PNG/PDF/ZIP/OLE files (some deliberately straddling carving chunk
+boundaries), runs ForensicAnalyzer and PartitionAnalyzer over it and reports
+MB/s, files/s, peak RSS, recall and precision against the ground truth.
+
+    python bench_carving.py --size 256 --files 200 --workers 1 4
+"""
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import struct
+import zlib
+import random
+import zipfile
+import argparse
+import hashlib
+import tempfile
+import contextlib
+import multiprocessing
+
+try:
+    import resource
+    RESOURCE_AVAILABLE = True
+except ImportError:
+    RESOURCE_AVAILABLE = False
+
+import disk_forensic
+from disk_analysis import PartitionAnalyzer
+from evidence_reader import DiskReader
+
+
+SECTOR = 512
+PARTITION_ALIGN = 2048  # sectors
+
+
+class SyntheticFiles:
+    """Deterministic generators for well-formed test files."""
+    def __init__(self, rnd):
+        self.rnd = rnd
+
+    def noise(self, size):
+        return self.rnd.randbytes(size)
+
+    def jpg(self, size, thumbnail=True):
+        def segment(marker, payload):
+            return b'\xff' + bytes([marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+        data = b'\xff\xd8' + segment(0xE0, b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00')
+        if thumbnail:
+            data += segment(0xE1, b'Exif\x00\x00' + self.jpg(256, thumbnail=False))
+        data += segment(0xDB, b'\x00' + self.noise(64))
+        data += segment(0xC0, b'\x08\x00\x10\x00\x10\x01\x01\x11\x00')
+        data += segment(0xC4, b'\x00' + self.noise(28))
+        data += segment(0xDA, b'\x01\x01\x00\x00\x3f\x00')
+        scan = self.noise(size).replace(b'\xff', b'\xff\x00')
+        return data + scan[:size // 2] + b'\xff\xd0' + scan[size // 2:] + b'\xff\xd9'
+
+    def png(self, size):
+        def chunk(kind, payload):
+            return struct.pack('>I', len(payload)) + kind + payload + struct.pack('>I', zlib.crc32(kind + payload))
+
+        return (b'\x89PNG\r\n\x1a\n'
+                + chunk(b'IHDR', struct.pack('>IIBBBBB', 64, 64, 8, 2, 0, 0, 0))
+                + chunk(b'IDAT', self.noise(size))
+                + chunk(b'IEND', b''))
+
+    def pdf(self, size):
+        stream = self.noise(size).replace(b'startxref', b'xxxxxxxxx').replace(b'%PDF-', b'xxxxx')
+        objects = [
+            b'<< /Type /Catalog /Pages 2 0 R >>',
+            b'<< /Type /Pages /Kids [] /Count 0 >>',
+            b'<< /Length %d >>\nstream\n' % size + stream + b'\nendstream',
+        ]
+        data = b'%PDF-1.4\n'
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(len(data))
+            data += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+        xref = len(data)
+        data += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+        data += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+        data += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+        return data
+
+    def zip(self, size):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            archive.writestr('data.bin', self.noise(size))
+            archive.comment = b'detectra benchmark'
+        return buffer.getvalue()
+
+    def ole(self, size, stream='Workbook'):
+        # Layout: header, FAT sectors, one directory sector, stream data.
+        sectors = max(1, min(size, 6 * 1024 * 1024) // SECTOR)
+        fat_sectors = 1
+        while fat_sectors * 128 < fat_sectors + 1 + sectors:
+            fat_sectors += 1
+        first_data = fat_sectors + 1
+        fat = [0xFFFFFFFD] * fat_sectors + [0xFFFFFFFE]
+        fat += list(range(first_data + 1, first_data + sectors)) + [0xFFFFFFFE]
+        fat += [0xFFFFFFFF] * (fat_sectors * 128 - len(fat))
+
+        header = bytearray(SECTOR)
+        header[0:8] = bytes([0xD0, 0xCF, 0x11, 0xE0, 0xA1, 0xB1, 0x1A, 0xE1])
+        header[0x18:0x1E] = struct.pack('<HHH', 0x3E, 3, 0xFFFE)
+        header[0x1E:0x22] = struct.pack('<HH', 9, 6)
+        header[0x2C:0x34] = struct.pack('<II', fat_sectors, fat_sectors)
+        header[0x38:0x4C] = struct.pack('<IIIII', 4096, 0xFFFFFFFE, 0, 0xFFFFFFFE, 0)
+        difat = list(range(fat_sectors)) + [0xFFFFFFFF] * (109 - fat_sectors)
+        header[0x4C:0x200] = struct.pack('<109I', *difat)
+
+        directory = bytearray(SECTOR)
+        name = (stream + '\0').encode('utf-16-le')
+        directory[0:len(name)] = name
+        return bytes(header) + struct.pack(f'<{len(fat)}I', *fat) + bytes(directory) + self.noise(sectors * SECTOR)
+
+
+def fat16_boot_sector(total_sectors):
+    """Minimal FAT16 boot sector for PartitionAnalyzer.get_fat_information."""
+    boot = bytearray(SECTOR)
+    boot[0:3] = b'\xeb\x3c\x90'
+    boot[3:11] = b'DETECTRA'
+    boot[11:13] = struct.pack('<H', SECTOR)
+    boot[13] = 8                                  # sectors per cluster
+    boot[14:16] = struct.pack('<H', 4)            # reserved sectors
+    boot[16] = 2                                  # FAT copies
+    boot[17:19] = struct.pack('<H', 512)          # root entries
+    boot[22:24] = struct.pack('<H', 64)           # sectors per FAT
+    boot[32:36] = struct.pack('<I', total_sectors)
+    boot[510:512] = b'\x55\xaa'
+    return bytes(boot)
+
+
+def root_directory(rnd, entries):
+    data = bytearray()
+    for index in range(entries):
+        name = f"FILE{index:04d}TXT".encode()
+        entry = bytearray(32)
+        entry[0:11] = name
+        if index % 5 == 0:
+            entry[0] = 0xE5  # deleted
+        entry[11] = 0x20
+        entry[26:28] = struct.pack('<H', 2 + index)
+        entry[28:32] = struct.pack('<I', rnd.randrange(1, 1 << 20))
+        data += entry
+    return bytes(data)
+
+
+def build_image(path, size_mb, file_count, seed=1, partitions=2, fill='random'):
+    """Write a synthetic image and return its ground truth."""
+    rnd = random.Random(seed)
+    files = SyntheticFiles(rnd)
+    size = size_mb * 1024 * 1024
+    total_sectors = size // SECTOR
+
+    # MBR with `partitions` equal, aligned primary partitions.
+    usable = total_sectors - PARTITION_ALIGN
+    per_partition = usable // partitions // PARTITION_ALIGN * PARTITION_ALIGN
+    mbr = bytearray(SECTOR)
+    extents = []
+    for index in range(partitions):
+        start = PARTITION_ALIGN + index * per_partition
+        part_type = 0x06 if index == 0 else 0x07
+        mbr[446 + index * 16:462 + index * 16] = (bytes([0, 0, 0, 0, part_type, 0, 0, 0])
+                                                  + struct.pack('<II', start, per_partition))
+        extents.append((start * SECTOR, (start + per_partition) * SECTOR))
+    mbr[510:512] = b'\x55\xaa'
+
+    placed = [(0, bytes(mbr), None)]
+    first = extents[0][0]
+    placed.append((first, fat16_boot_sector(per_partition), None))
+    # Data area as PartitionAnalyzer computes it: start + reserved + FATs.
+    placed.append((first + (4 + 64 * 2) * SECTOR, root_directory(rnd, 64), None))
+
+    makers = [('JPG', files.jpg), ('PNG', files.png), ('PDF', files.pdf),
+              ('ZIP', files.zip), ('XLS', files.ole)]
+    truth = []
+    cursor = {extent: extent[0] + 256 * 1024 for extent in extents}
+    for index in range(file_count):
+        kind, maker = makers[index % len(makers)]
+        extent = extents[index % len(extents)]
+        data = maker(rnd.randrange(4 * 1024, 600 * 1024))
+        offset = cursor[extent]
+        if index % 3 == 0:
+            # Straddle the next carving chunk boundary of this partition.
+            chunks = (offset - extent[0]) // disk_forensic.CHUNK_SIZE + 1
+            offset = max(offset, extent[0] + chunks * disk_forensic.CHUNK_SIZE - len(data) // 2)
+        offset = (offset + 511) // 512 * 512
+        if offset + len(data) > extent[1]:
+            continue
+        cursor[extent] = offset + len(data) + rnd.randrange(0, 64 * 1024)
+        placed.append((offset, data, kind))
+        truth.append({'type': kind, 'offset': offset, 'size': len(data),
+                      'md5': hashlib.md5(data).hexdigest()})
+        if kind == 'JPG':
+            # The EXIF thumbnail is a legitimate embedded JPEG as well.
+            thumb = data.find(b'\xff\xd8\xff', 3)
+            end = data.find(b'\xff\xd9', thumb) + 2
+            truth.append({'type': 'JPG', 'offset': offset + thumb, 'size': end - thumb,
+                          'md5': hashlib.md5(data[thumb:end]).hexdigest()})
+
+    placed.sort(key=lambda item: item[0])
+    with open(path, 'wb') as image:
+        position = 0
+        for offset, data, _ in placed + [(size, b'', None)]:
+            while position < offset:
+                gap = min(offset - position, 4 * 1024 * 1024)
+                image.write(rnd.randbytes(gap) if fill == 'random' else bytes(gap))
+                position += gap
+            image.write(data)
+            position += len(data)
+    return {'size': size, 'extents': extents, 'files': truth}
+
+
+def peak_rss_mb():
+    if not RESOURCE_AVAILABLE:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 / scale / 1024
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024 / scale / 1024
+    return round(own, 1), round(children, 1)
+
+
+def _run_carver(image_path, truth, workdir, options, results):
+    """Child process: one carving run, isolated so peak RSS is per configuration."""
+    os.chdir(workdir)
+    scanned = sum(end - start for start, end in truth['extents'])
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        analyzer = disk_forensic.ForensicAnalyzer(image_path, 'bench', os.path.join(workdir, 'out'),
+                                                  **options)
+        start = time.perf_counter()
+        analyzer.analyze_disk()
+        elapsed = time.perf_counter() - start
+
+    conn = sqlite3.connect(analyzer.db_path)
+    rows = conn.execute('SELECT file_type, offset, size, md5 FROM carved_files').fetchall()
+    conn.close()
+
+    expected = {(f['offset'], f['type'], f['md5']) for f in truth['files']}
+    found = {(offset, file_type, md5) for file_type, offset, size, md5 in rows}
+    true_positives = len(expected & found)
+    own_rss, children_rss = peak_rss_mb()
+    results.put({
+        'elapsed_s': round(elapsed, 3),
+        'mb_per_s': round(scanned / (1024 * 1024) / elapsed, 1) if elapsed else None,
+        'files_per_s': round(len(rows) / elapsed, 1) if elapsed else None,
+        'carved': len(rows),
+        'skipped_ratio': round(analyzer.bytes_skipped / analyzer.bytes_scanned, 4)
+                         if analyzer.bytes_scanned else None,
+        'recall': round(true_positives / len(expected), 4) if expected else None,
+        'precision': round(true_positives / len(rows), 4) if rows else None,
+        'peak_rss_mb': own_rss,
+        'peak_worker_rss_mb': children_rss,
+    })
+
+
+def run_carver(image_path, truth, options):
+    workdir = tempfile.mkdtemp(prefix='detectra-bench-')
+    try:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_run_carver,
+                                          args=(image_path, truth, workdir, options, results))
+        process.start()
+        result = results.get()
+        process.join()
+        return result
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_partition_analyzer(image_path, repeat=20):
+    """Time PartitionAnalyzer's FAT parsing and root directory scan."""
+    reader = DiskReader(image_path)
+    reader.open()
+    try:
+        mbr = reader.read(512)
+        window = reader.window(512, reader.disk_to_read)
+        analyzer = PartitionAnalyzer()
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(repeat):
+                data_area = analyzer.get_fat_information(mbr[446:462], window)
+                analyzer.directory_scan(data_area, window)
+        elapsed = time.perf_counter() - start
+    finally:
+        reader.close()
+    return {'scans': repeat, 'ms_per_scan': round(elapsed / repeat * 1000, 2)}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark Detectra carving on a synthetic image.")
+    parser.add_argument('--size', type=int, default=128, help="image size in MB")
+    parser.add_argument('--files', type=int, default=100, help="number of embedded files")
+    parser.add_argument('--partitions', type=int, default=2, choices=range(1, 5))
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--fill', choices=('random', 'zero'), default='random',
+                        help="background between embedded files")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1],
+                        help="worker counts to compare")
+    parser.add_argument('--no-resolvers', action='store_true',
+                        help="also run without structure-aware length resolution")
+    parser.add_argument('--image', help="keep the generated image at this path")
+    parser.add_argument('--json', help="write results to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    tmpdir = tempfile.mkdtemp(prefix='detectra-image-')
+    image_path = args.image or os.path.join(tmpdir, 'synthetic.dd')
+    try:
+        start = time.perf_counter()
+        truth = build_image(image_path, args.size, args.files, args.seed, args.partitions, args.fill)
+        print(f"Built {args.size} MB image with {len(truth['files'])} files "
+              f"in {time.perf_counter() - start:.1f}s: {image_path}")
+
+        configs = [{'workers': workers} for workers in args.workers]
+        if args.no_resolvers:
+            configs += [{'workers': workers, 'resolve_lengths': False} for workers in args.workers]
+
+        results = {'image': {'size_mb': args.size, 'files': len(truth['files']), 'seed': args.seed,
+                             'fill': args.fill, 'partitions': args.partitions},
+                   'carving': [], 'partition_analyzer': None}
+        for options in configs:
+            result = run_carver(image_path, truth, options)
+            result['options'] = options
+            results['carving'].append(result)
+            print(f"{json.dumps(options)}: {result['mb_per_s']} MB/s, {result['files_per_s']} files/s, "
+                  f"recall {result['recall']}, precision {result['precision']}, "
+                  f"skipped {result['skipped_ratio']:.1%} empty, "
+                  f"peak RSS {result['peak_rss_mb']} MB (workers {result['peak_worker_rss_mb']} MB)")
+
+        results['partition_analyzer'] = run_partition_analyzer(image_path)
+        print(f"PartitionAnalyzer: {results['partition_analyzer']['ms_per_scan']} ms per FAT + directory scan")
+
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(results, f, indent=4)
+            print(f"Results written to {args.json}")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""Statistical block classification of evidence images.
+
+Every BLOCK_SIZE block of the image is labelled from its byte histogram:
+
+    zero        one byte value throughout (zeroed or wiped)
+    text        at least TEXT_RATIO printable ASCII / whitespace
+    encrypted   high entropy and a byte distribution indistinguishable from
+                uniform (chi-square over GROUP_BLOCKS neighbouring blocks)
+    compressed  high entropy but measurably non-uniform
+    unknown     anything else (executables, structured binary data, ...)
+
+A single 4 KB block doesn't hold enough samples to tell compression from
+encryption, so the uniformity test pools the histograms of the high-entropy
+blocks in each group. Range-coded formats (xz/LZMA) are statistically
+uniform and land in "encrypted" too.
+
+The labels form a block map file, one byte per block. The carver fills it
+in as a byproduct of carving, classifying each chunk it has already read
+(text signatures are then not carved inside encrypted regions). It also
+gives a quick overview of an image, and can be built offline without
+carving:
+
+    python block_classifier.py build image.dd -o image.blockmap
+    python block_classifier.py summary image.blockmap --runs --min-size 1048576
+"""
+import os
+import re
+import sys
+import math
+import mmap
+import struct
+import argparse
+from collections import Counter
+
+from evidence_reader import DiskReader
+from metrics import ProgressMeter
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("numpy not installed. Block classification will be slow.")
+
+
+BLOCK_SIZE = 4096
+GROUP_BLOCKS = 16  # blocks pooled for the uniformity test
+CLASSIFY_CHUNK = 4 * 1024 * 1024  # bytes classified per step, a multiple of BLOCK_SIZE * GROUP_BLOCKS
+HISTOGRAM_BATCH = 256  # blocks histogrammed at once (bounds the int64 index array)
+
+ZERO, TEXT, COMPRESSED, ENCRYPTED, UNKNOWN = range(5)
+UNSCANNED = 255
+LABELS = {ZERO: 'zero', TEXT: 'text', COMPRESSED: 'compressed', ENCRYPTED: 'encrypted',
+          UNKNOWN: 'unknown', UNSCANNED: 'unscanned'}
+
+TEXT_RATIO = 0.90
+HIGH_ENTROPY = 7.5  # bits per byte; random 4 KB blocks measure about 7.95
+UNIFORM_CHI2 = 330.0  # 255 degrees of freedom, p ~ 0.001
+TEXT_BYTES = bytes(range(0x20, 0x7F)) + b'\t\n\r\f'
+
+# Carver types whose content is text, and the block labels such content never has.
+TEXT_TYPES = ('TXT',)
+NOT_TEXT = (ENCRYPTED,)
+
+BLOCKMAP_MAGIC = b'DTBLKMAP'
+BLOCKMAP_HEADER = struct.Struct('<8sIQQ')  # magic, block size, image size, block count
+BLOCKMAP_HEADER_SIZE = 32
+
+_RUNS = re.compile(rb'(.)\1*', re.DOTALL)
+
+
+def _labels_numpy(data, block_size, lead):
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    full, tail = divmod(len(buffer), block_size)
+    count = full + (1 if tail else 0)
+    counts = np.empty((count, 256), dtype=np.int64)
+    for first in range(0, full, HISTOGRAM_BATCH):
+        batch = min(HISTOGRAM_BATCH, full - first)
+        blocks = buffer[first * block_size:(first + batch) * block_size].reshape(batch, block_size)
+        index = blocks + (np.arange(batch, dtype=np.int64) * 256)[:, None]
+        counts[first:first + batch] = np.bincount(index.ravel(), minlength=batch * 256).reshape(batch, 256)
+    if tail:
+        counts[full] = np.bincount(buffer[full * block_size:], minlength=256)
+
+    lengths = counts.sum(axis=1)
+    p = counts / lengths[:, None]
+    entropy = -(p * np.log2(np.where(p > 0, p, 1.0))).sum(axis=1)
+    text = counts[:, np.frombuffer(TEXT_BYTES, dtype=np.uint8)].sum(axis=1) / lengths
+    high = entropy >= HIGH_ENTROPY
+
+    groups = -(-(lead + count) // GROUP_BLOCKS)
+    pooled = np.zeros((groups * GROUP_BLOCKS, 256), dtype=np.int64)
+    pooled[lead:lead + count] = counts * high[:, None]
+    pooled = pooled.reshape(groups, GROUP_BLOCKS, 256).sum(axis=1)
+    expected = pooled.sum(axis=1) / 256.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chi2 = ((pooled - expected[:, None]) ** 2 / expected[:, None]).sum(axis=1)
+    uniform = np.repeat(chi2 <= UNIFORM_CHI2, GROUP_BLOCKS)[lead:lead + count]
+
+    labels = np.full(count, UNKNOWN, dtype=np.uint8)
+    labels[high & uniform] = ENCRYPTED
+    labels[high & ~uniform] = COMPRESSED
+    labels[text >= TEXT_RATIO] = TEXT
+    labels[counts.max(axis=1) == lengths] = ZERO
+    return labels.tobytes()
+
+
+def _labels_python(data, block_size, lead):
+    text_bytes = set(TEXT_BYTES)
+    histograms = []
+    labels = bytearray()
+    for start in range(0, len(data), block_size):
+        histogram = Counter(bytes(data[start:start + block_size]))
+        length = sum(histogram.values())
+        entropy = -sum(c / length * math.log2(c / length) for c in histogram.values())
+        if len(histogram) == 1:
+            label = ZERO
+        elif sum(c for value, c in histogram.items() if value in text_bytes) >= TEXT_RATIO * length:
+            label = TEXT
+        elif entropy >= HIGH_ENTROPY:
+            label = ENCRYPTED  # settled by the group test below
+        else:
+            label = UNKNOWN
+        labels.append(label)
+        histograms.append(histogram if label == ENCRYPTED else None)
+
+    for first in range(-lead, len(labels), GROUP_BLOCKS):
+        pooled = Counter()
+        for histogram in histograms[max(first, 0):first + GROUP_BLOCKS]:
+            if histogram is not None:
+                pooled.update(histogram)
+        total = sum(pooled.values())
+        if not total:
+            continue
+        expected = total / 256
+        chi2 = sum((pooled.get(value, 0) - expected) ** 2 for value in range(256)) / expected
+        if chi2 > UNIFORM_CHI2:
+            for i in range(max(first, 0), min(first + GROUP_BLOCKS, len(labels))):
+                if labels[i] == ENCRYPTED:
+                    labels[i] = COMPRESSED
+    return bytes(labels)
+
+
+def classify_blocks(data, block_size=BLOCK_SIZE, first_block=0):
+    """One label byte per block of `data` (a trailing partial block is labelled on its own).
+
+    `first_block` is the image block number `data` starts at; the uniformity
+    test pools the image's GROUP_BLOCKS groups, or the part of a group that
+    falls within `data`.
+    """
+    if not len(data):
+        return b''
+    lead = first_block % GROUP_BLOCKS
+    if NUMPY_AVAILABLE:
+        return _labels_numpy(data, block_size, lead)
+    return _labels_python(data, block_size, lead)
+
+
+def create_block_map(path, image_size, block_size=BLOCK_SIZE):
+    """Write an all-unscanned block map for an image of `image_size` bytes."""
+    count = -(-image_size // block_size)
+    with open(path, 'wb') as output:
+        output.write(BLOCKMAP_HEADER.pack(BLOCKMAP_MAGIC, block_size, image_size, count)
+                     .ljust(BLOCKMAP_HEADER_SIZE, b'\0'))
+        for start in range(0, count, CLASSIFY_CHUNK):
+            output.write(bytes([UNSCANNED]) * min(CLASSIFY_CHUNK, count - start))
+    return count
+
+
+def build_block_map(reader, path, block_size=BLOCK_SIZE, chunk_size=CLASSIFY_CHUNK, progress=None):
+    """Classify the whole image behind `reader` into a block map file at `path`.
+
+    Offline counterpart of the classification done while carving. Empty
+    regions (sparse holes, constant fill) are labelled zero without being
+    histogrammed. `progress` is called with the bytes done after each step.
+    The file is written next to `path` and renamed into place.
+    """
+    size = reader.size
+    partial_path = f"{path}.part"
+    count = create_block_map(partial_path, size, block_size)
+    block_map = BlockMap(partial_path, writable=True)
+    try:
+        offset = 0
+        while offset < size:
+            run = reader.empty_run(offset, size) // block_size * block_size
+            if run:
+                block_map.mark_empty(offset, run)
+                step = run
+            else:
+                chunk = reader.view(offset, min(chunk_size, size - offset))
+                if not chunk:
+                    break
+                block_map.classify(chunk, offset)
+                step = len(chunk)
+            offset += step
+            if progress:
+                progress(step)
+    finally:
+        block_map.close()
+    os.replace(partial_path, path)
+    return count
+
+
+class BlockMap:
+    """Memory-mapped block map file.
+
+    Opened `writable`, classify() and mark_empty() store the labels of the
+    chunks a carve loop reads. Blocks cut by a chunk boundary are completed
+    from the next chunk when it follows on directly, and a block cut at the
+    start of a carved range stays unscanned. Shard workers open the same
+    file and write the labels of their own byte ranges.
+    """
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.handle = open(path, 'r+b' if writable else 'rb')
+        self.map = mmap.mmap(self.handle.fileno(), 0,
+                             access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, self.block_size, self.image_size, self.count = BLOCKMAP_HEADER.unpack_from(self.map, 0)
+        if magic != BLOCKMAP_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a block map")
+        self.carry = b''  # start of a block cut by the end of the last chunk
+        self.carry_end = None
+
+    def label(self, offset):
+        """Label of the block holding image `offset`."""
+        block = offset // self.block_size
+        if block >= self.count:
+            return UNSCANNED
+        return self.map[BLOCKMAP_HEADER_SIZE + block]
+
+    def classify(self, chunk, offset):
+        """Label the blocks of `chunk`, which starts at image `offset`."""
+        size = self.block_size
+        if self.carry and self.carry_end == offset:
+            need = size - len(self.carry)
+            head = bytes(chunk[:need])
+            if len(head) < need and offset + len(head) < self.image_size:
+                self.carry += head
+                self.carry_end += len(head)
+                return
+            start = offset - len(self.carry)
+            self._store(start, classify_blocks(self.carry + head, size, start // size))
+            chunk = chunk[len(head):]
+            offset += len(head)
+        self.carry = b''
+        self.carry_end = None
+        end = offset + len(chunk)
+        first = -(-offset // size) * size
+        if first >= end:
+            return
+        last = end if end >= self.image_size else end // size * size
+        if last > first:
+            self._store(first, classify_blocks(chunk[first - offset:last - offset], size, first // size))
+        if last < end:
+            self.carry = bytes(chunk[last - offset:])
+            self.carry_end = end
+
+    def mark_empty(self, offset, length):
+        """Label the blocks inside an empty (skipped) region as zero."""
+        first = -(-offset // self.block_size)
+        last = (offset + length) // self.block_size
+        if offset + length >= self.image_size:
+            last = self.count
+        if last > first:
+            self._store(first * self.block_size, bytes([ZERO]) * (last - first))
+        self.carry = b''
+        self.carry_end = None
+
+    def _store(self, offset, labels):
+        block = offset // self.block_size
+        labels = labels[:max(0, self.count - block)]
+        self.map[BLOCKMAP_HEADER_SIZE + block:BLOCKMAP_HEADER_SIZE + block + len(labels)] = labels
+
+    def summary(self):
+        """Bytes of the image per label name."""
+        labels = self.map[BLOCKMAP_HEADER_SIZE:BLOCKMAP_HEADER_SIZE + self.count]
+        sizes = {name: labels.count(bytes([label])) * self.block_size for label, name in LABELS.items()}
+        return {name: size for name, size in sizes.items() if size}
+
+    def runs(self, min_size=0, label=None):
+        """Yield (start, end, label name) for runs of equally labelled blocks."""
+        labels = self.map[BLOCKMAP_HEADER_SIZE:BLOCKMAP_HEADER_SIZE + self.count]
+        for match in _RUNS.finditer(labels):
+            value = match.group()[0]
+            if label is not None and value != label:
+                continue
+            start = match.start() * self.block_size
+            end = min(match.end() * self.block_size, self.image_size)
+            if end - start >= min_size:
+                yield start, end, LABELS.get(value, 'invalid')
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.handle.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Classify image blocks by content statistics.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="classify an evidence image into a block map")
+    build.add_argument('evidence')
+    build.add_argument('-o', '--output', required=True)
+    summary = commands.add_parser('summary', help="show what a block map holds")
+    summary.add_argument('block_map')
+    summary.add_argument('--runs', action='store_true', help="list runs of equally labelled blocks")
+    summary.add_argument('--min-size', type=int, default=1024 * 1024, help="smallest run listed, in bytes")
+    summary.add_argument('--label', choices=sorted(LABELS.values()), default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        reader = DiskReader(args.evidence)
+        if not reader.open():
+            return 1
+        try:
+            meter = ProgressMeter(reader.size)
+            count = build_block_map(reader, args.output, progress=meter.advance)
+            print(meter.line())
+        finally:
+            reader.close()
+        print(f"Wrote {count} block labels to {args.output}")
+        return 0
+
+    block_map = BlockMap(args.block_map)
+    try:
+        for name, size in block_map.summary().items():
+            print(f"{name}: {size} bytes ({size / max(block_map.image_size, 1):.1%})")
+        if args.runs:
+            label = {name: value for value, name in LABELS.items()}.get(args.label)
+            for start, end, name in block_map.runs(args.min_size, label):
+                print(f"{start}-{end}\t{end - start}\t{name}")
+    finally:
+        block_map.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
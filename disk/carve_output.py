@@ -0,0 +1,337 @@
+import os
+import time
+import hashlib
+import itertools
+from threading import Thread, Lock
+from queue import Queue
+
+from metrics import Metrics
+from artifact_store import COLLISION_DIGITS
+
+
+HASH_ALGORITHMS = ('md5', 'sha1', 'sha256')
+
+_STOP = object()
+
+
+class CarvedOutput:
+    """One carved file travelling through the output pipeline."""
+    def __init__(self, output_id, file_type, offset, partial_path, fragments=None):
+        self.id = output_id
+        self.file_type = file_type
+        self.offset = offset
+        self.fragments = fragments  # (offset, length) extents of a reassembled file
+        self.resolved = False  # carved to the full length a length resolver found
+        self.partial_path = partial_path
+        self.handle = None
+        self.stream = None  # evidence_pack.PackStream of a large packed file
+        self.buffer = bytearray()
+        self.hashers = None
+        self.size = 0
+        self.failed = False
+
+
+class OutputPipeline:
+    """Background stage that writes carved bytes to disk and hashes them on the way.
+
+    The carving thread only enqueues (output, data) items; worker threads open
+    the partial file, write each slice and update MD5/SHA-1/SHA-256
+    incrementally, then rename the file to {md5}.{ext} and hand the result to
+    `on_complete`. Every file is pinned to one worker so its writes stay in
+    order. Queues are bounded (`max_pending` items per worker), so a slow disk
+    applies backpressure to carving instead of growing memory.
+
+    A `scanner` (yara_stage.FileScanner) is run on every newly stored file
+    once its bytes are complete; its matches travel in the record as 'yara'.
+
+    A `hash_filter` (hashset.HashFilter) is asked about every finished file
+    before it is stored: known-good files are discarded and reported with
+    blob and path None, known-bad ones are stored as usual. The verdict
+    travels in the record as 'known'.
+
+    With a `pack` (evidence_pack.EvidencePack), stored files are appended
+    to its segment files instead of being written one file each; the
+    record's 'pack' holds the location and 'path' a printable form of it.
+    Files larger than `buffer_limit` are streamed straight into a segment
+    reserved for them and truncated away again if they turn out to be
+    duplicates or known-good, so they never go through a partial file.
+
+    Hashing, writing and file scanning times are summed over the worker
+    threads into `metrics` ('hash', 'write', 'yara_files'), along with the
+    bytes and files written.
+
+    With a DedupIndex, files are content-addressed: files up to `buffer_limit`
+    bytes are kept in memory until their hash is known and are never written
+    if the blob already exists; larger ones spill to a partial file that is
+    dropped when it turns out to be a duplicate.
+
+    Data slices are written as given (usually memoryviews over the evidence),
+    so the pipeline must be closed before the evidence reader is.
+    """
+    def __init__(self, output_path, on_complete, workers=2, max_pending=64,
+                 algorithms=HASH_ALGORITHMS, dedup=None, buffer_limit=256 * 1024, scanner=None,
+                 hash_filter=None, pack=None, metrics=None):
+        self.output_path = output_path
+        self.dedup = dedup
+        self.scanner = scanner
+        self.hash_filter = hash_filter
+        self.pack = pack
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.buffer_limit = buffer_limit if dedup is not None or pack is not None else 0
+        self.partial_dir = os.path.join(output_path, '.partial')
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.on_complete = on_complete
+        self.algorithms = algorithms
+        # Longest blob name stem: the digest, plus a collision suffix when deduplicating.
+        self.digest_length = hashlib.new(algorithms[0]).digest_size * 2
+        if dedup is not None:
+            self.digest_length += 1 + COLLISION_DIGITS
+        self.ids = itertools.count()
+        self.lock = Lock()
+        self.pending = {}  # output id -> offset, for carves not yet reported
+        self.bytes_written = 0
+        self.files_written = 0
+        self.duplicates = 0
+        self.bytes_deduplicated = 0
+        self.known_good = 0
+        self.known_bad = 0
+        self.queues = [Queue(maxsize=max_pending) for _ in range(max(1, workers))]
+        self.threads = [
+            Thread(target=self._run, args=(queue,), name=f"carve-output-{i}", daemon=True)
+            for i, queue in enumerate(self.queues)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def open(self, file_type, offset, fragments=None):
+        output_id = next(self.ids)
+        partial_path = os.path.join(self.partial_dir, f"{offset}.{file_type.lower()}.part")
+        with self.lock:
+            self.pending[output_id] = offset
+        return CarvedOutput(output_id, file_type, offset, partial_path, fragments)
+
+    def write(self, output, data):
+        self._queue(output).put(('write', output, data))
+
+    def complete(self, output):
+        self._queue(output).put(('complete', output, None))
+
+    def abort(self, output):
+        self._queue(output).put(('abort', output, None))
+
+    def min_pending_offset(self):
+        """Lowest offset whose carve hasn't been reported yet, or None."""
+        with self.lock:
+            return min(self.pending.values(), default=None)
+
+    def drain(self):
+        """Block until everything queued so far has been written and reported."""
+        for queue in self.queues:
+            queue.join()
+
+    def close(self):
+        """Wait for all queued work to finish and stop the workers."""
+        for queue in self.queues:
+            queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+        try:
+            os.rmdir(self.partial_dir)
+        except OSError:
+            pass
+
+    def _queue(self, output):
+        return self.queues[output.id % len(self.queues)]
+
+    def _run(self, queue):
+        while True:
+            item = queue.get()
+            if item is _STOP:
+                queue.task_done()
+                return
+            action, output, data = item
+            try:
+                if action == 'write':
+                    self._write(output, data)
+                elif action == 'complete':
+                    self._complete(output)
+                else:
+                    self._discard(output)
+            except Exception as e:
+                print(f"Error writing carved file at offset {output.offset}: {e}")
+                output.failed = True
+                self._discard(output)
+            finally:
+                if action != 'write':
+                    with self.lock:
+                        self.pending.pop(output.id, None)
+                queue.task_done()
+
+    def _write(self, output, data):
+        if output.failed:
+            return
+        if output.hashers is None:
+            output.hashers = [hashlib.new(name) for name in self.algorithms]
+        started = time.perf_counter()
+        for hasher in output.hashers:
+            hasher.update(data)
+        self.metrics.add_time('hash', time.perf_counter() - started)
+        output.size += len(data)
+
+        if output.handle is None and output.stream is None and output.size <= self.buffer_limit:
+            output.buffer += data
+            return
+        with self.metrics.stage('write'):
+            if output.stream is None and self.pack is not None:
+                output.stream = self.pack.stream(self.digest_length + 1 + len(output.file_type))
+                output.stream.write(output.buffer)
+                output.buffer = bytearray()
+            if output.stream is not None:
+                output.stream.write(data)
+                return
+            if output.handle is None:
+                # Another process sharing the output directory may have removed it on close.
+                os.makedirs(self.partial_dir, exist_ok=True)
+                output.handle = open(output.partial_path, 'wb')
+                output.handle.write(output.buffer)
+                output.buffer = bytearray()
+            output.handle.write(data)
+
+    def _complete(self, output):
+        if output.failed:
+            return
+        if output.hashers is None:
+            self._write(output, b'')
+        hashes = {name: hasher.hexdigest() for name, hasher in zip(self.algorithms, output.hashers)}
+        blob = f"{hashes[self.algorithms[0]]}.{output.file_type.lower()}"
+
+        known = self.hash_filter.check(hashes) if self.hash_filter else None
+        if known == 'good':
+            self._discard(output)
+            with self.lock:
+                self.known_good += 1
+            self.metrics.count('known_good')
+            self.on_complete({
+                'file_type': output.file_type,
+                'offset': output.offset,
+                'size': output.size,
+                'hashes': hashes,
+                'blob': None,
+                'path': None,
+                'duplicate': False,
+                'fragments': output.fragments,
+                'resolved': output.resolved,
+                'yara': [],
+                'known': known,
+            })
+            return
+        if known == 'bad':
+            with self.lock:
+                self.known_bad += 1
+            self.metrics.count('known_bad')
+
+        duplicate = False
+        if self.dedup is not None:
+            blob, duplicate = self.dedup.claim(hashes['sha256'], blob)
+        matches = []
+        pack = None
+        if duplicate:
+            self._discard(output)
+            if self.pack is not None:
+                pack = self.dedup.location(blob)
+            with self.lock:
+                self.duplicates += 1
+                self.bytes_deduplicated += output.size
+        elif self.pack is not None:
+            if output.stream is None:
+                matches = self._scan(data=output.buffer)
+                with self.metrics.stage('write'):
+                    pack = self.pack.append(blob, data=output.buffer)
+                if self.dedup is not None:
+                    self.dedup.place(blob, pack)
+            else:
+                with self.metrics.stage('write'):
+                    pack = output.stream.commit(blob)
+                output.stream = None
+                if self.dedup is not None:
+                    self.dedup.place(blob, pack)
+                if self.scanner is not None:
+                    matches = self._scan(data=self.pack.read(pack))
+        elif output.handle is None:
+            with self.metrics.stage('write'):
+                blob = self._store(blob, hashes, data=output.buffer)
+            matches = self._scan(data=output.buffer)
+        else:
+            with self.metrics.stage('write'):
+                output.handle.close()
+                blob = self._store(blob, hashes, partial_path=output.partial_path)
+            matches = self._scan(path=os.path.join(self.output_path, blob))
+        output.buffer = bytearray()
+
+        if not duplicate:
+            with self.lock:
+                self.bytes_written += output.size
+                self.files_written += 1
+            self.metrics.count('files_written')
+            self.metrics.count('bytes_written', output.size)
+        else:
+            self.metrics.count('duplicates')
+        if pack:
+            path = self.pack.location(pack)
+        elif self.pack is None:
+            path = os.path.join(self.output_path, blob)
+        else:
+            path = None  # a duplicate of a blob another thread is still packing
+        self.on_complete({
+            'file_type': output.file_type,
+            'offset': output.offset,
+            'size': output.size,
+            'hashes': hashes,
+            'blob': blob,
+            'path': path,
+            'duplicate': duplicate,
+            'fragments': output.fragments,
+            'resolved': output.resolved,
+            'yara': matches,
+            'known': known,
+            'pack': pack,
+        })
+
+    def _store(self, blob, hashes, data=None, partial_path=None):
+        """Write a loose blob from `data` or move it from `partial_path`; returns its name.
+
+        With a DedupIndex an existing file is never replaced: its MD5 name may
+        hold different content stored by another worker, so the blob takes its
+        collision name instead.
+        """
+        path = os.path.join(self.output_path, blob)
+        if self.dedup is not None:
+            try:
+                open(path, 'xb').close()
+            except FileExistsError:
+                blob = self.dedup.rename(hashes['sha256'])
+                path = os.path.join(self.output_path, blob)
+        if partial_path is None:
+            with open(path, 'wb') as carved_file:
+                carved_file.write(data)
+        else:
+            os.replace(partial_path, path)
+        return blob
+
+    def _scan(self, data=None, path=None):
+        if self.scanner is None:
+            return []
+        with self.metrics.stage('yara_files'):
+            return self.scanner(data=data, path=path)
+
+    def _discard(self, output):
+        output.buffer = bytearray()
+        if output.stream is not None:
+            stream, output.stream = output.stream, None
+            stream.discard()
+        if output.handle is not None:
+            output.handle.close()
+            try:
+                os.remove(output.partial_path)
+            except OSError:
+                pass
@@ -1,52 +1,13 @@
 import sys
-import os
 
-try:
-    import pyewf
-    PYEWF_AVAILABLE = True
-except ImportError:
-    PYEWF_AVAILABLE = False
-    print("pyewf not installed. E01 support disabled.")
-
-class DiskReader:
-    def __init__(self, filename, disk_to_read=500000000):
-        self.filename = filename
-        self.disk_to_read = disk_to_read
-        self.handle = None
-        self.file_type = self._detect_file_type()
-        
-    def _detect_file_type(self):
-        ext = os.path.splitext(self.filename)[1].lower()
-        if ext == '.e01' and PYEWF_AVAILABLE:
-            return 'E01'
-        return 'RAW'
-    
-    def open(self):
-        try:
-            if self.file_type == 'E01' and PYEWF_AVAILABLE:
-                filenames = pyewf.glob(self.filename)
-                self.handle = pyewf.handle()
-                self.handle.open(filenames)
-            else:
-                self.handle = open(self.filename, 'rb')
-            return True
-        except Exception as e:
-            print(f"Error opening file: {str(e)}")
-            return False
-    
-    def read(self, size):
-        try:
-            return self.handle.read(size)
-        except Exception as e:
-            print(f"Error reading file: {str(e)}")
-            return None
-    
-    def close(self):
-        if self.handle:
-            self.handle.close()
+from evidence_reader import DiskReader
+from volumes import Volume, discover_volumes, fat_geometry, ntfs_geometry
+from fat_walker import FatWalker
+from ntfs_mft import MftParser, iter_mft
 
 class PartitionAnalyzer:
-    def __init__(self):
+    def __init__(self, workers=1):
+        self.workers = workers  # processes parsing an NTFS $MFT in walk_directory_tree
         self.part_codes = {
             0x00: "Empty",
             0x01: "12-bit FAT",
@@ -60,24 +21,24 @@ class PartitionAnalyzer:
         }
     
     def get_sector(self, part):
+        if isinstance(part, Volume):
+            return part.start_sector
         try:
-            big_endian = part[8:12]
-            big_endian.reverse()
-            hexed = ''.join(format(x, '02x') for x in big_endian)
-            return int(hexed, 16)
+            return int.from_bytes(bytes(part[8:12]), 'little')
         except Exception:
             return 0
     
     def get_part_size(self, part):
+        if isinstance(part, Volume):
+            return part.size_sectors
         try:
-            big_endian = part[12:16]
-            big_endian.reverse()
-            hexed = ''.join(format(x, '02x') for x in big_endian)
-            return int(hexed, 16)
+            return int.from_bytes(bytes(part[12:16]), 'little')
         except Exception:
             return 0
     
     def get_part_code(self, part):
+        if isinstance(part, Volume):
+            return part.filesystem or part.type_name
         try:
             code = part[4]
             return self.part_codes.get(code, f"Unknown ({hex(code)})")
@@ -85,6 +46,8 @@ class PartitionAnalyzer:
             return "Invalid"
     
     def print_info(self, part):
+        if isinstance(part, Volume):
+            print(f"Scheme: {part.scheme}" + (f" ({part.name})" if part.name else ""))
         print(f"Start Sector: {self.get_sector(part)}")
         print(f"Partition Size: {self.get_part_size(part)}")
         print(f"Partition Type: {self.get_part_code(part)}\n")
@@ -132,13 +95,9 @@ class PartitionAnalyzer:
                 print("Insufficient disk data read")
                 return None
             
-            reserved_area = disk_data[volume + 14:volume + 16]
-            reserved_area.reverse()
-            reserved_area = int(''.join(format(x, '02x') for x in reserved_area), 16)
+            reserved_area = int.from_bytes(bytes(disk_data[volume + 14:volume + 16]), 'little')
             
-            fat_area = disk_data[volume + 22:volume + 24]
-            fat_area.reverse()
-            fat_area = int(''.join(format(x, '02x') for x in fat_area), 16)
+            fat_area = int.from_bytes(bytes(disk_data[volume + 22:volume + 24]), 'little')
             
             fat_copies = disk_data[volume + 16]
             per_cluster = disk_data[volume + 13]
@@ -192,16 +151,12 @@ class PartitionAnalyzer:
                 if directory[0] == 229:  # Deleted file
                     try:
                         print("   Deleted File Information")
-                        deleted_info = directory[26:28]
-                        deleted_info.reverse()
-                        deleted_info = int(''.join(format(x, '02x') for x in deleted_info), 16)
+                        deleted_info = int.from_bytes(bytes(directory[26:28]), 'little')
                         print(f"   Starting Cluster: {deleted_info}")
                         deleted_info = (deleted_info - 2) * 8 + 599
                         print(f"   Starting Sector: {deleted_info}")
                         
-                        deleted_size = directory[28:32]
-                        deleted_size.reverse()
-                        deleted_size = int(''.join(format(x, '02x') for x in deleted_size), 16)
+                        deleted_size = int.from_bytes(bytes(directory[28:32]), 'little')
                         print(f"   Size of file: {deleted_size} bytes")
                         
                         if deleted_info * 512 - 496 < len(disk_data):
@@ -215,38 +170,80 @@ class PartitionAnalyzer:
         except Exception as e:
             print(f"Error scanning directory: {str(e)}")
 
+    def walk_directory_tree(self, disk_reader, part):
+        """Yield a record for every file and directory of a FAT or NTFS volume, deleted ones included.
+
+        NTFS records come straight from the $MFT, so they carry the parent
+        record number instead of a full path; with more than one worker the
+        $MFT is parsed in segments by a process pool (iter_mft).
+        """
+        if not isinstance(part, Volume):
+            part = Volume(0, 'MBR', part[4], self.get_part_code(part),
+                          self.get_sector(part) * 512, self.get_part_size(part) * 512)
+        geometry = fat_geometry(disk_reader, part)
+        if geometry is not None:
+            yield from FatWalker(disk_reader, geometry).walk()
+            return
+        geometry = ntfs_geometry(disk_reader, part)
+        if geometry is None:
+            print("Unsupported filesystem")
+            return
+        if self.workers > 1:
+            records = iter_mft(disk_reader.filename, part, workers=self.workers)
+        else:
+            records = MftParser(disk_reader, geometry).records()
+        for record in records:
+            if record['base_record'] or record['name'] is None:
+                continue  # extension records carry no name of their own
+            record['path'] = f"[{record['parent_record']}]/{record['name']}"
+            yield record
+
+    def print_entry(self, record):
+        kind = "DIR " if record['is_directory'] else "FILE"
+        state = " (deleted)" if record['deleted'] else ""
+        print(f"{kind} {record['path']}{state}")
+        location = (f"Starting Cluster: {record['first_cluster']}" if 'first_cluster' in record
+                    else f"MFT Record: {record['record_number']}")
+        print(f"   Size: {record['size']} bytes, {location}, Modified: {record['modified']}")
+
 def main():
     if len(sys.argv) > 1:
         file = sys.argv[1]
     else:
         file = r"C:\Users\kavin_1xozkcy\Projects\detectra\data\charlie-2009-11-12.E01"
     
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else 1
+
     disk_reader = DiskReader(file)
-    analyzer = PartitionAnalyzer()
+    analyzer = PartitionAnalyzer(workers=max(workers, 1))
     
     if not disk_reader.open():
         sys.exit(1)
     
-    mbr = list(disk_reader.read(512))
+    mbr = disk_reader.read(512)
     if not mbr:
         print("Error reading MBR")
         disk_reader.close()
         sys.exit(1)
     
-    partitions = {
-        1: mbr[446:462],
-        2: mbr[462:478],
-        3: mbr[478:494],
-        4: mbr[494:510]
-    }
+    volume_map = discover_volumes(disk_reader)
+    for error in volume_map.errors:
+        print(f"Warning: {error}")
+    if volume_map.scheme:
+        partitions = dict(enumerate(volume_map.volumes, 1))
+    else:
+        print("No partition table found")
+        partitions = {}
     
-    more_disk = list(disk_reader.read(disk_reader.disk_to_read))
-    disk_reader.close()
+    # Zero-copy window over the image (starting right after the MBR, as the
+    # offsets below expect) instead of materializing it in memory.
+    more_disk = disk_reader.window(512, disk_reader.disk_to_read)
     
     options = {
         1: "List Partitions",
         2: "Show Partitions Information",
-        3: "Exit"
+        3: "Exit",
+        4: "Walk Directory Tree"
     }
     
     for x in options:
@@ -254,7 +251,7 @@ def main():
     
     while True:
         try:
-            choice = input("Choose the option 1-3: ")
+            choice = input(f"Choose the option 1-{len(options)}: ")
             
             if choice == "1":
                 for p in partitions:
@@ -262,11 +259,11 @@ def main():
                     analyzer.print_info(partitions[p])
             
             elif choice == "2":
-                print("Choose the partition 1-4:")
+                print(f"Choose the partition 1-{len(partitions)}:")
                 for p in partitions:
                     print(f"Partition {p}")
                 
-                part_select = int(input("Choose the partition 1-4: "))
+                part_select = int(input(f"Choose the partition 1-{len(partitions)}: "))
                 if part_select in partitions:
                     data_area = analyzer.get_fat_information(partitions[part_select], more_disk)
                     analyzer.directory_scan(data_area, more_disk)
@@ -276,6 +273,17 @@ def main():
             elif choice == "3":
                 break
             
+            elif choice == "4":
+                part_select = int(input(f"Choose the partition 1-{len(partitions)}: "))
+                if part_select in partitions:
+                    entries = 0
+                    for record in analyzer.walk_directory_tree(disk_reader, partitions[part_select]):
+                        analyzer.print_entry(record)
+                        entries += 1
+                    print(f"{entries} directory entries")
+                else:
+                    print("Invalid partition selection")
+            
             else:
                 print("Please select a valid option")
                 
@@ -283,5 +291,7 @@ def main():
             print(f"Error: {str(e)}")
             continue
 
+    disk_reader.close()
+
 if __name__ == "__main__":
     main()
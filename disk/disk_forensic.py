@@ -1,38 +1,42 @@
-import sys
 import os
-import hashlib
 import datetime
+import time
 import sqlite3
-from pathlib import Path
-import struct
-import logging
-from threading import Thread
-from queue import Queue
-import json
-
-
-try:
-    import magic
-    MAGIC_AVAILABLE = True
-except ImportError:
-    MAGIC_AVAILABLE = False
-    print("python-magic not installed. File type detection will be limited.")
-try:
-    import yara
-    YARA_AVAILABLE = True
-except ImportError:
-    YARA_AVAILABLE = False
-    print("yara-python not installed. Pattern matching will be disabled.")
-try:
-    import pyewf
-    PYEWF_AVAILABLE = True
-except ImportError:
-    PYEWF_AVAILABLE = False
-    print("pyewf not installed. E01 support disabled.")
+import re
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+
+from evidence_reader import POOL_CONTEXT, DiskReader
+from artifact_store import ArtifactWriter, DedupIndex
+from carve_output import OutputPipeline
+from length_resolvers import INVALID, resolve_length
+from volumes import discover_volumes
+from allocation import unallocated_extents
+from reassembly import REASSEMBLERS, FRAGMENT_BLOCK, FRAGMENT_GAP, find_fragments, reassemble_batch
+from yara_stage import YARA_AVAILABLE, StreamScanner, FileScanner, compile_rules, load_rules
+from type_validation import MAGIC_AVAILABLE, MAGIC_WORKERS, TypeValidator
+from hashset import HashFilter
+from report_writer import REPORT_FORMATS, ReportWriter, ensure_indexes
+from evidence_pack import PACK_SEGMENT_SIZE, CREATE_PACK_INDEX, CREATE_PACK_MD5_INDEX, EvidencePack
+from metrics import PROGRESS_INTERVAL, Metrics, ProgressMeter, ChunkProfiler
+from block_classifier import TEXT_TYPES, NOT_TEXT, BlockMap, create_block_map
+
+
+CHUNK_SIZE = 1024 * 1024  # 1 MB
+SHARD_SIZE = 256 * 1024 * 1024  # byte range handed to one worker in parallel mode
+SHARD_OVERLAP = 64 * 1024  # lookahead past a shard end for boundary-straddling headers
+SHARD_RETRIES = 1  # resubmissions of a shard whose worker raised
+CHECKPOINT_INTERVAL = 64 * 1024 * 1024  # bytes carved between progress checkpoints
+CACHE_SIZE = 64 * 1024 * 1024  # E01 decompressed-block cache budget per reader
+REASSEMBLY_BATCH = 64  # fragmentation candidates checked per worker task
+YARA_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'detectra', 'yara')  # compiled rules by digest
 
 
 class FileSignatures:
-    """File signature definitions for file carving."""
+    """File signature definitions for file carving.
+
+    Types that share a header carry 'markers': byte strings that must appear
+    shortly after the header for the hit to be classified as that type.
+    """
     def __init__(self):
         self.signatures = [
             # JPEG Image
@@ -82,6 +86,7 @@ class FileSignatures:
                 'type': 'XLS',
                 'header': bytes([0xD0, 0xCF, 0x11, 0xE0, 0xA1, 0xB1, 0x1A, 0xE1]),
                 'footer': None,
+                'markers': ['Workbook'.encode('utf-16-le'), 'Book'.encode('utf-16-le')],
                 'max_size': 10000000
             },
             # Microsoft Excel (XLSX)
@@ -89,6 +94,7 @@ class FileSignatures:
                 'type': 'XLSX',
                 'header': bytes([0x50, 0x4B, 0x03, 0x04]),
                 'footer': bytes([0x50, 0x4B, 0x05, 0x06]),
+                'markers': [b'xl/'],
                 'max_size': 50000000
             },
             # Microsoft PowerPoint (PPT)
@@ -96,6 +102,7 @@ class FileSignatures:
                 'type': 'PPT',
                 'header': bytes([0xD0, 0xCF, 0x11, 0xE0, 0xA1, 0xB1, 0x1A, 0xE1]),
                 'footer': None,
+                'markers': ['PowerPoint Document'.encode('utf-16-le')],
                 'max_size': 10000000
             },
             # Microsoft PowerPoint (PPTX)
@@ -103,6 +110,7 @@ class FileSignatures:
                 'type': 'PPTX',
                 'header': bytes([0x50, 0x4B, 0x03, 0x04]),
                 'footer': bytes([0x50, 0x4B, 0x05, 0x06]),
+                'markers': [b'ppt/'],
                 'max_size': 50000000
             },
             # WordPerfect
@@ -125,52 +133,573 @@ class FileSignatures:
         return self.signatures
 
 
-class DiskReader:
-    def __init__(self, filename, disk_to_read=500000000):
-        self.filename = filename
-        self.disk_to_read = disk_to_read
-        self.handle = None
-        self.file_type = self._detect_file_type()
-        
-    def _detect_file_type(self):
-        ext = os.path.splitext(self.filename)[1].lower()
-        if ext == '.e01' and PYEWF_AVAILABLE:
-            return 'E01'
-        return 'RAW'
-    
-    def open(self):
-        try:
-            if self.file_type == 'E01' and PYEWF_AVAILABLE:
-                filenames = pyewf.glob(self.filename)
-                self.handle = pyewf.handle()
-                self.handle.open(filenames)
+class SignatureMatcher:
+    """Finds every signature hit in a chunk with one scan per distinct header.
+
+    Signatures are grouped by header: identical headers (ZIP/XLSX/PPTX) and
+    headers that extend a shorter one (DOC vs. XLS/PPT) share a single root
+    pattern. Each root is located once with a compiled literal search, hits
+    are merged in offset order and the concrete type is resolved afterwards
+    from the longer headers and the optional 'markers' of each signature.
+    Patterns are compiled so searches run directly on memoryviews of the
+    evidence without copying.
+    """
+    def __init__(self, signatures, marker_window=65536):
+        self.marker_window = marker_window
+        self.roots = []
+        for sig in sorted(signatures, key=lambda s: len(s['header'])):
+            for root in self.roots:
+                if sig['header'].startswith(root['header']):
+                    root['group'].append(sig)
+                    break
             else:
-                self.handle = open(self.filename, 'rb')
-            return True
-        except Exception as e:
-            print(f"Error opening file: {str(e)}")
-            return False
-    
-    def read(self, size):
+                self.roots.append({
+                    'header': sig['header'],
+                    'pattern': re.compile(re.escape(sig['header'])),
+                    'group': [sig]
+                })
+
+        # Longest header first so the most specific candidate wins a tie.
+        for root in self.roots:
+            root['group'].sort(key=lambda s: len(s['header']), reverse=True)
+
+        # First-byte dispatch table, used to resolve hits found by other means
+        # (e.g. across chunk boundaries) without rescanning for every root.
+        self.dispatch = {}
+        for root in self.roots:
+            self.dispatch.setdefault(root['header'][0], []).append(root)
+
+        self.marker_patterns = {
+            sig['type']: re.compile(b'|'.join(re.escape(m) for m in sig['markers']))
+            for sig in signatures if sig.get('markers')
+        }
+        self.footer_patterns = {
+            sig['type']: re.compile(re.escape(sig['footer']))
+            for sig in signatures if sig['footer']
+        }
+
+        self.max_header_len = max(len(sig['header']) for sig in signatures)
+
+    def find_hits(self, chunk, start=0, end=None):
+        """Return (position, root) pairs for all header hits, in offset order."""
+        if end is None:
+            end = len(chunk)
+        hits = []
+        for root in self.roots:
+            pattern = root['pattern']
+            match = pattern.search(chunk, start, end)
+            while match:
+                hits.append((match.start(), root))
+                match = pattern.search(chunk, match.start() + 1, end)
+        hits.sort(key=lambda hit: hit[0])
+        return hits
+
+    def match_at(self, data, pos):
+        """Return the root whose header starts at data[pos], if any."""
+        for root in self.dispatch.get(data[pos], ()):
+            header = root['header']
+            if data[pos:pos + len(header)] == header:
+                return root
+        return None
+
+    def resolve(self, root, data, pos):
+        """Pick the concrete signature for a root hit at data[pos]."""
+        group = root['group']
+        if len(group) == 1:
+            return group[0]
+
+        candidates = [
+            sig for sig in group
+            if data[pos:pos + len(sig['header'])] == sig['header']
+        ]
+        for sig in candidates:
+            pattern = self.marker_patterns.get(sig['type'])
+            if pattern and pattern.search(data, pos, pos + self.marker_window):
+                return sig
+
+        # No marker matched: fall back to the most specific generic type.
+        for sig in candidates:
+            if not sig.get('markers'):
+                return sig
+        return None
+
+
+class CarveState:
+    """An open carve whose bytes are streamed to the output pipeline."""
+    def __init__(self, sig, offset, output, footer_pattern=None):
+        self.sig = sig
+        self.offset = offset
+        self.output = output
+        self.footer = sig['footer']
+        self.footer_pattern = footer_pattern
+        self.limit = sig['max_size'] + (len(self.footer) if self.footer else 0)
+        self.resolved = False  # limit is the length found by a length resolver
+        self.size = 0
+        self.carry = b''  # tail of the last write, for footers split across chunks
+
+
+class StreamingCarver:
+    """Carves files from a stream of chunks, keeping open files across chunk boundaries.
+
+    Only the current chunk and a lookback of a few bytes (headers and footers
+    split across two chunks) are held in memory; carved bytes are handed to
+    the output pipeline as they are read until the footer or 'max_size' is
+    reached, and the pipeline writes and hashes them in the background.
+
+    Given a random-access `reader`, each hit first goes through the
+    structure-aware length resolvers; when the true size is known the carve
+    copies exactly that many bytes and skips footer scanning altogether,
+    and a hit whose structure the resolver rejects is dropped; footers are
+    only searched when the resolver can't tell. With a TypeValidator, the hits of each chunk are checked in one batch
+    before anything is opened, and false positives are never written.
+    Stage times and per-signature counts go to `metrics`. With a writable
+    BlockMap, every chunk fed (and every empty run skipped) is classified
+    into the map before its hits are resolved, and text signatures are not
+    carved from blocks classified as encrypted.
+    """
+    def __init__(self, matcher, output, max_open=512, header_limit=None, reader=None,
+                 skip_offsets=None, validator=None, metrics=None, block_map=None):
+        self.matcher = matcher
+        self.block_map = block_map
+        self.metrics = metrics if metrics is not None else Metrics()
+        self.reader = reader
+        self.validator = validator
+        self.skip_offsets = skip_offsets or set()  # already carved by an interrupted run
+        self.header_limit = header_limit  # hits at or past this offset belong to another shard
+        self.output = output
+        self.max_open = max_open
+        self.open_carves = []
+        self.tail = b''
+        self.tail_offset = 0
+        self.skipped_hits = 0
+        self.resolved_hits = 0
+        self.bytes_skipped = 0
+
+    def feed(self, chunk, offset):
+        """Process the chunk that starts at absolute `offset`."""
+        if self.block_map is not None:
+            with self.metrics.stage('block_map'):
+                self.block_map.classify(chunk, offset)
+        # Headers that started in the previous chunk's tail and end in this one.
+        if self.tail:
+            window = self.tail + bytes(chunk[:self.matcher.max_header_len - 1])
+            for i in range(len(self.tail)):
+                root = self.matcher.match_at(window, i)
+                if root is None or i + len(root['header']) <= len(self.tail):
+                    continue
+                if not self._owns(self.tail_offset + i):
+                    continue
+                context = self.tail[i:] + bytes(chunk[:self.matcher.marker_window])
+                sig = self._plausible(self.matcher.resolve(root, context, 0), self.tail_offset + i)
+                if sig is not None and self.validator is not None:
+                    with self.metrics.stage('validation'):
+                        checked = self.validator.validate([(sig, context)])[0]
+                    if checked is None:
+                        self.metrics.signature(sig['type'], 'dropped')
+                    sig = checked
+                carve = self._open(sig, self.tail_offset + i)
+                if carve is not None:
+                    self._advance(carve, self.tail, i)
+
+        for carve in list(self.open_carves):
+            self._advance(carve, chunk, 0)
+
+        hits = []
+        with self.metrics.stage('header_search'):
+            found = self.matcher.find_hits(chunk)
+        for pos, root in found:
+            if not self._owns(offset + pos):
+                break
+            hits.append((pos, self._plausible(self.matcher.resolve(root, chunk, pos), offset + pos)))
+        for (pos, _), sig in zip(hits, self._validate(chunk, offset, hits)):
+            carve = self._open(sig, offset + pos)
+            if carve is not None:
+                self._advance(carve, chunk, pos)
+
+        keep = self.matcher.max_header_len - 1
+        self.tail = bytes(chunk[-keep:]) if keep else b''
+        self.tail_offset = offset + len(chunk) - len(self.tail)
+
+    def skip(self, size, offset=None):
+        """Advance past `size` bytes of empty space at `offset` without scanning them.
+
+        Only valid while no carve is open. The lookback tail is dropped: a
+        header can't continue into a constant-fill block.
+        """
+        if self.block_map is not None and offset is not None:
+            self.block_map.mark_empty(offset, size)
+        self.tail = b''
+        self.bytes_skipped += size
+
+    def finish(self):
+        """End of stream: keep footerless carves, drop those still missing a footer."""
+        for carve in list(self.open_carves):
+            if carve.footer:
+                self._abort(carve)
+            else:
+                self._complete(carve)
+        self.tail = b''
+
+    def abandon(self):
+        """Read failure: drop every open carve instead of keeping it truncated."""
+        for carve in list(self.open_carves):
+            self._abort(carve)
+        self.tail = b''
+
+    def safe_offset(self, offset):
+        """Offset below which every hit has been carved and reported."""
+        pending = [carve.offset for carve in self.open_carves]
+        in_flight = self.output.min_pending_offset()
+        if in_flight is not None:
+            pending.append(in_flight)
+        return min(pending + [offset])
+
+    def _plausible(self, sig, offset):
+        """Count a resolved hit; None for text hits inside encrypted blocks."""
+        if sig is None:
+            return None
+        self.metrics.signature(sig['type'], 'hits')
+        if (self.block_map is not None and sig['type'] in TEXT_TYPES
+                and self.block_map.label(offset) in NOT_TEXT):
+            self.metrics.signature(sig['type'], 'dropped')
+            self.metrics.count('hits_in_encrypted_blocks')
+            return None
+        return sig
+
+    def _validate(self, chunk, offset, hits):
+        """Signatures to carve the (position, sig) hits of a chunk with; None drops a hit."""
+        sigs = [sig for _, sig in hits]
+        if self.validator is None:
+            return sigs
+        pending = [i for i, (pos, sig) in enumerate(hits)
+                   if sig is not None and offset + pos not in self.skip_offsets]
+        with self.metrics.stage('validation'):
+            checked = self.validator.validate([(sigs[i], self._head(chunk, offset, hits[i][0])) for i in pending])
+        for i, sig in zip(pending, checked):
+            if sig is None:
+                self.metrics.signature(sigs[i]['type'], 'dropped')
+            sigs[i] = sig
+        return sigs
+
+    def _head(self, chunk, offset, pos):
+        """The first bytes of the hit at chunk[pos], read past the chunk end when needed."""
+        size = self.validator.head_size
+        if pos + size <= len(chunk) or self.reader is None:
+            return chunk[pos:pos + size]
+        return self.reader.view(offset + pos, size) or chunk[pos:pos + size]
+
+    def _owns(self, offset):
+        return self.header_limit is None or offset < self.header_limit
+
+    def _open(self, sig, offset):
+        if sig is None or offset in self.skip_offsets:
+            return None
+        if len(self.open_carves) >= self.max_open:
+            self.skipped_hits += 1
+            self.metrics.count('hits_skipped')
+            return None
+        carve = CarveState(sig, offset, None, self.matcher.footer_patterns.get(sig['type']))
+        if self.reader is not None:
+            with self.metrics.stage('length_resolve'):
+                length = resolve_length(self.reader, sig['type'], offset, carve.limit)
+            if length == INVALID:
+                self.metrics.signature(sig['type'], 'dropped')
+                return None
+            if length:
+                carve.footer = None
+                carve.limit = length
+                carve.resolved = True
+                self.resolved_hits += 1
+        carve.output = self.output.open(sig['type'], offset)
+        self.open_carves.append(carve)
+        return carve
+
+    def _advance(self, carve, data, start):
+        """Feed data[start:] to an open carve, completing or aborting it when it ends."""
         try:
-            return self.handle.read(size)
+            available = len(data) - start
+            budget = carve.limit - carve.size
+            view = memoryview(data)
+
+            if not carve.footer:
+                take = min(available, budget)
+                self._write(carve, view[start:start + take])
+                if carve.size >= carve.limit:
+                    self._complete(carve)
+                return
+
+            footer = carve.footer
+            if carve.carry:
+                joined = carve.carry + bytes(view[start:start + len(footer) - 1])
+                end = joined.find(footer)
+                if end != -1:
+                    self._write(carve, view[start:start + end + len(footer) - len(carve.carry)])
+                    self._complete(carve)
+                    return
+
+            # The footer can't overlap the header of a fresh carve.
+            search_from = start + (len(carve.sig['header']) if carve.size == 0 else 0)
+            searched = time.perf_counter()
+            match = carve.footer_pattern.search(data, search_from, start + budget)
+            searched = time.perf_counter() - searched
+            self.metrics.add_time('footer_search', searched)
+            self.metrics.signature(carve.sig['type'], 'footer_time', searched)
+            if match:
+                self._write(carve, view[start:match.end()])
+                self._complete(carve)
+                return
+
+            if available >= budget:
+                self._abort(carve)
+                return
+
+            self._write(carve, view[start:])
+            carve.carry = (carve.carry + bytes(view[max(start, len(data) - len(footer) + 1):]))[-(len(footer) - 1):]
         except Exception as e:
-            print(f"Error reading file: {str(e)}")
-            return None
-    
-    def close(self):
-        if self.handle:
-            self.handle.close()
+            print(f"Error carving file at offset {carve.offset}: {e}")
+            self._abort(carve)
+
+    def _write(self, carve, data):
+        self.output.write(carve.output, data)
+        carve.size += len(data)
+
+    def _complete(self, carve):
+        self.open_carves.remove(carve)
+        self.metrics.signature(carve.sig['type'], 'carved')
+        self.metrics.signature(carve.sig['type'], 'bytes', carve.size)
+        # A resolved carve cut short by the end of its range is still a reassembly candidate.
+        carve.output.resolved = carve.resolved and carve.size >= carve.limit
+        self.output.complete(carve.output)
+
+    def _abort(self, carve):
+        if carve in self.open_carves:
+            self.open_carves.remove(carve)
+            self.metrics.signature(carve.sig['type'], 'aborted')
+        self.output.abort(carve.output)
+
+
+def carve_byte_range(reader, feed, carver, start, end, stop, chunk_size=CHUNK_SIZE,
+                     checkpoint=None, skip_empty=False, progress=None):
+    """Feed [start, end) to the carver chunk by chunk.
+
+    Reading continues past `end` (never past `stop`) only while carves are
+    still open, so files that cross the range end are completed. `checkpoint`
+    is called with the current offset every CHECKPOINT_INTERVAL bytes. With
+    `skip_empty`, sparse holes and zeroed or constant-fill blocks are stepped
+    over whenever no carve is open; offsets stay absolute. `progress` is
+    called with the number of bytes of [start, end) done after each step.
+    Read time and bytes read go to the carver's metrics. Returns the offset
+    reached, which is below `end` when a read failed.
+    """
+    metrics = carver.metrics
+    offset = start
+    next_checkpoint = start + CHECKPOINT_INTERVAL
+    while offset < stop and (offset < end or carver.open_carves):
+        previous = offset
+        run = reader.empty_run(offset, end) if skip_empty and offset < end and not carver.open_carves else 0
+        if run:
+            carver.skip(run, offset)
+            offset += run
+        else:
+            with metrics.stage('read'):
+                chunk = reader.view(offset, min(chunk_size, stop - offset))
+            if not chunk:
+                print(f"Read failed at offset {offset}.")
+                break
+            metrics.count('bytes_read', len(chunk))
+            feed(chunk, offset)
+            offset += len(chunk)
+        if progress and previous < end:
+            progress(min(offset, end) - previous)
+        if checkpoint and offset >= next_checkpoint:
+            checkpoint(min(offset, end))
+            next_checkpoint = offset + CHECKPOINT_INTERVAL
+    return offset
+
+
+def load_carved_offsets(db_path, start, end):
+    """Offsets in [start, end) that already have a carved_files row."""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute('SELECT offset FROM carved_files WHERE offset >= ? AND offset < ?',
+                            (start, end))
+        return {row[0] for row in rows}
+    finally:
+        conn.close()
+
+
+def plan_shards(extents, shard_size):
+    """Group sorted (start, end) extents into shards of about `shard_size` bytes.
+
+    Small extents are packed together and large ones split, so a volume
+    carved as thousands of unallocated extents still makes a few tasks.
+    Yields each shard as a list of (start, end, stop) pieces, where `stop`
+    is the end of the extent the piece was cut from.
+    """
+    shard, size = [], 0
+    for start, end in extents:
+        while start < end:
+            piece_end = min(start + shard_size - size, end)
+            shard.append((start, piece_end, end))
+            size += piece_end - start
+            start = piece_end
+            if size >= shard_size:
+                yield shard
+                shard, size = [], 0
+    if shard:
+        yield shard
+
+
+def carve_shard(evidence_path, output_path, db_path, pieces, options):
+    """Process-pool worker: carve headers found in the (start, end, stop) pieces of a shard.
+
+    The worker opens its own reader and carves each piece with a carver of
+    its own, like the extents of a serial run. A piece is scanned
+    SHARD_OVERLAP bytes past `end` (never past `stop`, the end of its
+    extent) so headers straddling a shard boundary are seen; hits past
+    `end` are left to the next shard. Returns the rows for the parent to
+    store, the shard's counters (empty bytes skipped, hits checked, dropped and
+    reclassified by type validation, known-good and known-bad files) and
+    the YARA matches of the raw stream
+    when options carry compiled rules. A failed read raises IOError, so the
+    shard is retried or left uncompleted. The shard's Metrics snapshot travels
+    in the counters as 'metrics'. With a block map in the options, text
+    hits inside encrypted blocks are dropped. On resume,
+    offsets already in the case database are not carved again. `options` is
+    ForensicAnalyzer.carve_options().
+    """
+    reader = DiskReader(evidence_path, cache_size=options['cache_size'])
+    if not reader.open():
+        raise IOError(f"cannot open {evidence_path}")
+    rows = []
+    yara_rows = []
+    metrics = Metrics()
+    bytes_skipped = 0
+    rules = load_rules(options['yara_rules']) if options['yara_rules'] else None
+    dedup = DedupIndex(db_path) if options['deduplicate'] else None
+    hash_filter = HashFilter(options['known_good'], options['known_bad'])
+    pack = EvidencePack(options['pack_dir'], options['pack_segment_size']) if options['pack_dir'] else None
+    output = OutputPipeline(output_path, rows.append, dedup=dedup,
+                            scanner=FileScanner(rules) if rules else None, hash_filter=hash_filter,
+                            pack=pack, metrics=metrics)
+    matcher = SignatureMatcher(FileSignatures().get_signatures())
+    validator = TypeValidator(matcher, options['magic_workers']) if options['validate_types'] else None
+    block_map = BlockMap(options['block_map'], writable=True) if options['block_map'] else None
+    try:
+        skip_offsets = (load_carved_offsets(db_path, pieces[0][0], pieces[-1][1])
+                        if options['resume'] else None)
+        for start, end, stop in pieces:
+            carver = StreamingCarver(matcher, output, header_limit=end,
+                                     reader=reader if options['resolve_lengths'] else None,
+                                     skip_offsets=skip_offsets, validator=validator, metrics=metrics,
+                                     block_map=block_map)
+            feed = carver.feed
+            if rules:
+                stream = StreamScanner(rules, yara_rows.append, limit=end)
+
+                def feed(chunk, offset):
+                    carver.feed(chunk, offset)
+                    with metrics.stage('yara_stream'):
+                        stream.feed(chunk, offset)
+            profile_offset = options['profile_offset']
+            if profile_offset is not None and start <= profile_offset < end:
+                feed = ChunkProfiler(profile_offset, options['profile_path']).wrap(feed)
+            reached = carve_byte_range(reader, feed, carver, start, min(end + SHARD_OVERLAP, stop), stop,
+                                       skip_empty=options['skip_empty'])
+            if reached < end:
+                carver.abandon()
+                raise IOError(f"read failed at offset {reached}")
+            carver.finish()
+            bytes_skipped += carver.bytes_skipped
+    finally:
+        output.close()
+        if pack is not None:
+            pack.close()
+        hash_filter.close()
+        if validator is not None:
+            validator.close()
+        if block_map is not None:
+            block_map.close()
+        reader.close()
+    metrics.count('bytes_skipped', bytes_skipped)
+    stats = {'bytes_skipped': bytes_skipped, 'known_good': output.known_good,
+             'known_bad': output.known_bad, 'metrics': metrics.snapshot()}
+    if validator is not None:
+        stats.update(hits_checked=validator.checked, hits_dropped=validator.dropped,
+                     hits_reclassified=validator.reclassified)
+    return rows, stats, yara_rows
+
 
 class ForensicAnalyzer:
-    def __init__(self, evidence_path, case_id, output_path):
+    def __init__(self, evidence_path, case_id, output_path, workers=1, shard_size=SHARD_SIZE,
+                 output_workers=2, output_backlog=64, deduplicate=True, resume=False,
+                 resolve_lengths=True, carve_gaps=True, cache_size=CACHE_SIZE, skip_empty=True,
+                 unallocated_only=False, reassemble=True, fragment_block=FRAGMENT_BLOCK,
+                 fragment_gap=FRAGMENT_GAP, yara_rules=None, yara_cache=YARA_CACHE,
+                 validate_types=True, magic_workers=MAGIC_WORKERS, known_good=(), known_bad=(),
+                 pack_output=False, pack_segment_size=PACK_SEGMENT_SIZE, metrics_path=None,
+                 profile_offset=None, progress_interval=PROGRESS_INTERVAL, db_path=None,
+                 block_map=False):
         self.evidence_path = evidence_path
         self.case_id = case_id
         self.output_path = output_path
+        self.workers = workers
+        self.shard_size = shard_size
+        self.pool = None
+        self.shard_futures = {}  # future -> (shard_start, shard_end, pieces left to carve)
+        self.failed_ranges = []  # (start, end) left uncarved by worker or read errors
+        self.writer = None
+        self.output_workers = output_workers
+        self.output_backlog = output_backlog
+        self.output = None
+        self.deduplicate = deduplicate
+        self.dedup = None
+        self.resume = resume
+        self.resolve_lengths = resolve_lengths
+        self.carve_gaps = carve_gaps
+        self.cache_size = cache_size
+        self.skip_empty = skip_empty
+        self.unallocated_only = unallocated_only
+        self.reassemble = reassemble
+        self.fragment_block = fragment_block
+        self.fragment_gap = fragment_gap
+        self.fragment_candidates = []
+        self.yara_rules = yara_rules  # directory of .yar/.yara files
+        self.yara_cache = yara_cache
+        self.compiled_rules = None
+        self.rules = None
+        self.yara_stream = None
+        self.validate_types = validate_types and MAGIC_AVAILABLE
+        self.magic_workers = magic_workers
+        self.validator = None
+        self.validation = {'hits_checked': 0, 'hits_dropped': 0, 'hits_reclassified': 0}
+        self.known_good = list(known_good)  # hash set files (hashset.py) of files to leave out
+        self.known_bad = list(known_bad)  # hash set files of files to flag
+        self.hash_filter = None
+        self.known_counts = {'known_good': 0, 'known_bad': 0}
+        # Append carved files to segment files under output_path/packs instead of one file each.
+        self.pack_dir = os.path.join(output_path, 'packs') if pack_output else None
+        self.pack_segment_size = pack_segment_size
+        self.pack = None
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path  # JSON metrics dump written at the end of analyze_disk
+        self.profile_offset = profile_offset  # profile the chunk containing this offset
+        self.profile_path = os.path.join(output_path, f"case_{case_id}_profile")
+        self.progress_interval = progress_interval
+        self.meter = None
+        # Classify carved chunks into output_path/case_{id}.blockmap and let the carver consult it.
+        self.block_map_path = os.path.join(output_path, f"case_{case_id}.blockmap") if block_map else None
+        self.block_map = None
+        self.bytes_scanned = 0
+        self.bytes_skipped = 0
+        self.progress = []
+        self.evidence_key = os.path.abspath(self.evidence_path)
         os.makedirs(self.output_path, exist_ok=True)
         self.file_signatures = FileSignatures().get_signatures()
-        self.db_path = f"case_{self.case_id}.db"
-        self.disk_reader = DiskReader(self.evidence_path)  # Use DiskReader for file access
+        self.matcher = SignatureMatcher(self.file_signatures)
+        self.max_sizes = {sig['type']: sig['max_size'] for sig in self.file_signatures}
+        self.db_path = db_path or f"case_{self.case_id}.db"
+        self.disk_reader = DiskReader(self.evidence_path, cache_size=cache_size)  # Use DiskReader for file access
         self.initialize_database()  # Initialize the SQLite database
 
     def initialize_database(self):
@@ -184,193 +713,567 @@ class ForensicAnalyzer:
                 offset INTEGER,
                 size INTEGER,
                 md5 TEXT,
+                sha1 TEXT,
+                sha256 TEXT,
+                blob TEXT,
+                duplicate INTEGER DEFAULT 0,
+                fragments TEXT,
+                known TEXT,
                 recovery_time TEXT
             );
         ''')
+        # Bring case databases from older versions up to the current columns.
+        columns = {row[1] for row in c.execute('PRAGMA table_info(carved_files)')}
+        for column, definition in (('sha1', 'TEXT'), ('sha256', 'TEXT'), ('blob', 'TEXT'),
+                                   ('duplicate', 'INTEGER DEFAULT 0'), ('fragments', 'TEXT'),
+                                   ('known', 'TEXT')):
+            if column not in columns:
+                c.execute(f'ALTER TABLE carved_files ADD COLUMN {column} {definition}')
+        if 'blob' not in columns:
+            c.execute("UPDATE carved_files SET blob = md5 || '.' || lower(file_type)")
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS yara_matches (
+                id INTEGER PRIMARY KEY,
+                source TEXT,
+                rule TEXT,
+                namespace TEXT,
+                tags TEXT,
+                string_id TEXT,
+                offset INTEGER,
+                length INTEGER,
+                file_offset INTEGER,
+                blob TEXT,
+                match_time TEXT
+            )
+        ''')
+
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS carve_progress (
+                evidence TEXT,
+                range_start INTEGER,
+                range_end INTEGER,
+                next_offset INTEGER,
+                completed INTEGER,
+                updated TEXT,
+                PRIMARY KEY (evidence, range_start)
+            )
+        ''')
+        c.execute(CREATE_PACK_INDEX)
+        c.execute(CREATE_PACK_MD5_INDEX)
+        ensure_indexes(c)
         conn.commit()
         conn.close()
 
     def analyze_disk(self):
-        """Analyze the entire disk or file."""
+        """Analyze the entire disk or file; returns False if the analysis failed."""
         if not self.disk_reader.open():
             print("Failed to open the evidence file.")
-            return
+            return False
 
+        self.progress = self.load_progress() if self.resume else []
+        self.failed_ranges = []
+        self.metrics = Metrics()
+        started = time.perf_counter()
+        self.writer = self.output = self.hash_filter = self.pack = None
         try:
-            mbr = self.disk_reader.read(512)  # Read the Master Boot Record (MBR)
-            if not mbr:
-                print("Failed to read MBR.")
-                return
+            # Hash sets are opened first, so a bad path fails before any thread starts.
+            self.hash_filter = HashFilter(self.known_good, self.known_bad)
+            self.prepare_yara()
+            if self.validate_types:
+                self.validator = TypeValidator(self.matcher, self.magic_workers)
+            self.writer = ArtifactWriter(self.db_path).start()
+            self.dedup = DedupIndex(self.db_path) if self.deduplicate else None
+            self.pack = EvidencePack(self.pack_dir, self.pack_segment_size) if self.pack_dir else None
+            self.output = OutputPipeline(self.output_path, self.record_carved_file,
+                                         workers=self.output_workers, max_pending=self.output_backlog,
+                                         dedup=self.dedup,
+                                         scanner=FileScanner(self.rules) if self.rules else None,
+                                         hash_filter=self.hash_filter, pack=self.pack, metrics=self.metrics)
+            volume_map = discover_volumes(self.disk_reader)
+            for error in volume_map.errors:
+                print(f"Partition table warning: {error}")
+            if not volume_map.volumes:
+                print("No partitions found, carving the whole image.")
+                extents = volume_map.gaps(min_size=0)
+            elif self.carve_gaps:
+                extents = volume_map.volumes + volume_map.gaps()
+            else:
+                extents = volume_map.volumes
+            if self.block_map_path:
+                self.block_map = self.open_block_map()
+            self.meter = ProgressMeter(sum(volume.size for volume in extents), self.progress_interval)
 
-            partitions = self.parse_partitions(mbr)
-            for part_num, partition in partitions.items():
-                print(f"Analyzing partition {part_num}: {partition}")
-                self.analyze_partition(partition)
+            if self.workers > 1:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=POOL_CONTEXT)
+                self.shard_futures = {}
+
+            for volume in sorted(extents, key=lambda v: v.start):
+                print(f"Analyzing {volume}")
+                self.analyze_volume(volume)
+
+            if self.pool:
+                self.collect_shards()
+            if self.reassemble:
+                with self.metrics.stage('reassembly'):
+                    self.reassemble_fragments()
+            if self.validate_types:
+                if self.validator is not None:
+                    self.validation['hits_checked'] += self.validator.checked
+                    self.validation['hits_dropped'] += self.validator.dropped
+                    self.validation['hits_reclassified'] += self.validator.reclassified
+                print(f"Type validation: {self.validation['hits_checked']} hits checked, "
+                      f"{self.validation['hits_dropped']} dropped as false positives, "
+                      f"{self.validation['hits_reclassified']} reclassified.")
+            if self.hash_filter:
+                known_good = self.known_counts['known_good'] + self.output.known_good
+                known_bad = self.known_counts['known_bad'] + self.output.known_bad
+                print(f"Known files: {known_good} known-good filtered, {known_bad} known-bad flagged.")
+            if self.rules:
+                yara_matches = self.metrics.snapshot()['counters'].get('yara_matches', 0)
+                print(f"YARA: {yara_matches} matches recorded.")
+            if self.block_map is not None:
+                print("Block map: " + ", ".join(f"{name} {size / 1048576:.1f} MB"
+                                                 for name, size in self.block_map.summary().items()))
+            if self.skip_empty and self.bytes_scanned:
+                print(f"Skipped {self.bytes_skipped} empty bytes "
+                      f"({self.bytes_skipped / self.bytes_scanned:.1%} of {self.bytes_scanned} scanned).")
+            for start, end in self.failed_ranges:
+                print(f"Not carved: [{start}, {end}) ({end - start} bytes); resume to retry.")
+            completed = not self.failed_ranges
         except Exception as e:
             print(f"Error analyzing disk: {e}")
+            completed = False
         finally:
+            if self.pool:
+                self.pool.shutdown(cancel_futures=True)
+                self.pool = None
+            if self.output is not None:
+                self.output.close()
+            if self.pack is not None:
+                self.pack.close()
+                self.pack = None
+            if self.hash_filter is not None:
+                self.hash_filter.close()
+            if self.validator is not None:
+                self.validator.close()
+                self.validator = None
+            if self.block_map is not None:
+                self.block_map.close()
+                self.block_map = None
+            if self.writer is not None:
+                self.writer.close()
+            cache = self.disk_reader.cache_stats()
+            if cache:
+                print(f"E01 block cache: {cache['hits']} hits, {cache['misses']} misses")
             self.disk_reader.close()
+            self.report_metrics(time.perf_counter() - started)
+        return completed
+
+    def open_block_map(self):
+        """Open the case's block map for the carvers to fill in, creating it if there is none for this image.
+
+        An existing map (from an interrupted run or block_classifier.py build)
+        keeps its labels; the blocks carved again are relabelled.
+        """
+        path = self.block_map_path
+        if os.path.exists(path):
+            block_map = BlockMap(path, writable=True)
+            if block_map.image_size == self.disk_reader.size:
+                print(f"Using block map {path}")
+                return block_map
+            block_map.close()
+        create_block_map(path, self.disk_reader.size)
+        print(f"Classifying image blocks into {path} while carving")
+        return BlockMap(path, writable=True)
 
-    def parse_partitions(self, mbr):
-        """Parse MBR to extract partition entries."""
-        partitions = {}
-        for i in range(4):  # Four partition entries in the MBR
-            offset = 446 + i * 16
-            partitions[i + 1] = mbr[offset:offset + 16]
-        return partitions
-
-    def analyze_partition(self, partition):
-        """Analyze a specific partition."""
-        start_sector = self.get_sector(partition)
-        part_size = self.get_part_size(partition)
-        part_type = self.get_part_type(partition)
-
-        if part_type == "Empty" or part_size == 0:
+    def report_metrics(self, elapsed):
+        """Print the stage and signature breakdown of the run; dump it as JSON when asked to."""
+        if self.writer is not None:
+            self.metrics.add_time('sqlite', self.writer.write_time, self.writer.batches_written)
+            self.metrics.count('rows_written', self.writer.rows_written)
+        print(f"Analysis took {elapsed:.2f}s ({self.bytes_scanned / elapsed / 1048576:.1f} MB/s)."
+              if elapsed > 0 else "Analysis took no time.")
+        for line in self.metrics.report():
+            print(line)
+        if self.metrics_path:
+            self.metrics.dump(self.metrics_path, extra={
+                'case_id': self.case_id,
+                'evidence_file': self.evidence_path,
+                'workers': self.workers,
+                'elapsed': elapsed,
+                'bytes_scanned': self.bytes_scanned,
+            })
+            print(f"Metrics written to {self.metrics_path}")
+
+    def prepare_yara(self):
+        """Compile the rules directory once (cached by content digest) and load it."""
+        self.compiled_rules = self.rules = None
+        if not self.yara_rules:
+            return
+        if not YARA_AVAILABLE:
+            print("YARA rules given but yara-python is not installed; skipping YARA scanning.")
+            return
+        self.compiled_rules = compile_rules(self.yara_rules, self.yara_cache)
+        if self.compiled_rules:
+            self.rules = load_rules(self.compiled_rules)
+
+    def analyze_volume(self, volume):
+        """Carve one volume or unpartitioned gap from the partition map."""
+        if volume.size == 0:
             print(f"Partition is empty or size is zero.")
             return
 
-        print(f"Partition: Type={part_type}, Start Sector={start_sector}, Size={part_size}")
-        self.carve_files_from_partition(start_sector, part_size)
-
-    def get_sector(self, partition):
-        """Get the starting sector of the partition."""
-        sector_data = partition[8:12]
-        return int.from_bytes(sector_data, byteorder='little')
-
-    def get_part_size(self, partition):
-        """Get the size of the partition in sectors."""
-        size_data = partition[12:16]
-        return int.from_bytes(size_data, byteorder='little')
-
-    def get_part_type(self, partition):
-        """Get the partition type."""
-        part_type_code = partition[4]
-        partition_types = {
-            0x00: "Empty",
-            0x07: "NTFS",
-            0x0B: "FAT32",
-            0x0C: "FAT32 LBA",
-            0x83: "Linux"
+        print(f"Partition: Type={volume.filesystem or volume.type_name}, "
+              f"Start Sector={volume.start_sector}, Size={volume.size_sectors}")
+        if self.unallocated_only and volume.scheme != 'GAP':
+            extents = unallocated_extents(self.disk_reader, volume)
+            if extents is not None:
+                free = sum(end - start for start, end in extents)
+                print(f"Carving unallocated space only: {len(extents)} extents, "
+                      f"{free} of {volume.size} bytes ({free / volume.size:.1%}).")
+                self.meter.adjust_total(free - volume.size)
+                self.carve_extents(volume.start, volume.end, extents)
+                return
+            print("Allocation unknown for this filesystem, carving the whole partition.")
+        self.carve_extent(volume.start, volume.end)
+
+    def carve_extent(self, offset, end):
+        """Carve files from the byte range [offset, end) of the evidence."""
+        self.carve_extents(offset, end, [(offset, end)])
+
+    def carve_extents(self, range_start, range_end, extents):
+        """Carve the sorted (start, end) extents of [range_start, range_end).
+
+        Each extent is scanned on its own and carves stop at its end, so a
+        file is never stitched across allocated clusters. Progress is
+        checkpointed for the range as a whole; after a failed read the range
+        stays incomplete from the first unfinished carve and goes to
+        failed_ranges. With a worker pool the extents are grouped into
+        shards instead, each checkpointed on its own.
+        """
+        if self.pool:
+            self.schedule_shards(extents)
+            return
+
+        offset = range_start
+        skip_offsets = None
+        if self.resume:
+            offset = self.resume_point(range_start, range_end)
+            self.meter.adjust_total(range_start - min(offset, range_end))
+            if offset >= range_end:
+                print("Partition already carved, skipping.")
+                return
+            if offset > range_start:
+                print(f"Resuming partition at offset {offset}.")
+            skip_offsets = load_carved_offsets(self.db_path, offset, range_end)
+
+        for start, end in extents:
+            start = max(start, offset)
+            if start >= end:
+                continue
+            self.carver = StreamingCarver(self.matcher, self.output,
+                                          reader=self.disk_reader if self.resolve_lengths else None,
+                                          skip_offsets=skip_offsets, validator=self.validator,
+                                          metrics=self.metrics, block_map=self.block_map)
+            if self.rules:
+                self.yara_stream = StreamScanner(self.rules, self.record_yara_match)
+            feed = self.carve_files_from_chunk
+            if self.profile_offset is not None:
+                feed = ChunkProfiler(self.profile_offset, self.profile_path).wrap(feed)
+            reached = carve_byte_range(self.disk_reader, feed, self.carver, start, end, end,
+                                       checkpoint=lambda pos: self.save_checkpoint(range_start, range_end,
+                                                                                   self.carver.safe_offset(pos)),
+                                       skip_empty=self.skip_empty, progress=self.meter.advance)
+            if reached < end:
+                # Everything from the first unfinished carve on is carved again on resume.
+                resume_at = self.carver.safe_offset(reached)
+                self.carver.abandon()
+                self.output.drain()
+                self.save_checkpoint(range_start, range_end, resume_at)
+                self.failed_ranges.append((resume_at, range_end))
+                self.bytes_scanned += reached - start
+                return
+            self.carver.finish()
+            self.bytes_scanned += end - start
+            self.bytes_skipped += self.carver.bytes_skipped
+            self.metrics.count('bytes_skipped', self.carver.bytes_skipped)
+            if self.carver.skipped_hits:
+                print(f"Skipped {self.carver.skipped_hits} hits: too many files open at once.")
+        self.output.drain()
+        self.save_checkpoint(range_start, range_end, range_end, completed=True)
+
+    def load_progress(self):
+        """Checkpointed (range_start, next_offset) pairs for this evidence file."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute('SELECT range_start, next_offset FROM carve_progress WHERE evidence = ?',
+                                (self.evidence_key,)).fetchall()
+        finally:
+            conn.close()
+
+    def incomplete_ranges(self):
+        """(first uncarved offset, range end) of checkpointed ranges not carved to their end."""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute('SELECT range_start, range_end, next_offset FROM carve_progress '
+                                'WHERE evidence = ?', (self.evidence_key,)).fetchall()
+        finally:
+            conn.close()
+        progress = [(range_start, next_offset) for range_start, _, next_offset in rows]
+        points = [(self.resume_point(range_start, range_end, progress), range_end)
+                  for range_start, range_end, _ in rows]
+        return [(point, range_end) for point, range_end in points if point < range_end]
+
+    def resume_point(self, start, end, progress=None):
+        """First offset in [start, end) not covered by a checkpoint."""
+        progress = self.progress if progress is None else progress
+        point = start
+        advanced = True
+        while advanced:
+            advanced = False
+            for range_start, next_offset in progress:
+                if range_start <= point < next_offset:
+                    point = next_offset
+                    advanced = True
+        return min(point, end)
+
+    def save_checkpoint(self, range_start, range_end, next_offset, completed=False):
+        self.writer.save_progress(self.evidence_key, range_start, range_end, next_offset,
+                                  completed, datetime.datetime.now().isoformat())
+
+    def schedule_shards(self, extents):
+        """Group the extents of a volume into shards and queue them on the worker pool."""
+        for pieces in plan_shards(extents, self.shard_size):
+            shard_start, shard_end = pieces[0][0], pieces[-1][1]
+            size = sum(end - start for start, end, _ in pieces)
+            if self.resume:
+                carve_from = self.resume_point(shard_start, shard_end)
+                pieces = [(max(start, carve_from), end, stop) for start, end, stop in pieces if end > carve_from]
+                self.meter.adjust_total(sum(end - start for start, end, _ in pieces) - size)
+            if pieces:
+                self.submit_shard(shard_start, shard_end, pieces)
+
+    def submit_shard(self, shard_start, shard_end, pieces):
+        future = self.pool.submit(carve_shard, self.evidence_path, self.output_path, self.db_path,
+                                  pieces, self.carve_options())
+        self.shard_futures[future] = (shard_start, shard_end, pieces)
+        return future
+
+    def carve_options(self):
+        """Carving settings handed to shard workers."""
+        return {
+            'deduplicate': self.deduplicate,
+            'resume': self.resume,
+            'resolve_lengths': self.resolve_lengths,
+            'cache_size': self.cache_size,
+            'skip_empty': self.skip_empty,
+            'fragment_block': self.fragment_block,
+            'fragment_gap': self.fragment_gap,
+            'yara_rules': self.compiled_rules,
+            'validate_types': self.validate_types,
+            'magic_workers': self.magic_workers,
+            'known_good': self.known_good,
+            'known_bad': self.known_bad,
+            'pack_dir': self.pack_dir,
+            'pack_segment_size': self.pack_segment_size,
+            'profile_offset': self.profile_offset,
+            'profile_path': self.profile_path,
+            'block_map': self.block_map_path,
         }
-        return partition_types.get(part_type_code, f"Unknown ({hex(part_type_code)})")
 
-    def carve_files_from_partition(self, start_sector, size):
-        """Carve files from a partition."""
-        chunk_size = 1024 * 1024  # 1 MB
-        offset = start_sector * 512
-        remaining = size * 512
+    def collect_shards(self):
+        """Merge worker results, dropping hits reported twice from overlap zones.
 
-        while remaining > 0:
-            read_size = min(chunk_size, remaining)
-            chunk = self.disk_reader.read(read_size)
-            if not chunk:
-                print("No more data to read.")
-                break
+        A shard whose worker raised is resubmitted up to SHARD_RETRIES times;
+        after that it goes to failed_ranges and its carve_progress row stays
+        incomplete, so a resumed run carves it again.
+        """
+        print(f"Queued {len(self.shard_futures)} shards for {self.workers} workers.")
+        seen = set()
+        tries = {}
+        pending = set(self.shard_futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                self.collect_shard(future, pending, tries, seen)
+        self.shard_futures = {}
 
-            self.carve_files_from_chunk(chunk, offset)
-            offset += read_size
-            remaining -= read_size
+    def collect_shard(self, future, pending, tries, seen):
+        """Merge one finished shard; a failed one is resubmitted into `pending`."""
+        shard_start, shard_end, pieces = self.shard_futures.pop(future)
+        carve_from = pieces[0][0]
+        size = sum(end - start for start, end, _ in pieces)
+        try:
+            rows, stats, yara_rows = future.result()
+        except Exception as e:
+            tries[shard_start] = tries.get(shard_start, 0) + 1
+            if tries[shard_start] <= SHARD_RETRIES:
+                print(f"Error carving shard [{carve_from}, {shard_end}): {e}; retrying.")
+                pending.add(self.submit_shard(shard_start, shard_end, pieces))
+            else:
+                print(f"Error carving shard [{carve_from}, {shard_end}): {e}")
+                self.failed_ranges.append((carve_from, shard_end))
+                self.save_checkpoint(shard_start, shard_end, carve_from)
+            return
+        self.bytes_scanned += size
+        self.bytes_skipped += min(stats['bytes_skipped'], size)
+        for counter in self.validation:
+            self.validation[counter] += stats.get(counter, 0)
+        for counter in self.known_counts:
+            self.known_counts[counter] += stats.get(counter, 0)
+        self.metrics.merge(stats['metrics'])
+        self.meter.advance(size)
+        for match in yara_rows:
+            self.record_yara_match(match)
+        for record in rows:
+            key = (record['offset'], record['file_type'])
+            if key in seen:
+                continue
+            seen.add(key)
+            if self.dedup is not None and record['blob']:
+                self.merge_shard_blob(record)
+            self.record_carved_file(record)
+        self.save_checkpoint(shard_start, shard_end, shard_end, completed=True)
 
     def carve_files_from_chunk(self, chunk, offset):
-        """Find and carve files in a chunk."""
-        for sig in self.file_signatures:
-            pos = 0
-            while True:
-                pos = chunk.find(sig['header'], pos)
-                if pos == -1:
-                    break
+        """Find and carve files in a chunk, continuing carves from earlier chunks."""
+        self.carver.feed(chunk, offset)
+        if self.yara_stream is not None:
+            with self.metrics.stage('yara_stream'):
+                self.yara_stream.feed(chunk, offset)
+
+    def merge_shard_blob(self, record):
+        """Dedup a blob written by a worker against blobs stored by other workers."""
+        if record['duplicate']:
+            # Deduplicated by the worker against the case database, whose pack_index
+            # row may not have been committed yet when the worker loaded it.
+            if self.pack is not None and not record.get('pack'):
+                record['pack'] = self.dedup.location(record['blob'])
+                record['path'] = self.pack.location(record['pack']) if record['pack'] else None
+            return
+        blob, duplicate = self.dedup.claim(record['hashes']['sha256'], record['blob'])
+        if not duplicate:
+            if blob != record['blob']:
+                # Another worker stored different content under the same MD5 name.
+                if not record.get('pack'):
+                    path = os.path.join(self.output_path, blob)
+                    os.replace(record['path'], path)
+                    record['path'] = path
+                record['blob'] = blob
+            if record.get('pack'):
+                self.dedup.place(blob, record['pack'])
+            return
+        if record.get('pack'):
+            # The worker's copy keeps its bytes but is retired; the record points at the indexed one.
+            self.pack.retire(record['pack'])
+            record['pack'] = self.dedup.location(blob)
+            record['path'] = self.pack.location(record['pack']) if record['pack'] else None
+        else:
+            if blob != record['blob']:
+                try:
+                    os.remove(record['path'])
+                except OSError:
+                    pass
+            record['path'] = os.path.join(self.output_path, blob)
+        record['blob'] = blob
+        record['duplicate'] = True
+
+    def reassemble_fragments(self):
+        """Bifragment gap carving for the carved files that fail validation.
 
+        Carves of reassemblable types are validated against the evidence; for
+        broken ones a second fragment is searched within `fragment_gap`
+        bytes, spread over the worker pool when there is one. Reassembled
+        files are stored as extra rows that list their fragments, next to the
+        original carve.
+        """
+        candidates = [(file_type, offset, size, self.max_sizes[file_type])
+                      for file_type, offset, size in sorted(set(self.fragment_candidates))]
+        self.fragment_candidates = []
+        if not candidates:
+            return
+        print(f"Checking {len(candidates)} carved files for fragmentation...")
+        if self.pool:
+            batches = [self.pool.submit(reassemble_batch, self.evidence_path,
+                                        candidates[i:i + REASSEMBLY_BATCH], self.carve_options())
+                       for i in range(0, len(candidates), REASSEMBLY_BATCH)]
+            found = []
+            for future in as_completed(batches):
                 try:
-                    file_data = self.extract_file(chunk[pos:], sig)
-                    if file_data:
-                        md5 = hashlib.md5(file_data).hexdigest()
-                        file_path = os.path.join(self.output_path, f"{md5}.{sig['type'].lower()}")
-
-                        with open(file_path, 'wb') as carved_file:
-                            carved_file.write(file_data)
-
-                        # Insert into database
-                        conn = sqlite3.connect(self.db_path)
-                        c = conn.cursor()
-                        c.execute('''
-                            INSERT INTO carved_files (file_type, offset, size, md5, recovery_time)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (sig['type'], offset + pos, len(file_data), md5, datetime.datetime.now().isoformat()))
-                        conn.commit()
-                        conn.close()
-
-                        print(f"Carved {sig['type']} file: {file_path}")
+                    found.extend(future.result())
                 except Exception as e:
-                    print(f"Error carving file at offset {offset + pos}: {e}")
-                pos += 1
-
-    def extract_file(self, data, signature):
-        """Extract a file from the given data using its signature."""
-        if signature['footer']:
-            end = data.find(signature['footer'])
-            if end == -1 or (end - len(signature['header'])) > signature['max_size']:
-                return None
-            return data[:end + len(signature['footer'])]
+                    print(f"Error reassembling fragments: {e}")
         else:
-            # Carve file using header and max_size only
-            return data[:signature['max_size']]
+            found = find_fragments(self.disk_reader, candidates, self.fragment_block, self.fragment_gap)
 
+        for file_type, offset, extents in sorted(found, key=lambda item: item[1]):
+            output = self.output.open(file_type, offset, fragments=extents)
+            for start, length in extents:
+                self.output.write(output, self.disk_reader.view(start, length))
+            self.output.complete(output)
+        self.output.drain()
+        print(f"Reassembled {len(found)} fragmented files.")
 
-    def generate_report(self):
-        """Generate a detailed JSON report."""
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+    def record_yara_match(self, match):
+        """Queue a YARA match found in the raw image stream."""
+        self.writer.add_yara_match('image', match, datetime.datetime.now().isoformat())
+        self.metrics.count('yara_matches')
 
-        # Fetch all carved files
-        carved_files = c.execute('SELECT * FROM carved_files').fetchall()
-
-        # Aggregate data by file type
-        file_type_summary = c.execute('''
-            SELECT file_type, 
-                COUNT(*) AS file_count, 
-                SUM(size) AS total_size, 
-                MAX(size) AS largest_file_size
-            FROM carved_files
-            GROUP BY file_type
-        ''').fetchall()
+    def record_carved_file(self, record):
+        """Queue a completed carve for the case database."""
+        recovery_time = datetime.datetime.now().isoformat()
+        self.writer.add_carved_file(record, recovery_time)
+        if record.get('pack') and not record['duplicate']:
+            self.writer.add_packed_blob(record)
+        matches = record.get('yara') or ()
+        for match in matches:
+            self.writer.add_yara_match('carved', match, recovery_time, record['offset'], record['blob'])
+        if matches:
+            # Called from the output pipeline's threads too; Metrics counts under its lock.
+            self.metrics.count('yara_matches', len(matches))
+            rules = ', '.join(sorted({match['rule'] for match in matches}))
+            print(f"YARA rules matched carved {record['file_type']} {record['blob']}: {rules}")
+        if record.get('known') == 'good':
+            print(f"Known-good {record['file_type']} at offset {record['offset']} filtered out")
+            return
+        # Only carves that ended on a footer or were cut short can be missing a fragment;
+        # a duplicate's content was already a candidate at its first offset.
+        if (self.reassemble and record['file_type'] in REASSEMBLERS and not record.get('fragments')
+                and not record.get('resolved') and not record['duplicate']):
+            self.fragment_candidates.append((record['file_type'], record['offset'], record['size']))
 
-        # Get earliest and latest recovery times
-        recovery_times = c.execute('''
-            SELECT MIN(recovery_time), MAX(recovery_time) FROM carved_files
-        ''').fetchone()
+        if record.get('known') == 'bad':
+            print(f"KNOWN-BAD {record['file_type']} at offset {record['offset']}: {record['blob']}")
+        if record.get('fragments'):
+            print(f"Reassembled {record['file_type']} from {len(record['fragments'])} fragments: "
+                  f"{record['path']}")
+        elif record['duplicate']:
+            print(f"Duplicate {record['file_type']} at offset {record['offset']}: {record['blob']}")
+        else:
+            print(f"Carved {record['file_type']} file: {record['path']}")
 
-        conn.close()
 
-        # Format report
-        report = {
+    def generate_report(self, report_format='json'):
+        """Generate the case report (json, ndjson, parquet or arrow), streamed from the case database."""
+        report_file = os.path.join(self.output_path, f"case_{self.case_id}_report.{report_format}")
+        writer = ReportWriter(self.db_path)
+        report = writer.write(report_file, report_format, header={
             'case_id': self.case_id,
             'evidence_file': self.evidence_path,
             'analysis_time': datetime.datetime.now().isoformat(),
-            'total_files': len(carved_files),
-            'file_type_summary': [
-                {
-                    'file_type': row[0],
-                    'file_count': row[1],
-                    'total_size': row[2],
-                    'largest_file_size': row[3]
-                }
-                for row in file_type_summary
-            ],
-            'earliest_recovery_time': recovery_times[0],
-            'latest_recovery_time': recovery_times[1],
-            'carved_files': carved_files
-        }
-
-        # Save report to JSON file
-        report_file = os.path.join(self.output_path, f"case_{self.case_id}_report.json")
-        with open(report_file, 'w') as f:
-            json.dump(report, f, indent=4)
+        })
+        if report is None:
+            return
 
-        print(f"Report generated: {report_file}")
+        print(f"Report generated: {report_file} ({writer.rows_written} carved files)")
         print("\nSummary:")
-        for row in file_type_summary:
-            print(f"- {row[0]}: {row[1]} files, Total Size: {row[2]} bytes, Largest File: {row[3]} bytes")
-
+        for row in report['file_type_summary']:
+            print(f"- {row['file_type']}: {row['file_count']} files, Total Size: {row['total_size']} bytes, "
+                  f"Largest File: {row['largest_file_size']} bytes")
+        dedup = report['deduplication']
+        print(f"Deduplication: {dedup['duplicate_hits']} of {report['total_files']} hits were duplicates, "
+              f"{dedup['bytes_saved']} bytes saved")
 
 
 def main():
@@ -378,11 +1281,26 @@ def main():
     evidence_path = input("Enter evidence file path: ").strip()
     output_path = input("Enter output directory path: ").strip()
 
-    analyzer = ForensicAnalyzer(evidence_path, case_id, output_path)
+    workers = input("Worker processes [1]: ").strip()
+    workers = int(workers) if workers.isdigit() and int(workers) > 0 else 1
+    unallocated_only = input("Carve unallocated space only? [y/N]: ").strip().lower() == 'y'
+    yara_rules = input("YARA rules directory (blank to skip): ").strip() or None
+    known_good = input("Known-good hash sets, comma separated (blank to skip): ").strip()
+    known_bad = input("Known-bad hash sets, comma separated (blank to skip): ").strip()
+    pack_output = input("Pack carved files into segment files? [y/N]: ").strip().lower() == 'y'
+    metrics_path = input("Metrics JSON file (blank to skip): ").strip() or None
+    block_map = input("Classify blocks while carving (skip text hits in encrypted regions)? [y/N]: ").strip().lower() == 'y'
+
+    analyzer = ForensicAnalyzer(evidence_path, case_id, output_path, workers=workers,
+                                unallocated_only=unallocated_only, yara_rules=yara_rules,
+                                known_good=[path.strip() for path in known_good.split(',') if path.strip()],
+                                known_bad=[path.strip() for path in known_bad.split(',') if path.strip()],
+                                pack_output=pack_output, metrics_path=metrics_path, block_map=block_map)
 
     print("1 - Analyze Disk")
     print("2 - Generate Report")
     print("3 - Exit")
+    print("4 - Resume Interrupted Analysis")
 
     while True:
         choice = input("Select an option: ").strip()
@@ -391,11 +1309,21 @@ def main():
             analyzer.analyze_disk()
             print("Analysis completed.")
         elif choice == "2":
+            report_format = input(f"Report format {'/'.join(REPORT_FORMATS)} [json]: ").strip().lower()
+            if report_format and report_format not in REPORT_FORMATS:
+                print("Invalid report format.")
+                continue
             print("Generating report...")
-            analyzer.generate_report()
+            analyzer.generate_report(report_format or 'json')
         elif choice == "3":
             print("Exiting.")
             break
+        elif choice == "4":
+            print("Resuming analysis from the last checkpoint...")
+            analyzer.resume = True
+            analyzer.analyze_disk()
+            analyzer.resume = False
+            print("Analysis completed.")
         else:
             print("Invalid option. Try again.")
 
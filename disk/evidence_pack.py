@@ -0,0 +1,313 @@
+"""Packed output for carved files: append-only segment files plus an index.
+
+Instead of one `{md5}.{ext}` file per carve, blobs are appended to segment
+files of up to PACK_SEGMENT_SIZE bytes (a large blob streamed into a segment
+may run past it). Each blob is preceded by a small
+record header (magic, name length, data length, name), so a segment can be
+listed or re-indexed on its own; where every blob lives is recorded in the
+case database's pack_index table, keyed by blob name and indexed by MD5.
+A blob packed by one shard worker that turns out to duplicate another
+worker's keeps its bytes, but its record is marked dead (PACK_DEAD).
+
+Restore carved files from a case database:
+
+    python evidence_pack.py extract case_1.db out/packs -o restored --md5 <md5> ...
+    python evidence_pack.py extract case_1.db out/packs -o restored --file-type JPG
+"""
+import os
+import sys
+import struct
+import sqlite3
+import argparse
+from threading import Lock
+
+
+PACK_SEGMENT_SIZE = 1024 * 1024 * 1024
+PACK_RECORD = struct.Struct('<4sHQ')  # magic, blob name length, data length
+PACK_MAGIC = b'DPK1'
+PACK_DEAD = b'DPK0'  # magic of a record whose blob is indexed from another record
+COPY_BLOCK = 1024 * 1024
+
+CREATE_PACK_INDEX = '''
+    CREATE TABLE IF NOT EXISTS pack_index (
+        blob TEXT PRIMARY KEY,
+        md5 TEXT,
+        segment TEXT,
+        offset INTEGER,
+        length INTEGER
+    )
+'''
+CREATE_PACK_MD5_INDEX = 'CREATE INDEX IF NOT EXISTS idx_pack_index_md5 ON pack_index (md5)'
+
+
+class _Segment:
+    """One open segment file; used by one writer at a time."""
+    def __init__(self, handle, name):
+        self.handle = handle
+        self.name = name
+        self.position = 0
+
+
+class PackStream:
+    """A blob streamed into a segment reserved for it until commit() or discard().
+
+    The record header is written as a placeholder and filled in by commit(),
+    once the blob name (its hash) and length are known; a name shorter than
+    the `name_length` reserved for it is padded with NUL bytes.
+    """
+    def __init__(self, pack, segment, name_length):
+        self.pack = pack
+        self.segment = segment
+        self.start = segment.position
+        self.name_length = name_length
+        self.offset = self.start + PACK_RECORD.size + name_length
+        self.length = 0
+        segment.handle.write(bytes(PACK_RECORD.size + name_length))
+
+    def write(self, data):
+        self.segment.handle.write(data)
+        self.length += len(data)
+
+    def commit(self, blob):
+        """Name the streamed blob and release the segment; returns its location."""
+        name = blob.encode()
+        if len(name) > self.name_length:
+            raise ValueError(f"blob name {blob} doesn't fit the reserved {self.name_length} bytes")
+        handle = self.segment.handle
+        handle.seek(self.start)
+        handle.write(PACK_RECORD.pack(PACK_MAGIC, self.name_length, self.length) + name.ljust(self.name_length, b'\0'))
+        handle.seek(0, os.SEEK_END)
+        handle.flush()
+        self.segment.position = self.offset + self.length
+        self.pack._release(self.segment, self.length)
+        return {'segment': self.segment.name, 'record': self.start, 'offset': self.offset, 'length': self.length}
+
+    def discard(self):
+        """Drop the streamed bytes (truncating the segment back) and release it."""
+        self.segment.handle.truncate(self.start)
+        self.segment.handle.seek(self.start)
+        self.segment.position = self.start
+        self.pack._release(self.segment, 0)
+
+
+class EvidencePack:
+    """Appends carved files to segment files in `pack_dir`.
+
+    Every EvidencePack (one per process) creates its own segments, claiming
+    the next free `segment-NNNNN.pack` name with an exclusive create, so
+    shard workers never append to the same file. Within a process, each
+    writer reserves a segment of its own: append() for blobs held in memory,
+    stream() for large ones written as they are carved. A segment is only
+    created when every existing one is busy, so there are as many open
+    segments as blobs being streamed at once, plus one. Thread-safe.
+    """
+    def __init__(self, pack_dir, segment_size=PACK_SEGMENT_SIZE):
+        self.pack_dir = pack_dir
+        self.segment_size = segment_size
+        os.makedirs(pack_dir, exist_ok=True)
+        self.lock = Lock()
+        self.idle = []  # open segments not reserved by a writer
+        self.next_number = 0
+        self.bytes_packed = 0
+
+    def _create(self):
+        while True:
+            name = f"segment-{self.next_number:05d}.pack"
+            self.next_number += 1
+            try:
+                return _Segment(open(os.path.join(self.pack_dir, name), 'xb'), name)
+            except FileExistsError:
+                continue
+
+    def _reserve(self, length=0):
+        """An idle segment with room for `length` more bytes (a new one if full or none is idle)."""
+        with self.lock:
+            segment = self.idle.pop() if self.idle else None
+            if segment is not None and segment.position and segment.position + length >= self.segment_size:
+                segment.handle.close()
+                segment = None
+            if segment is None:
+                segment = self._create()
+            return segment
+
+    def _release(self, segment, length):
+        with self.lock:
+            self.idle.append(segment)
+            self.bytes_packed += length
+
+    def append(self, blob, data=None, path=None, length=None):
+        """Append one blob from `data` or the file at `path` (`length` bytes).
+
+        Returns the blob's location as a dict with 'segment', 'record' (offset
+        of the record header), 'offset' (of the data, past the header) and
+        'length'.
+        """
+        name = blob.encode()
+        if length is None:
+            length = len(data) if data is not None else os.path.getsize(path)
+        segment = self._reserve(length)
+        record = segment.position
+        try:
+            segment.handle.write(PACK_RECORD.pack(PACK_MAGIC, len(name), length) + name)
+            offset = segment.position + PACK_RECORD.size + len(name)
+            if data is not None:
+                segment.handle.write(data)
+            else:
+                with open(path, 'rb') as source:
+                    copied = 0
+                    while copied < length:
+                        block = source.read(min(COPY_BLOCK, length - copied))
+                        if not block:
+                            raise IOError(f"{path} is shorter than {length} bytes")
+                        segment.handle.write(block)
+                        copied += len(block)
+            segment.position = offset + length
+        except Exception:
+            segment.handle.truncate(segment.position)
+            segment.handle.seek(segment.position)
+            self._release(segment, 0)
+            raise
+        self._release(segment, length)
+        return {'segment': segment.name, 'record': record, 'offset': offset, 'length': length}
+
+    def stream(self, name_length):
+        """Start streaming a blob whose name will be at most `name_length` bytes long."""
+        return PackStream(self, self._reserve(), name_length)
+
+    def read(self, pack):
+        """The bytes of a blob appended or committed by this pack."""
+        with open(os.path.join(self.pack_dir, pack['segment']), 'rb') as source:
+            source.seek(pack['offset'])
+            return source.read(pack['length'])
+
+    def location(self, pack):
+        """Printable location of a packed blob."""
+        return f"{os.path.join(self.pack_dir, pack['segment'])}@{pack['offset']}"
+
+    def retire(self, pack):
+        """Mark the record of a blob appended by a closed pack (a shard worker's) as dead."""
+        with open(os.path.join(self.pack_dir, pack['segment']), 'r+b') as segment:
+            segment.seek(pack['record'])
+            segment.write(PACK_DEAD)
+
+    def close(self):
+        with self.lock:
+            for segment in self.idle:
+                segment.handle.close()
+                if segment.position == 0:  # everything streamed into it was discarded
+                    os.remove(os.path.join(self.pack_dir, segment.name))
+            self.idle = []
+
+
+def iter_segment(path):
+    """Yield (blob, offset, length) for every live record in a segment file."""
+    with open(path, 'rb') as segment:
+        position = 0
+        while True:
+            header = segment.read(PACK_RECORD.size)
+            if len(header) < PACK_RECORD.size:
+                return
+            magic, name_length, length = PACK_RECORD.unpack(header)
+            if magic not in (PACK_MAGIC, PACK_DEAD):
+                raise ValueError(f"corrupt pack record at {path}:{position}")
+            blob = segment.read(name_length).rstrip(b'\0').decode()
+            offset = position + PACK_RECORD.size + name_length
+            if magic == PACK_MAGIC:
+                yield blob, offset, length
+            position = offset + length
+            segment.seek(position)
+
+
+class PackReader:
+    """Random access to packed blobs by blob name or MD5, through pack_index."""
+    def __init__(self, db_path, pack_dir):
+        self.pack_dir = pack_dir
+        self.conn = sqlite3.connect(db_path)
+
+    def find(self, md5=None, blob=None):
+        """(blob, segment, offset, length) rows for an MD5 or a blob name."""
+        if blob is not None:
+            return self.conn.execute('SELECT blob, segment, offset, length FROM pack_index WHERE blob = ?',
+                                     (blob,)).fetchall()
+        return self.conn.execute('SELECT blob, segment, offset, length FROM pack_index WHERE md5 = ?',
+                                 (md5,)).fetchall()
+
+    def blobs(self, file_type=None):
+        """Every packed blob, optionally only those carved as `file_type`, in segment order."""
+        if file_type is None:
+            return self.conn.execute('SELECT blob, segment, offset, length FROM pack_index '
+                                     'ORDER BY segment, offset')
+        return self.conn.execute('''
+            SELECT pack_index.blob, segment, pack_index.offset, length FROM pack_index
+            WHERE blob IN (SELECT blob FROM carved_files WHERE file_type = ?)
+            ORDER BY segment, pack_index.offset
+        ''', (file_type.upper(),))
+
+    def stream(self, segment, offset, length, block=COPY_BLOCK):
+        """Yield the bytes of one packed blob in blocks."""
+        with open(os.path.join(self.pack_dir, segment), 'rb') as source:
+            source.seek(offset)
+            remaining = length
+            while remaining:
+                data = source.read(min(block, remaining))
+                if not data:
+                    raise IOError(f"segment {segment} is truncated")
+                remaining -= len(data)
+                yield data
+
+    def extract(self, row, output_dir):
+        """Restore one packed blob as `output_dir/blob`; returns its path."""
+        blob, segment, offset, length = row
+        path = os.path.join(output_dir, blob)
+        with open(path, 'wb') as output:
+            for data in self.stream(segment, offset, length):
+                output.write(data)
+        return path
+
+    def close(self):
+        self.conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Restore or list carved files in packed output.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    extract = commands.add_parser('extract', help="restore packed files")
+    extract.add_argument('db_path', help="case database holding pack_index")
+    extract.add_argument('pack_dir')
+    extract.add_argument('-o', '--output', required=True)
+    extract.add_argument('--md5', nargs='*', default=None, help="only these MD5s")
+    extract.add_argument('--file-type', default=None, help="only files carved as this type")
+    listing = commands.add_parser('list', help="list the records of segment files")
+    listing.add_argument('segments', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for path in args.segments:
+            for blob, offset, length in iter_segment(path):
+                print(f"{path}@{offset}\t{length}\t{blob}")
+        return 0
+
+    os.makedirs(args.output, exist_ok=True)
+    reader = PackReader(args.db_path, args.pack_dir)
+    try:
+        if args.md5:
+            rows = []
+            for md5 in args.md5:
+                found = reader.find(md5=md5.lower())
+                if not found:
+                    print(f"{md5}: not in pack index")
+                rows.extend(found)
+        else:
+            rows = reader.blobs(args.file_type)
+        restored = 0
+        for row in rows:
+            reader.extract(row, args.output)
+            restored += 1
+        print(f"Restored {restored} files to {args.output}")
+    finally:
+        reader.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,358 @@
+import os
+import mmap
+import errno
+import stat
+import multiprocessing
+from functools import lru_cache
+from collections import OrderedDict
+from threading import Thread, Lock, Condition
+
+try:
+    import pyewf
+    PYEWF_AVAILABLE = True
+except ImportError:
+    PYEWF_AVAILABLE = False
+    print("pyewf not installed. E01 support disabled.")
+
+
+EMPTY_BLOCK = 64 * 1024  # granularity of constant-fill detection
+
+# Worker pools must not fork: by the time they start, the parent already runs
+# the E01 readahead, writer and output threads, and a forked child can inherit
+# one of their locks held.
+POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+
+@lru_cache(maxsize=32)
+def _fill_block(value, size):
+    return bytes((value,)) * size
+
+
+class RawImage:
+    """RAW/dd image backend: the file is memory-mapped and slices are zero-copy."""
+    def __init__(self, filename):
+        self.handle = open(filename, 'rb')
+        self.handle.seek(0, os.SEEK_END)
+        self.size = self.handle.tell()
+        self.handle.seek(0)
+        self.map = None
+        self.buffer = None
+        # Sparse files (and filesystems) report holes through SEEK_DATA.
+        self.sparse = hasattr(os, 'SEEK_DATA') and stat.S_ISREG(os.fstat(self.handle.fileno()).st_mode)
+        if self.size:
+            try:
+                self.map = mmap.mmap(self.handle.fileno(), self.size, access=mmap.ACCESS_READ)
+                self.buffer = memoryview(self.map)
+            except (OSError, ValueError) as e:
+                # Some devices can't be mapped; fall back to plain reads.
+                print(f"Memory mapping unavailable, using buffered reads: {e}")
+
+    def view(self, offset, size):
+        if self.buffer is not None:
+            return self.buffer[offset:offset + size]
+        self.handle.seek(offset)
+        return memoryview(self.handle.read(size))
+
+    def window(self, offset, size):
+        return self.view(offset, size)
+
+    def data_offset(self, offset):
+        """First offset at or after `offset` that isn't inside a hole."""
+        if not self.sparse or offset >= self.size:
+            return offset
+        try:
+            return os.lseek(self.handle.fileno(), offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                return self.size  # Only a hole up to the end of the file
+            self.sparse = False
+            return offset
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.release()
+            self.buffer = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                # Callers still hold slices; the map is released with them.
+                pass
+            self.map = None
+        self.handle.close()
+
+
+class BlockCache:
+    """LRU cache of decompressed blocks, bounded by a memory budget in bytes."""
+    def __init__(self, budget):
+        self.budget = budget
+        self.blocks = OrderedDict()
+        self.used = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, index):
+        with self.lock:
+            block = self.blocks.get(index)
+            if block is None:
+                self.misses += 1
+                return None
+            self.blocks.move_to_end(index)
+            self.hits += 1
+            return block
+
+    def put(self, index, block):
+        with self.lock:
+            old = self.blocks.pop(index, None)
+            if old is not None:
+                self.used -= len(old)
+            self.blocks[index] = block
+            self.used += len(block)
+            while self.used > self.budget and len(self.blocks) > 1:
+                _, evicted = self.blocks.popitem(last=False)
+                self.used -= len(evicted)
+
+    def __contains__(self, index):
+        with self.lock:
+            return index in self.blocks
+
+    def clear(self):
+        with self.lock:
+            self.blocks.clear()
+            self.used = 0
+
+
+class E01Image:
+    """E01 backend: decompressed chunks are served from an LRU block cache.
+
+    Blocks are aligned to the EWF chunk size (32 KiB by default), so one
+    cached block costs one zlib decompression. Once reads turn sequential, a
+    read-ahead thread with its own pyewf handle decompresses the next
+    `readahead` blocks into the cache, overlapping decompression with
+    carving; random metadata reads (boot sectors, FATs, directories) are
+    served from the cache when they repeat.
+    """
+    def __init__(self, filename, block_size=32768, cache_size=64 * 1024 * 1024, readahead=64):
+        self.filename = filename
+        self.handle = pyewf.handle()
+        self.handle.open(pyewf.glob(filename))
+        self.size = self.handle.get_media_size()
+        self.block_size = block_size
+        self.block_count = (self.size + block_size - 1) // block_size
+        self.cache = BlockCache(cache_size)
+        # Prefetched blocks must survive in the cache until they're used.
+        self.readahead = min(readahead, cache_size // block_size // 2)
+        self.ready = Condition()
+        self.inflight = set()
+        self.last_block = None
+        self.prefetch_next = 0
+        self.prefetch_until = 0
+        self.closing = False
+        self.prefetcher = None
+        if self.readahead > 0:
+            self.prefetcher = Thread(target=self._prefetch, name="e01-readahead", daemon=True)
+            self.prefetcher.start()
+
+    def _decompress(self, handle, index):
+        return handle.read_buffer_at_offset(self.block_size, index * self.block_size)
+
+    def _block(self, index):
+        with self.ready:
+            while index in self.inflight:
+                self.ready.wait()
+            self._schedule(index)
+        block = self.cache.get(index)
+        if block is None:
+            block = self._decompress(self.handle, index)
+            self.cache.put(index, block)
+        return block
+
+    def _schedule(self, index):
+        """Start or extend read-ahead when `index` continues a sequential run."""
+        if self.prefetcher is not None and self.last_block is not None and \
+                self.last_block <= index <= self.last_block + 1:
+            self.prefetch_next = max(self.prefetch_next, index + 1)
+            self.prefetch_until = min(index + 1 + self.readahead, self.block_count)
+            self.ready.notify_all()
+        self.last_block = index
+
+    def _prefetch(self):
+        handle = pyewf.handle()
+        handle.open(pyewf.glob(self.filename))
+        try:
+            while True:
+                with self.ready:
+                    while not self.closing and self.prefetch_next >= self.prefetch_until:
+                        self.ready.wait()
+                    if self.closing:
+                        return
+                    index = self.prefetch_next
+                    self.prefetch_next += 1
+                    if index in self.cache:
+                        continue
+                    self.inflight.add(index)
+                try:
+                    self.cache.put(index, self._decompress(handle, index))
+                except Exception:
+                    pass  # The reader decompresses it itself and reports the error.
+                finally:
+                    with self.ready:
+                        self.inflight.discard(index)
+                        self.ready.notify_all()
+        finally:
+            handle.close()
+
+    def view(self, offset, size):
+        size = max(0, min(size, self.size - offset))
+        first = offset // self.block_size
+        last = (offset + size - 1) // self.block_size
+        start = offset - first * self.block_size
+        if size == 0:
+            return memoryview(b'')
+        if first == last:
+            return memoryview(self._block(first))[start:start + size]
+        data = bytearray()
+        for index in range(first, last + 1):
+            data += self._block(index)
+        return memoryview(data)[start:start + size]
+
+    def window(self, offset, size):
+        return ImageWindow(self, offset, max(0, min(size, self.size - offset)))
+
+    def stats(self):
+        return {'hits': self.cache.hits, 'misses': self.cache.misses,
+                'cached_bytes': self.cache.used, 'budget': self.cache.budget}
+
+    def close(self):
+        if self.prefetcher is not None:
+            with self.ready:
+                self.closing = True
+                self.ready.notify_all()
+            self.prefetcher.join()
+            self.prefetcher = None
+        self.cache.clear()
+        self.handle.close()
+
+
+class ImageWindow:
+    """Lazy, indexable byte window over a backend, for images that can't be mapped."""
+    def __init__(self, image, offset, size):
+        self.image = image
+        self.offset = offset
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            data = self.image.view(self.offset + start, max(0, stop - start))
+            return bytes(data[::step]) if step != 1 else bytes(data)
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("window index out of range")
+        return self.image.view(self.offset + key, 1)[0]
+
+
+class DiskReader:
+    """Evidence reader with a file-like API plus zero-copy views.
+
+    read() keeps the sequential file semantics callers already rely on;
+    view() and window() return slices at an absolute offset without copying
+    (memoryview over the mmap for RAW, block-cached slices for E01).
+    `cache_size` (bytes) and `readahead` (blocks) only apply to E01.
+    """
+    def __init__(self, filename, disk_to_read=500000000, cache_size=64 * 1024 * 1024, readahead=64):
+        self.filename = filename
+        self.disk_to_read = disk_to_read
+        self.cache_size = cache_size
+        self.readahead = readahead
+        self.image = None
+        self.position = 0
+        self.file_type = self._detect_file_type()
+
+    def _detect_file_type(self):
+        ext = os.path.splitext(self.filename)[1].lower()
+        if ext == '.e01' and PYEWF_AVAILABLE:
+            return 'E01'
+        return 'RAW'
+
+    @property
+    def size(self):
+        return self.image.size if self.image else 0
+
+    def open(self):
+        try:
+            if self.file_type == 'E01':
+                self.image = E01Image(self.filename, cache_size=self.cache_size,
+                                      readahead=self.readahead)
+            else:
+                self.image = RawImage(self.filename)
+            self.position = 0
+            return True
+        except Exception as e:
+            print(f"Error opening file: {str(e)}")
+            return False
+
+    def read(self, size):
+        try:
+            data = bytes(self.image.view(self.position, size))
+            self.position += len(data)
+            return data
+        except Exception as e:
+            print(f"Error reading file: {str(e)}")
+            return None
+
+    def seek(self, offset):
+        self.position = offset
+
+    def tell(self):
+        return self.position
+
+    def view(self, offset, size):
+        try:
+            return self.image.view(offset, size)
+        except Exception as e:
+            print(f"Error reading file: {str(e)}")
+            return None
+
+    def window(self, offset, size):
+        return self.image.window(offset, size)
+
+    def empty_run(self, offset, limit, block_size=EMPTY_BLOCK):
+        """Length of the unused region at `offset`, at most up to `limit`.
+
+        Sparse holes are skipped through SEEK_DATA without reading them; after
+        that, whole blocks filled with a single byte value (zeroed or wiped
+        sectors) are compared against a prebuilt fill block with one memcmp
+        each. Returns 0 when `offset` starts with real data.
+        """
+        position = offset
+        data_offset = getattr(self.image, 'data_offset', None)
+        while position < limit:
+            if data_offset is not None:
+                data = data_offset(position)
+                if data > position:
+                    position = min(data, limit)
+                    continue
+            block = self.image.view(position, min(block_size, limit - position))
+            # startswith() memcmps the view in place; comparing a memoryview
+            # with == would go item by item, and tobytes() would copy it.
+            if not block or not _fill_block(block[0], len(block)).startswith(block):
+                break
+            position += len(block)
+        return position - offset
+
+    def cache_stats(self):
+        """Block cache counters for E01 evidence, None for RAW."""
+        stats = getattr(self.image, 'stats', None)
+        return stats() if stats else None
+
+    def close(self):
+        if self.image:
+            self.image.close()
+            self.image = None
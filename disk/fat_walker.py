@@ -0,0 +1,291 @@
+import sys
+import struct
+import datetime
+from array import array
+from functools import lru_cache
+
+
+DIR_ENTRY = struct.Struct('<11sBBBHHHHHHHI')
+LFN_ENTRY = struct.Struct('<B10sBBB12sH4s')
+
+ATTR_READ_ONLY = 0x01
+ATTR_HIDDEN = 0x02
+ATTR_SYSTEM = 0x04
+ATTR_VOLUME_ID = 0x08
+ATTR_DIRECTORY = 0x10
+ATTR_ARCHIVE = 0x20
+ATTR_LFN = 0x0F
+
+DELETED_MARKER = 0xE5
+END_OF_DIRECTORY = 0x00
+
+END_OF_CHAIN = {'FAT12': 0xFF8, 'FAT16': 0xFFF8, 'FAT32': 0x0FFFFFF8}
+
+
+def lfn_checksum(short_name):
+    checksum = 0
+    for byte in short_name:
+        checksum = (((checksum & 1) << 7) + (checksum >> 1) + byte) & 0xFF
+    return checksum
+
+
+def _recover_first_byte(short_name, checksum):
+    """First byte of a deleted short name that makes its LFN checksum match, or None."""
+    for candidate in range(0x20, 0x100):
+        if candidate == DELETED_MARKER:
+            continue
+        if lfn_checksum(bytes((candidate,)) + short_name[1:]) == checksum:
+            return candidate
+    return None
+
+
+@lru_cache(maxsize=65536)  # timestamps repeat heavily within a volume
+def dos_datetime(date, time=0, tenths=0):
+    """ISO timestamp for a FAT date/time pair, None for unset or invalid values."""
+    if date == 0:
+        return None
+    try:
+        value = datetime.datetime(1980 + (date >> 9), (date >> 5) & 0x0F, date & 0x1F,
+                                  time >> 11, (time >> 5) & 0x3F, (time & 0x1F) * 2)
+    except ValueError:
+        return None
+    return (value + datetime.timedelta(milliseconds=tenths * 10)).isoformat()
+
+
+def short_name_text(raw, lowercase_flags=0):
+    base = raw[:8].rstrip(b' ').decode('cp437', errors='replace')
+    ext = raw[8:11].rstrip(b' ').decode('cp437', errors='replace')
+    # NT stores all-lowercase 8.3 names as uppercase plus these flags.
+    if lowercase_flags & 0x08:
+        base = base.lower()
+    if lowercase_flags & 0x10:
+        ext = ext.lower()
+    return f"{base}.{ext}" if ext else base
+
+
+def parse_directory(data, base_offset=0, deleted_parent=False):
+    """Decode a directory's raw bytes into entry records.
+
+    All 32-byte slots are unpacked in one pass with struct.iter_unpack; long
+    file name slots are collected and attached to the short entry that
+    follows when their checksum matches. Deleted entries (first byte 0xE5)
+    are returned with 'deleted' set, their LFN name restored when possible.
+    Decoding stops at the end-of-directory marker.
+    """
+    records = []
+    lfn_parts = []
+    usable = len(data) // DIR_ENTRY.size * DIR_ENTRY.size
+    for index, fields in enumerate(DIR_ENTRY.iter_unpack(memoryview(data)[:usable])):
+        (raw_name, attributes, nt_flags, ctime_tenths, ctime, cdate, adate,
+         cluster_high, mtime, mdate, cluster_low, size) = fields
+        first = raw_name[0]
+        if first == END_OF_DIRECTORY:
+            break
+        if attributes & 0x3F == ATTR_LFN:
+            lfn_parts.append(LFN_ENTRY.unpack_from(data, index * DIR_ENTRY.size))
+            continue
+
+        parts, lfn_parts = lfn_parts, []
+        if attributes & ATTR_VOLUME_ID or raw_name in (b'.          ', b'..         '):
+            continue
+
+        deleted = first == DELETED_MARKER
+        long_name = None
+        if parts:
+            checksum = parts[0][4]
+            if all(part[4] == checksum for part in parts):
+                if deleted:
+                    restored = _recover_first_byte(raw_name, checksum)
+                    if restored is not None:
+                        raw_name = bytes((restored,)) + raw_name[1:]
+                elif lfn_checksum(raw_name) != checksum:
+                    checksum = None
+                if checksum is not None:
+                    # Slots are stored last part first.
+                    text = b''.join(p[1] + p[5] + p[7] for p in reversed(parts))
+                    long_name = text.decode('utf-16-le', errors='replace').split('\0')[0]
+        if raw_name[0] == DELETED_MARKER:
+            raw_name = b'_' + raw_name[1:]
+        elif raw_name[0] == 0x05:  # 0xE5 escaped as a real first character
+            raw_name = b'\xe5' + raw_name[1:]
+
+        short_name = short_name_text(raw_name, nt_flags)
+        records.append({
+            'name': long_name or short_name,
+            'short_name': short_name,
+            'attributes': attributes,
+            'is_directory': bool(attributes & ATTR_DIRECTORY),
+            'deleted': deleted or deleted_parent,
+            'first_cluster': cluster_high << 16 | cluster_low,
+            'size': size,
+            'created': dos_datetime(cdate, ctime, ctime_tenths),
+            'modified': dos_datetime(mdate, mtime),
+            'accessed': dos_datetime(adate),
+            'entry_offset': base_offset + index * DIR_ENTRY.size,
+        })
+    return records
+
+
+class FatWalker:
+    """Walks the full directory tree of a FAT12/16/32 volume.
+
+    The FAT is decoded once into an array (a zero-copy cast over the mmap for
+    RAW evidence) so cluster chains are followed with plain indexing.
+    walk() is a generator of entry records, one dict per file or directory,
+    including deleted entries and the contents of deleted directories whose
+    first cluster still holds a directory.
+    """
+    def __init__(self, reader, geometry):
+        self.reader = reader
+        self.geometry = geometry
+        self.end_of_chain = END_OF_CHAIN[geometry.fat_type]
+        self.fat = self._load_fat()
+
+    def _load_fat(self):
+        geometry = self.geometry
+        data = self.reader.view(geometry.fat_offset, geometry.fat_size)
+        data = data if data is not None else memoryview(b'')
+        if geometry.fat_type == 'FAT12':
+            return bytes(data)
+        typecode = 'H' if geometry.fat_type == 'FAT16' else 'I'
+        itemsize = 2 if typecode == 'H' else 4
+        data = data[:len(data) // itemsize * itemsize]
+        if sys.byteorder == 'little':
+            return data.cast(typecode)
+        table = array(typecode, bytes(data))
+        table.byteswap()
+        return table
+
+    def next_cluster(self, cluster):
+        """FAT entry of `cluster`: the next cluster, 0 if free, >= end_of_chain at the end."""
+        geometry = self.geometry
+        if geometry.fat_type == 'FAT12':
+            offset = cluster * 3 // 2
+            if offset + 1 >= len(self.fat):
+                return self.end_of_chain
+            value = self.fat[offset] | self.fat[offset + 1] << 8
+            return value >> 4 if cluster & 1 else value & 0xFFF
+        if cluster >= len(self.fat):
+            return self.end_of_chain
+        value = self.fat[cluster]
+        return value & 0x0FFFFFFF if geometry.fat_type == 'FAT32' else value
+
+    def is_allocated(self, cluster):
+        return self.next_cluster(cluster) != 0
+
+    def chain(self, cluster):
+        """Clusters of the chain starting at `cluster`, stopping on loops and bad links."""
+        last = self.geometry.cluster_count + 2
+        seen = set()
+        while 2 <= cluster < last and cluster not in seen:
+            seen.add(cluster)
+            yield cluster
+            cluster = self.next_cluster(cluster)
+
+    def cluster_runs(self, clusters):
+        """Coalesce cluster numbers into (offset, length) runs of contiguous clusters."""
+        size = self.geometry.cluster_size
+        start = previous = None
+        for cluster in clusters:
+            if previous is not None and cluster == previous + 1:
+                previous = cluster
+                continue
+            if start is not None:
+                yield self.geometry.cluster_offset(start), (previous - start + 1) * size
+            start = previous = cluster
+        if start is not None:
+            yield self.geometry.cluster_offset(start), (previous - start + 1) * size
+
+    def file_runs(self, record):
+        """Byte runs holding a file's data.
+
+        Live files follow their cluster chain. The chain of a deleted file is
+        gone, so its data is assumed to be contiguous from the first cluster.
+        """
+        size = record['size']
+        first = record['first_cluster']
+        if first < 2 or (size == 0 and not record['is_directory']):
+            return
+        if record['deleted'] or not self.is_allocated(first):
+            count = max(1, (size + self.geometry.cluster_size - 1) // self.geometry.cluster_size)
+            runs = self.cluster_runs(range(first, min(first + count, self.geometry.cluster_count + 2)))
+        else:
+            runs = self.cluster_runs(self.chain(first))
+        remaining = size if not record['is_directory'] else None
+        for offset, length in runs:
+            if remaining is not None:
+                length = min(length, remaining)
+                remaining -= length
+            if length:
+                yield offset, length
+            if remaining == 0:
+                return
+
+    def _read_runs(self, runs):
+        data = bytearray()
+        for offset, length in runs:
+            view = self.reader.view(offset, length)
+            if view:
+                data += view
+        return data
+
+    def _root(self):
+        geometry = self.geometry
+        if geometry.fat_type == 'FAT32':
+            runs = list(self.cluster_runs(self.chain(geometry.root_cluster)))
+        else:
+            runs = [(geometry.root_dir_offset, geometry.root_dir_size)]
+        return runs
+
+    def walk(self):
+        """Yield a record for every entry in the tree, depth first.
+
+        Records carry 'path' (parent directory path plus name) and
+        'data_offset' (absolute offset of the first cluster, or None).
+        """
+        stack = [('', self._root(), False)]
+        visited = set()
+        while stack:
+            path, runs, deleted = stack.pop()
+            if not runs or runs[0][0] in visited:
+                continue
+            visited.add(runs[0][0])
+            subdirectories = []
+            for record in parse_directory(self._read_runs(runs), 0, deleted):
+                if self.geometry.fat_type != 'FAT32':
+                    record['first_cluster'] &= 0xFFFF  # the high word is only used by FAT32
+                record['entry_offset'] = self._absolute(runs, record['entry_offset'])
+                first = record['first_cluster']
+                record['path'] = f"{path}/{record['name']}"
+                record['data_offset'] = self.geometry.cluster_offset(first) if first >= 2 else None
+                yield record
+                if record['is_directory'] and first >= 2:
+                    child = self._directory_runs(record)
+                    if child:
+                        subdirectories.append((record['path'], child, record['deleted']))
+            stack.extend(reversed(subdirectories))
+
+    @staticmethod
+    def _absolute(runs, position):
+        """Map a position in the concatenated runs back to an evidence offset."""
+        for offset, length in runs:
+            if position < length:
+                return offset + position
+            position -= length
+        return None
+
+    def _directory_runs(self, record):
+        first = record['first_cluster']
+        if first >= self.geometry.cluster_count + 2:
+            return None
+        if not record['deleted']:
+            return list(self.cluster_runs(self.chain(first)))
+        # A deleted directory is only followed if its first cluster is free
+        # and still starts with the '.' entry.
+        if self.is_allocated(first):
+            return None
+        offset = self.geometry.cluster_offset(first)
+        head = self.reader.view(offset, 11)
+        if head is None or bytes(head) != b'.          ':
+            return None
+        return [(offset, self.geometry.cluster_size)]
@@ -0,0 +1,299 @@
+"""Compact on-disk hash sets for known-file filtering (NSRL-style known-good
+lists, known-bad lists).
+
+A hash set file holds one algorithm's digests, sorted and deduplicated, in a
+single memory-mapped file:
+
+    header | fan-out table | sorted digests | Bloom filter
+
+The fan-out table gives the index of the first digest for every two-byte
+prefix, so an exact lookup is a short binary search inside one bucket. The
+Bloom filter answers most negatives without touching the digest array at
+all; it is blocked (all bits of a digest fall in one 64-bit word) and takes
+its bits straight from the digest bytes, so a negative costs one read and
+no rehashing. Only the pages a lookup actually touches are read, so sets of
+100M+ entries stay far below their file size in resident memory.
+
+Build a set from text hash lists (one hash per line, or NSRL CSV rows):
+
+    python hashset.py build NSRLFile.txt -o nsrl_md5.hset --algorithm md5
+"""
+import os
+import re
+import sys
+import mmap
+import heapq
+import struct
+import argparse
+import tempfile
+from array import array
+
+
+HASHSET_MAGIC = b'DTHASH01'
+HEADER = struct.Struct('<8s8sIIQQ')  # magic, algorithm, digest size, Bloom hashes, count, Bloom words
+HEADER_SIZE = 64
+FANOUT_ENTRIES = 65536 + 1  # first index per two-byte prefix, plus the total
+FANOUT = struct.Struct(f'<{FANOUT_ENTRIES}Q')
+DIGESTS_OFFSET = HEADER_SIZE + FANOUT.size
+
+DIGEST_SIZES = {'md5': 16, 'sha1': 20, 'sha256': 32}
+BLOOM_BITS_PER_ENTRY = 10
+BLOOM_HASHES = 7  # bits set per digest, taken from digest bytes 8-14 (~1.5% false positives)
+RUN_ENTRIES = 4 * 1024 * 1024  # digests sorted in memory per run while building
+READ_BLOCK = 1024 * 1024
+
+
+def bloom_slot(digest, words, hashes):
+    """(word index, bit mask) of `digest` in a blocked Bloom filter of `words` 64-bit words."""
+    mask = 0
+    for byte in digest[8:8 + hashes]:
+        mask |= 1 << (byte & 63)
+    return int.from_bytes(digest[:8], 'little') % words, mask
+
+
+class HashSet:
+    """Read-only, memory-mapped hash set file.
+
+    `digest in hash_set` accepts raw digests or hex strings; values of the
+    wrong length are simply not members, so one set can be asked about MD5,
+    SHA-1 and SHA-256 values alike.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.handle = open(path, 'rb')
+        self.map = mmap.mmap(self.handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, algorithm, digest_size, bloom_hashes, count, bloom_words = HEADER.unpack_from(self.map, 0)
+        if magic != HASHSET_MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a hash set file")
+        self.algorithm = algorithm.rstrip(b'\0').decode()
+        self.digest_size = digest_size
+        self.bloom_hashes = bloom_hashes
+        self.bloom_words = bloom_words
+        self.count = count
+        self.bloom_offset = DIGESTS_OFFSET + count * digest_size
+        self.lookups = 0
+        self.bloom_rejects = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, value):
+        if isinstance(value, str):
+            if len(value) != self.digest_size * 2:
+                return False
+            try:
+                value = bytes.fromhex(value)
+            except ValueError:
+                return False
+        elif len(value) != self.digest_size:
+            return False
+        self.lookups += 1
+        if not self._maybe_contains(value):
+            self.bloom_rejects += 1
+            return False
+        return self._find(value)
+
+    def _maybe_contains(self, digest):
+        if not self.bloom_words:
+            return True
+        word, mask = bloom_slot(digest, self.bloom_words, self.bloom_hashes)
+        start = self.bloom_offset + word * 8
+        return int.from_bytes(self.map[start:start + 8], 'little') & mask == mask
+
+    def _find(self, digest):
+        prefix = digest[0] << 8 | digest[1]
+        low, high = struct.unpack_from('<QQ', self.map, HEADER_SIZE + prefix * 8)
+        size = self.digest_size
+        data = self.map
+        while low < high:
+            middle = (low + high) // 2
+            start = DIGESTS_OFFSET + middle * size
+            entry = data[start:start + size]
+            if entry < digest:
+                low = middle + 1
+            elif entry > digest:
+                high = middle
+            else:
+                return True
+        return False
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.handle.close()
+
+
+class HashSetBuilder:
+    """Builds a hash set file from any number of digests with bounded memory.
+
+    Digests are collected in runs of `run_entries`, each run is sorted and
+    spilled to a temporary file, and the runs are merged (deduplicating) into
+    the final file while the fan-out table and Bloom filter are filled in.
+    Memory is one run plus the Bloom filter (BLOOM_BITS_PER_ENTRY bits per entry).
+    """
+    def __init__(self, algorithm='md5', run_entries=RUN_ENTRIES, temp_dir=None):
+        if algorithm not in DIGEST_SIZES:
+            raise ValueError(f"unsupported hash algorithm {algorithm}")
+        self.algorithm = algorithm
+        self.digest_size = DIGEST_SIZES[algorithm]
+        self.run_entries = run_entries
+        self.temp_dir = temp_dir
+        self.hex_pattern = re.compile(rb'(?<![0-9A-Fa-f])[0-9A-Fa-f]{%d}(?![0-9A-Fa-f])'
+                                      % (self.digest_size * 2))
+        self.current = []
+        self.runs = []
+        self.added = 0
+
+    def add(self, digest):
+        if len(digest) != self.digest_size:
+            raise ValueError(f"expected a {self.digest_size}-byte {self.algorithm} digest")
+        self.current.append(bytes(digest))
+        self.added += 1
+        if len(self.current) >= self.run_entries:
+            self._spill()
+
+    def add_text(self, path):
+        """Add the first hex digest of the right length on each line of a text file."""
+        added = 0
+        with open(path, 'rb') as text:
+            for line in text:
+                match = self.hex_pattern.search(line)
+                if match:
+                    self.add(bytes.fromhex(match.group().decode()))
+                    added += 1
+        return added
+
+    def _spill(self):
+        self.current.sort()
+        handle = tempfile.NamedTemporaryFile(prefix='hashset-run-', dir=self.temp_dir, delete=False)
+        with handle:
+            handle.write(b''.join(self.current))
+        self.runs.append(handle.name)
+        self.current = []
+
+    def _read_run(self, path):
+        size = self.digest_size
+        block = READ_BLOCK // size * size
+        with open(path, 'rb') as run:
+            while True:
+                data = run.read(block)
+                if not data:
+                    return
+                for start in range(0, len(data), size):
+                    yield data[start:start + size]
+
+    def write(self, path):
+        """Merge everything added so far into the hash set file at `path`; returns its entry count."""
+        self.current.sort()
+        sources = [self._read_run(run) for run in self.runs] + [iter(self.current)]
+        bloom_words = max(1, (self.added * BLOOM_BITS_PER_ENTRY + 63) // 64)
+        bloom = array('Q', bytes(8 * bloom_words))
+        counts = array('Q', bytes(8 * FANOUT_ENTRIES))
+        count = 0
+        previous = None
+        partial_path = f"{path}.part"
+        try:
+            with open(partial_path, 'wb') as output:
+                output.seek(DIGESTS_OFFSET)
+                pending = []
+                for digest in heapq.merge(*sources):
+                    if digest == previous:
+                        continue
+                    previous = digest
+                    pending.append(digest)
+                    counts[(digest[0] << 8 | digest[1]) + 1] += 1
+                    word, mask = bloom_slot(digest, bloom_words, BLOOM_HASHES)
+                    bloom[word] |= mask
+                    count += 1
+                    if len(pending) >= 65536:
+                        output.write(b''.join(pending))
+                        pending = []
+                output.write(b''.join(pending))
+                if sys.byteorder != 'little':
+                    bloom.byteswap()
+                output.write(bloom.tobytes())
+
+                for prefix in range(1, FANOUT_ENTRIES):
+                    counts[prefix] += counts[prefix - 1]
+                output.seek(0)
+                output.write(HEADER.pack(HASHSET_MAGIC, self.algorithm.encode(), self.digest_size,
+                                         BLOOM_HASHES, count, bloom_words).ljust(HEADER_SIZE, b'\0'))
+                output.write(FANOUT.pack(*counts))
+            os.replace(partial_path, path)
+        finally:
+            for run in self.runs:
+                os.remove(run)
+            self.runs = []
+            self.current = []
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return count
+
+
+class HashFilter:
+    """Known-good / known-bad verdicts for carved files, from hash set files.
+
+    check() looks each set up with the digest of its own algorithm from a
+    record's hashes; known-bad wins over known-good.
+    """
+    def __init__(self, known_good=(), known_bad=()):
+        self.known_good = []
+        self.known_bad = []
+        try:
+            for paths, sets in ((known_good, self.known_good), (known_bad, self.known_bad)):
+                for path in paths:
+                    sets.append(HashSet(path))
+        except Exception:
+            self.close()  # don't leak the sets already opened
+            raise
+
+    def __bool__(self):
+        return bool(self.known_good or self.known_bad)
+
+    def check(self, hashes):
+        """'bad', 'good' or None for a dict of hex digests by algorithm name."""
+        for verdict, sets in (('bad', self.known_bad), ('good', self.known_good)):
+            for hash_set in sets:
+                digest = hashes.get(hash_set.algorithm)
+                if digest is not None and digest in hash_set:
+                    return verdict
+        return None
+
+    def close(self):
+        for hash_set in self.known_good + self.known_bad:
+            hash_set.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build or query hash set files.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="convert text hash lists into a hash set file")
+    build.add_argument('inputs', nargs='+', help="text files with one hash per line (NSRL CSV works)")
+    build.add_argument('-o', '--output', required=True)
+    build.add_argument('--algorithm', choices=sorted(DIGEST_SIZES), default='md5')
+    build.add_argument('--temp-dir', default=None, help="where sorted runs are spilled while building")
+    lookup = commands.add_parser('lookup', help="check hex digests against a hash set file")
+    lookup.add_argument('hashset')
+    lookup.add_argument('digests', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        builder = HashSetBuilder(args.algorithm, temp_dir=args.temp_dir)
+        for path in args.inputs:
+            print(f"{path}: {builder.add_text(path)} hashes")
+        count = builder.write(args.output)
+        print(f"Wrote {count} unique {args.algorithm} hashes to {args.output}")
+    else:
+        hash_set = HashSet(args.hashset)
+        try:
+            for digest in args.digests:
+                print(f"{digest}: {'found' if digest in hash_set else 'not found'}")
+        finally:
+            hash_set.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
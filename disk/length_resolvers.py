@@ -0,0 +1,235 @@
+import re
+import struct
+
+
+SCAN_WINDOW = 1024 * 1024
+
+# Returned by a resolver whose walk shows the hit isn't a file of its type,
+# as opposed to None when the length can't be told (truncated, too large).
+INVALID = -1
+
+# JPEG markers inside entropy-coded data: FF followed by anything but a
+# stuffed zero, a restart marker or another fill byte.
+JPEG_MARKER = re.compile(rb'\xff[^\x00\xd0-\xd7\xff]')
+ZIP_EOCD = re.compile(re.escape(bytes([0x50, 0x4B, 0x05, 0x06])))
+# A trailer (group 1: its startxref offset) or the header of the next document.
+PDF_TRAILER = re.compile(rb'startxref\s+(\d+)\s*%%EOF(?:\r\n|\r|\n)?|%PDF-')
+PDF_XREF_TARGET = re.compile(rb'xref|\d+\s+\d+\s+obj')
+PDF_UPDATE = re.compile(rb'\s*(?:xref|\d+\s+\d+\s+obj)')  # start of an appended incremental update
+PDF_LOOKAHEAD = 1024
+
+ZIP_CENTRAL_HEADER = bytes([0x50, 0x4B, 0x01, 0x02])
+ZIP64_MARKER = 0xFFFFFFFF  # central directory offset moved to the ZIP64 end record
+
+OLE_FREE_SECTOR = 0xFFFFFFFF
+OLE_END_OF_CHAIN = 0xFFFFFFFE
+
+
+def _read(reader, offset, size):
+    data = reader.view(offset, size)
+    return bytes(data) if data is not None else b''
+
+
+def _finditer(reader, pattern, start, end, overlap=64):
+    """Yield (absolute offset, match) for pattern hits in [start, end), window by window."""
+    pos = start
+    last = -1
+    while pos < end:
+        size = min(SCAN_WINDOW + overlap, end - pos)
+        window = reader.view(pos, size)
+        if not window:
+            return
+        for match in pattern.finditer(window):
+            found = pos + match.start()
+            if found > last:
+                last = found
+                yield found, match
+        if len(window) < size:
+            return
+        pos += SCAN_WINDOW
+
+
+def resolve_png(reader, offset, max_size):
+    """Walk PNG chunks up to IEND; INVALID when the first chunk isn't IHDR."""
+    pos = offset + 8
+    end = offset + max_size
+    while pos + 12 <= end:
+        head = _read(reader, pos, 8)
+        if len(head) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', head)
+        if pos == offset + 8 and chunk_type != b'IHDR':
+            return INVALID
+        if not chunk_type.isalpha():
+            return None
+        pos += 12 + length
+        if chunk_type == b'IEND':
+            return pos - offset if pos <= end else None
+    return None
+
+
+def resolve_jpeg(reader, offset, max_size):
+    """Walk JPEG segments, skipping entropy-coded scans, up to EOI."""
+    pos = offset + 2
+    end = offset + max_size
+    while pos + 4 <= end:
+        head = _read(reader, pos, 4)
+        if len(head) < 2 or head[0] != 0xFF:
+            return None
+        marker = head[1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker == 0xD9:  # EOI
+            return pos + 2 - offset
+        if 0xD0 <= marker <= 0xD7 or marker == 0x01:  # standalone markers
+            pos += 2
+            continue
+        if marker < 0xC0 or marker == 0xD8:
+            # Reserved codes, or an SOI outside a segment: the walk has left this
+            # image's data (e.g. a fragment gap), so its end can't be told.
+            return None
+        if len(head) < 4:
+            return None
+        length = struct.unpack('>H', head[2:4])[0]
+        if length < 2:
+            return None
+        if marker == 0xDA:
+            components = _read(reader, pos + 4, 1)
+            if not components or not 1 <= components[0] <= 4 or length != 6 + 2 * components[0]:
+                return None  # not a scan header of this image
+        pos += 2 + length
+        if marker == 0xDA:  # SOS: skip the scan data to the next real marker
+            for found, match in _finditer(reader, JPEG_MARKER, pos, end):
+                pos = found
+                break
+            else:
+                return None
+    return None
+
+
+def resolve_zip(reader, offset, max_size):
+    """Length up to the end of the first end-of-central-directory record of this archive.
+
+    An EOCD belongs to the archive when its central directory lies between
+    `offset` and the EOCD and starts with a central file header. EOCDs whose
+    directory would start before `offset` belong to an archive that starts
+    earlier; INVALID when every EOCD found is one of those, e.g. for a hit
+    on a local header in the middle of an archive. An EOCD that fits but
+    whose directory isn't where it says may be this archive fragmented (or a
+    later archive's), so the length is unknown then.
+    """
+    misplaced = False
+    seen = False
+    for found, match in _finditer(reader, ZIP_EOCD, offset + 4, offset + max_size):
+        record = _read(reader, found, 22)
+        if len(record) < 22:
+            return None
+        seen = True
+        cd_size, cd_offset, comment_length = struct.unpack('<IIH', record[12:22])
+        if cd_offset != ZIP64_MARKER:
+            if cd_offset + cd_size > found - offset:
+                continue
+            if cd_size and _read(reader, offset + cd_offset, 4) != ZIP_CENTRAL_HEADER:
+                misplaced = True
+                continue
+        return found + 22 + comment_length - offset
+    return INVALID if seen and not misplaced else None
+
+
+def resolve_ole(reader, offset, max_size):
+    """Size of an OLE2 compound file from the highest sector used in its FAT."""
+    header = _read(reader, offset, 512)
+    if len(header) < 512:
+        return None
+    sector_shift = struct.unpack('<H', header[0x1E:0x20])[0]
+    if sector_shift not in (9, 12):
+        return INVALID
+    sector_size = 1 << sector_shift
+    fat_count, = struct.unpack('<I', header[0x2C:0x30])
+    difat_next, difat_count = struct.unpack('<II', header[0x44:0x4C])
+    if fat_count == 0:
+        return INVALID
+    if fat_count * sector_size > max_size:
+        return None
+
+    fat_sectors = [s for s in struct.unpack('<109I', header[0x4C:0x200]) if s < OLE_END_OF_CHAIN]
+    for _ in range(difat_count):
+        if difat_next >= OLE_END_OF_CHAIN:
+            break
+        sector = _read(reader, offset + (difat_next + 1) * sector_size, sector_size)
+        if len(sector) < sector_size:
+            return None
+        entries = struct.unpack(f'<{sector_size // 4}I', sector)
+        fat_sectors.extend(s for s in entries[:-1] if s < OLE_END_OF_CHAIN)
+        difat_next = entries[-1]
+    fat_sectors = fat_sectors[:fat_count]
+
+    entries_per_sector = sector_size // 4
+    last_used = -1
+    for index, sector_number in enumerate(fat_sectors):
+        sector = _read(reader, offset + (sector_number + 1) * sector_size, sector_size)
+        if len(sector) < sector_size:
+            return None
+        # Free entries are 0xFFFFFFFF, so the used part is what's left after stripping them.
+        used = len(sector.rstrip(b'\xff'))
+        if used:
+            last_used = max(last_used, index * entries_per_sector + (used + 3) // 4 - 1)
+    if last_used < 0:
+        return None
+    size = (last_used + 2) * sector_size  # +1 for the header sector
+    return size if size <= max_size else None
+
+
+def resolve_pdf(reader, offset, max_size):
+    """End of the last trailer whose startxref points back into the document.
+
+    Trailers are walked forward one at a time. Trailers of unrelated data are
+    rejected because their xref offset doesn't land on an xref table or
+    stream. Incremental updates append further trailers, so a valid trailer
+    only ends the document when the PDF_LOOKAHEAD bytes after it don't start
+    another update; the next PDF header ends it too. The scan therefore
+    stops near the end of the document instead of running to max_size.
+    """
+    length = None
+    for found, match in _finditer(reader, PDF_TRAILER, offset + 5, offset + max_size, overlap=256):
+        if match.group(1) is None:  # the next document's header
+            break
+        xref = int(match.group(1))
+        if xref >= found - offset:
+            continue
+        target = _read(reader, offset + xref, 32)
+        if not PDF_XREF_TARGET.match(target):
+            continue
+        length = found + len(match.group(0)) - offset
+        if not PDF_UPDATE.match(_read(reader, offset + length, PDF_LOOKAHEAD)):
+            break
+    return length
+
+
+RESOLVERS = {
+    'JPG': resolve_jpeg,
+    'PNG': resolve_png,
+    'PDF': resolve_pdf,
+    'ZIP': resolve_zip,
+    'XLSX': resolve_zip,
+    'PPTX': resolve_zip,
+    'DOC': resolve_ole,
+    'XLS': resolve_ole,
+    'PPT': resolve_ole,
+}
+
+
+def resolve_length(reader, file_type, offset, max_size):
+    """Return the exact length of the file starting at `offset`, None if unknown
+    or INVALID if its structure shows it isn't a `file_type` file."""
+    resolver = RESOLVERS.get(file_type)
+    if resolver is None:
+        return None
+    try:
+        length = resolver(reader, offset, max_size)
+    except (struct.error, ValueError, IndexError):
+        return None
+    if length == INVALID:
+        return INVALID
+    return length if length and length > 0 else None
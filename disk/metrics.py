@@ -0,0 +1,194 @@
+import os
+import io
+import sys
+import json
+import time
+import pstats
+import cProfile
+import tracemalloc
+from threading import Lock
+
+
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines
+PROFILE_TOP = 25  # functions / allocation sites kept in profile summaries
+
+SIGNATURE_FIELDS = ('hits', 'dropped', 'aborted', 'carved', 'bytes', 'footer_time')
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'started')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.add_time(self.stage, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """Per-stage timers and counters for one carving run.
+
+    Stages accumulate wall time and call counts (read, header_search,
+    footer_search, validation, length_resolve, yara, hash, write, sqlite,
+    ...); time spent in the output pipeline's worker threads is summed over
+    the threads. Counters hold byte and file totals, and every signature
+    type gets its own hits / dropped / aborted / carved / bytes /
+    footer_time row, which is where a slow or noisy signature shows up.
+    Thread-safe; shard workers send snapshot() back and the parent merge()s.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.stages = {}  # stage -> [seconds, calls]
+        self.counters = {}
+        self.signatures = {}  # file type -> {field: value}
+
+    def stage(self, name):
+        """Context manager timing one pass through stage `name`."""
+        return _StageTimer(self, name)
+
+    def add_time(self, stage, seconds, calls=1):
+        with self.lock:
+            entry = self.stages.get(stage)
+            if entry is None:
+                entry = self.stages[stage] = [0.0, 0]
+            entry[0] += seconds
+            entry[1] += calls
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def signature(self, file_type, field, value=1):
+        with self.lock:
+            row = self.signatures.get(file_type)
+            if row is None:
+                row = self.signatures[file_type] = dict.fromkeys(SIGNATURE_FIELDS, 0)
+            row[field] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'stages': {name: {'seconds': seconds, 'calls': calls}
+                           for name, (seconds, calls) in self.stages.items()},
+                'counters': dict(self.counters),
+                'signatures': {file_type: dict(row) for file_type, row in self.signatures.items()},
+            }
+
+    def merge(self, snapshot):
+        for name, stage in snapshot['stages'].items():
+            self.add_time(name, stage['seconds'], stage['calls'])
+        for name, value in snapshot['counters'].items():
+            self.count(name, value)
+        for file_type, row in snapshot['signatures'].items():
+            for field, value in row.items():
+                self.signature(file_type, field, value)
+
+    def report(self):
+        """Human-readable summary lines: stages by time, then signatures by hits."""
+        snapshot = self.snapshot()
+        lines = ["Stage times:"]
+        for name, stage in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append(f"- {name}: {stage['seconds']:.2f}s over {stage['calls']} calls")
+        if snapshot['signatures']:
+            lines.append("Signatures:")
+            for file_type, row in sorted(snapshot['signatures'].items(), key=lambda item: -item[1]['hits']):
+                lines.append(f"- {file_type}: {row['hits']} hits, {row['dropped']} dropped, "
+                             f"{row['aborted']} aborted, {row['carved']} carved ({row['bytes']} bytes), "
+                             f"footer search {row['footer_time']:.2f}s")
+        return lines
+
+    def dump(self, path, extra=None):
+        """Write the metrics (plus `extra` run information) as JSON."""
+        data = dict(extra or {})
+        data.update(self.snapshot())
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=4)
+
+
+class ProgressMeter:
+    """Prints a progress line with throughput and ETA every `interval` seconds."""
+    def __init__(self, total_bytes, interval=PROGRESS_INTERVAL, label="Progress"):
+        self.total = total_bytes
+        self.interval = interval
+        self.label = label
+        self.done = 0
+        self.started = time.perf_counter()
+        self.last_print = self.started
+
+    def adjust_total(self, delta):
+        self.total = max(0, self.total + delta)
+
+    def advance(self, size):
+        self.done += size
+        now = time.perf_counter()
+        if now - self.last_print >= self.interval:
+            self.last_print = now
+            print(self.line(now))
+
+    def line(self, now=None):
+        elapsed = (now or time.perf_counter()) - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        fraction = min(self.done / self.total, 1.0) if self.total else 1.0
+        remaining = (self.total - self.done) / rate if rate and self.total > self.done else 0
+        minutes, seconds = divmod(int(remaining), 60)
+        hours, minutes = divmod(minutes, 60)
+        return (f"{self.label}: {fraction:.1%} ({self.done / 1048576:.0f} of {self.total / 1048576:.0f} MB), "
+                f"{rate / 1048576:.1f} MB/s, ETA {hours}:{minutes:02d}:{seconds:02d}")
+
+
+class ChunkProfiler:
+    """Opt-in cProfile + tracemalloc capture of the one chunk that contains `offset`.
+
+    wrap() returns a feed function that profiles the sampled chunk and passes
+    every other chunk straight through. The capture is written to
+    `{path_prefix}.prof` (pstats) and `{path_prefix}.mem.txt` (top
+    allocation sites). Only the carving thread is profiled; work done by the
+    output pipeline's threads shows up in the Metrics stage times instead.
+    """
+    def __init__(self, offset, path_prefix):
+        self.offset = offset
+        self.path_prefix = path_prefix
+        self.captured = False
+
+    def wrap(self, feed):
+        def profiled_feed(chunk, offset):
+            if self.captured or not offset <= self.offset < offset + len(chunk):
+                return feed(chunk, offset)
+            self.captured = True
+            return self.capture(feed, chunk, offset)
+        return profiled_feed
+
+    def capture(self, feed, chunk, offset):
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        profiler = cProfile.Profile()
+        before = tracemalloc.take_snapshot()
+        profiler.enable()
+        try:
+            return feed(chunk, offset)
+        finally:
+            profiler.disable()
+            after = tracemalloc.take_snapshot()
+            if not tracing:
+                tracemalloc.stop()
+            self._save(profiler, after.compare_to(before, 'lineno'), offset, len(chunk))
+
+    def _save(self, profiler, allocations, offset, size):
+        directory = os.path.dirname(self.path_prefix)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(f"{self.path_prefix}.prof")
+        with open(f"{self.path_prefix}.mem.txt", 'w') as f:
+            f.write(f"Allocations while carving the chunk at offset {offset} ({size} bytes):\n")
+            for stat in allocations[:PROFILE_TOP]:
+                f.write(f"{stat}\n")
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(PROFILE_TOP)
+        print(f"Profiled chunk at offset {offset}: {self.path_prefix}.prof, {self.path_prefix}.mem.txt")
+        sys.stdout.write(summary.getvalue())
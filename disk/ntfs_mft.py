@@ -0,0 +1,338 @@
+import struct
+import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+from evidence_reader import POOL_CONTEXT, DiskReader
+from volumes import Volume, ntfs_geometry
+
+
+RECORD_HEADER = struct.Struct('<4sHHQHHHHIIQH')
+ATTRIBUTE_HEADER = struct.Struct('<IIBBHHH')
+RESIDENT_HEADER = struct.Struct('<IH')
+NONRESIDENT_HEADER = struct.Struct('<QQHHIQQQ')
+STANDARD_INFORMATION = struct.Struct('<QQQQI')
+FILE_NAME = struct.Struct('<QQQQQQQIIBB')
+
+ATTR_STANDARD_INFORMATION = 0x10
+ATTR_ATTRIBUTE_LIST = 0x20
+ATTR_FILE_NAME = 0x30
+ATTR_DATA = 0x80
+ATTR_END = 0xFFFFFFFF
+
+RECORD_IN_USE = 0x01
+RECORD_DIRECTORY = 0x02
+
+NAMESPACE_DOS = 2
+FIXUP_STRIDE = 512
+
+MFT_RECORD = 0
+BITMAP_RECORD = 6
+
+BATCH_RECORDS = 1024  # records read per view while streaming
+SEGMENT_RECORDS = 65536  # records per process-pool task
+
+_FILETIME_EPOCH = datetime.datetime(1601, 1, 1)
+
+
+def filetime(value):
+    """ISO timestamp for a Windows FILETIME, None for unset or out-of-range values."""
+    if not value:
+        return None
+    try:
+        return (_FILETIME_EPOCH + datetime.timedelta(microseconds=value // 10)).isoformat()
+    except OverflowError:
+        return None
+
+
+def apply_fixups(record):
+    """Restore the sector tails of a bytearray record from its update sequence array.
+
+    Returns False when a tail doesn't carry the update sequence number,
+    i.e. the record was torn by an interrupted write.
+    """
+    usa_offset, usa_count = struct.unpack_from('<HH', record, 4)
+    if usa_count == 0 or usa_offset + usa_count * 2 > len(record):
+        return False
+    usn = record[usa_offset:usa_offset + 2]
+    intact = True
+    for index in range(1, usa_count):
+        tail = index * FIXUP_STRIDE - 2
+        if tail + 2 > len(record):
+            break
+        if record[tail:tail + 2] != usn:
+            intact = False
+        record[tail:tail + 2] = record[usa_offset + index * 2:usa_offset + index * 2 + 2]
+    return intact
+
+
+def decode_runlist(data, offset=0):
+    """Decode a non-resident runlist into (lcn, cluster count) pairs; lcn is None for sparse runs."""
+    runs = []
+    lcn = 0
+    while offset < len(data):
+        header = data[offset]
+        if header == 0:
+            break
+        length_size, offset_size = header & 0x0F, header >> 4
+        offset += 1
+        if length_size == 0 or offset + length_size + offset_size > len(data):
+            break
+        count = int.from_bytes(data[offset:offset + length_size], 'little')
+        offset += length_size
+        if offset_size:
+            lcn += int.from_bytes(data[offset:offset + offset_size], 'little', signed=True)
+            runs.append((lcn, count))
+        else:
+            runs.append((None, count))
+        offset += offset_size
+    return runs
+
+
+def iter_attributes(record, offset):
+    """Yield (type, header fields, attribute offset) for each attribute of a fixed-up record."""
+    while offset + ATTRIBUTE_HEADER.size <= len(record):
+        fields = ATTRIBUTE_HEADER.unpack_from(record, offset)
+        attr_type, length = fields[0], fields[1]
+        if attr_type == ATTR_END or length < ATTRIBUTE_HEADER.size or offset + length > len(record):
+            return
+        yield attr_type, fields, offset
+        offset += length
+
+
+def parse_record(data, record_number, cluster_size=4096, volume_offset=0, max_resident=1024 * 1024):
+    """Decode one MFT record into a dict, or None if the slot holds no record.
+
+    Covers the record header, $STANDARD_INFORMATION, the preferred
+    $FILE_NAME (Win32 over DOS), the unnamed $DATA stream (runs as absolute
+    (offset, length) byte pairs, or the resident bytes) and the names of
+    alternate data streams. Records without the in-use flag are returned
+    with 'deleted' set; their attributes are usually still intact.
+    """
+    if len(data) < RECORD_HEADER.size or data[:4] != b'FILE':
+        return None
+    record = bytearray(data)
+    fixup_ok = apply_fixups(record)
+    (_, _, _, lsn, sequence, link_count, attrs_offset, flags,
+     used_size, _, base_reference, _) = RECORD_HEADER.unpack_from(record)
+    record = record[:min(used_size, len(record))] if used_size else record
+
+    result = {
+        'record_number': record_number,
+        'sequence': sequence,
+        'lsn': lsn,
+        'in_use': bool(flags & RECORD_IN_USE),
+        'deleted': not flags & RECORD_IN_USE,
+        'is_directory': bool(flags & RECORD_DIRECTORY),
+        'base_record': base_reference & 0xFFFFFFFFFFFF,
+        'link_count': link_count,
+        'fixup_ok': fixup_ok,
+        'name': None,
+        'parent_record': None,
+        'parent_sequence': None,
+        'created': None, 'modified': None, 'mft_modified': None, 'accessed': None,
+        'fn_created': None, 'fn_modified': None,
+        'file_attributes': None,
+        'size': None,
+        'allocated_size': None,
+        'runs': [],
+        'resident_data': None,
+        'streams': [],
+        'has_attribute_list': False,
+    }
+    best_namespace = None
+    for attr_type, fields, offset in iter_attributes(record, attrs_offset):
+        _, length, non_resident, name_length, name_offset, _, _ = fields
+        name = ''
+        if name_length:
+            name = record[offset + name_offset:offset + name_offset + name_length * 2]
+            name = name.decode('utf-16-le', errors='replace')
+
+        if non_resident:
+            (start_vcn, _, runlist_offset, _, _, allocated, real_size, _) = \
+                NONRESIDENT_HEADER.unpack_from(record, offset + 16)
+            value = None
+        else:
+            value_length, value_offset = RESIDENT_HEADER.unpack_from(record, offset + 16)
+            value = record[offset + value_offset:offset + value_offset + value_length]
+
+        if attr_type == ATTR_STANDARD_INFORMATION and value is not None \
+                and len(value) >= STANDARD_INFORMATION.size:
+            created, modified, mft_modified, accessed, attributes = STANDARD_INFORMATION.unpack_from(value)
+            result.update(created=filetime(created), modified=filetime(modified),
+                          mft_modified=filetime(mft_modified), accessed=filetime(accessed),
+                          file_attributes=attributes)
+        elif attr_type == ATTR_FILE_NAME and value is not None and len(value) >= FILE_NAME.size:
+            (parent, created, modified, _, _, _, real_fn, _, _,
+             name_chars, namespace) = FILE_NAME.unpack_from(value)
+            # Prefer the Win32 name over the 8.3 DOS alias.
+            if best_namespace is None or best_namespace == NAMESPACE_DOS:
+                best_namespace = namespace
+                result.update(
+                    name=value[66:66 + name_chars * 2].decode('utf-16-le', errors='replace'),
+                    parent_record=parent & 0xFFFFFFFFFFFF, parent_sequence=parent >> 48,
+                    fn_created=filetime(created), fn_modified=filetime(modified))
+                if result['size'] is None:
+                    result['size'] = real_fn
+        elif attr_type == ATTR_DATA:
+            if name:
+                result['streams'].append(name)
+                continue
+            if value is not None:
+                result['size'] = len(value)
+                result['allocated_size'] = len(value)
+                if len(value) <= max_resident:
+                    result['resident_data'] = bytes(value)
+                continue
+            if start_vcn == 0:  # sizes are only valid in the first extent
+                result['size'] = real_size
+                result['allocated_size'] = allocated
+            for lcn, count in decode_runlist(record, offset + runlist_offset):
+                result['runs'].append((None if lcn is None else volume_offset + lcn * cluster_size,
+                                       count * cluster_size))
+        elif attr_type == ATTR_ATTRIBUTE_LIST:
+            result['has_attribute_list'] = True
+    return result
+
+
+class MftParser:
+    """Streams the records of an NTFS volume's $MFT.
+
+    The $MFT's own runlist is read from record 0, so a fragmented MFT is
+    followed run by run; records are read BATCH_RECORDS at a time and parsed
+    one by one, so memory stays bounded whatever the MFT size. Extension
+    records (non-zero 'base_record') are yielded as they are; callers that
+    need complete attribute sets merge them by base record.
+    """
+    def __init__(self, reader, geometry, batch_records=BATCH_RECORDS, mft_runs=None):
+        self.reader = reader
+        self.geometry = geometry
+        self.record_size = geometry.record_size
+        self.batch_records = batch_records
+        self.mft_runs = mft_runs if mft_runs is not None else self._mft_runs()
+        self.record_count = sum(length for _, length in self.mft_runs) // self.record_size
+
+    def _read_record_at(self, offset):
+        data = self.reader.view(offset, self.record_size)
+        return bytes(data) if data is not None else b''
+
+    def _mft_runs(self):
+        record = parse_record(self._read_record_at(self.geometry.mft_offset), MFT_RECORD,
+                              self.geometry.cluster_size, self.geometry.volume_offset)
+        if record is None or not record['runs']:
+            raise ValueError("unreadable $MFT record")
+        # Trim allocation slack so only initialized records are walked.
+        runs, remaining = [], record['size']
+        for offset, length in record['runs']:
+            if offset is None or remaining <= 0:
+                break
+            runs.append((offset, min(length, remaining)))
+            remaining -= length
+        return runs
+
+    def record_offset(self, number):
+        """Absolute offset of MFT record `number`, or None past the end."""
+        position = number * self.record_size
+        for offset, length in self.mft_runs:
+            if position < length:
+                return offset + position
+            position -= length
+        return None
+
+    def record(self, number):
+        offset = self.record_offset(number)
+        if offset is None:
+            return None
+        return parse_record(self._read_record_at(offset), number,
+                            self.geometry.cluster_size, self.geometry.volume_offset)
+
+    def records(self, first=0, last=None):
+        """Yield parsed records numbered [first, last), skipping empty slots."""
+        last = self.record_count if last is None else min(last, self.record_count)
+        number = first
+        while number < last:
+            offset = self.record_offset(number)
+            # Stay within one run of the MFT so every batch is contiguous.
+            run_left = self._run_remaining(number)
+            count = min(self.batch_records, last - number, run_left)
+            batch = self.reader.view(offset, count * self.record_size)
+            if not batch:
+                return
+            for index in range(len(batch) // self.record_size):
+                data = batch[index * self.record_size:(index + 1) * self.record_size]
+                record = parse_record(data, number + index, self.geometry.cluster_size,
+                                      self.geometry.volume_offset)
+                if record is not None:
+                    yield record
+            number += count
+
+    def _run_remaining(self, number):
+        position = number * self.record_size
+        for _, length in self.mft_runs:
+            if position < length:
+                return (length - position) // self.record_size
+            position -= length
+        return 0
+
+    def read_data(self, record, limit=None):
+        """The unnamed $DATA stream of a parsed record (sparse runs read as zeros)."""
+        if record['resident_data'] is not None:
+            return record['resident_data']
+        size = record['size'] if limit is None else min(record['size'], limit)
+        data = bytearray()
+        for offset, length in record['runs']:
+            length = min(length, size - len(data))
+            if length <= 0:
+                break
+            if offset is None:
+                data += bytes(length)
+            else:
+                view = self.reader.view(offset, length)
+                data += view if view else b''
+        return bytes(data)
+
+
+def parse_mft_segment(evidence_path, volume_start, volume_size, mft_runs, first, last):
+    """Process-pool worker: parse MFT records [first, last) with a reader of its own."""
+    reader = DiskReader(evidence_path)
+    if not reader.open():
+        raise IOError(f"cannot open {evidence_path}")
+    try:
+        geometry = ntfs_geometry(reader, Volume(0, 'MBR', None, 'NTFS', volume_start, volume_size))
+        parser = MftParser(reader, geometry, mft_runs=mft_runs)
+        return list(parser.records(first, last))
+    finally:
+        reader.close()
+
+
+def iter_mft(evidence_path, volume, workers=1, segment_records=SEGMENT_RECORDS):
+    """Yield every MFT record of an NTFS volume in record order.
+
+    With workers > 1 the MFT is split into segments parsed by a process
+    pool; at most 2 * workers segments are in flight, so memory stays
+    bounded while records still come out in order.
+    """
+    reader = DiskReader(evidence_path)
+    if not reader.open():
+        raise IOError(f"cannot open {evidence_path}")
+    try:
+        geometry = ntfs_geometry(reader, volume)
+        if geometry is None:
+            raise ValueError("not an NTFS volume")
+        parser = MftParser(reader, geometry)
+        if workers <= 1:
+            yield from parser.records()
+            return
+
+        segments = [(first, min(first + segment_records, parser.record_count))
+                    for first in range(0, parser.record_count, segment_records)]
+        with ProcessPoolExecutor(max_workers=workers, mp_context=POOL_CONTEXT) as pool:
+            pending = []
+            for first, last in segments:
+                pending.append(pool.submit(parse_mft_segment, evidence_path, volume.start, volume.size,
+                                           parser.mft_runs, first, last))
+                if len(pending) >= 2 * workers:
+                    yield from pending.pop(0).result()
+            for future in pending:
+                yield from future.result()
+    finally:
+        reader.close()
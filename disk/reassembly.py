@@ -0,0 +1,393 @@
+import re
+import struct
+import zlib
+
+from evidence_reader import DiskReader
+
+
+FRAGMENT_BLOCK = 512  # fragments start and end on sector boundaries
+FRAGMENT_GAP = 4 * 1024 * 1024  # furthest a second fragment is searched for
+SPLIT_WINDOW = 32  # blocks before the first inconsistency tried as the end of fragment one
+JPEG_EVIDENCE = 16  # stuffed bytes and restart markers that settle a JPEG continuation
+JPEG_MIN_EVIDENCE = 2  # fewer than this and a continuation is likely a stray EOI in foreign data
+PROBE_SIZE = 4096  # bytes of a continuation checked before reading the rest
+INFLATE_PIECE = 1024 * 1024
+
+COMPLETE = 'complete'
+TRUNCATED = 'truncated'
+ERROR = 'error'
+UNCHECKED = 'unchecked'
+
+# Inside entropy-coded data every FF is a stuffed zero, a fill byte or a marker.
+JPEG_SCAN_MARKER = re.compile(rb'\xff[^\x00\xff]')
+JPEG_EVIDENCE_MARKER = re.compile(rb'\xff[\x00\xd0-\xd7]')
+JPEG_SEGMENTS = frozenset(
+    [m for m in range(0xC0, 0xD0) if m != 0xC8] + list(range(0xDA, 0xE0)) +
+    list(range(0xE0, 0xF0)) + [0xFE]
+)
+# Segments that may follow a scan: tables and the next scan.
+JPEG_SCAN_SEGMENTS = frozenset([0xC4, 0xDA, 0xDB, 0xDC, 0xDD])
+
+ZIP_LOCAL = struct.Struct('<4sHHHHHIIIHH')
+ZIP_CENTRAL = struct.Struct('<4sHHHHHHIIIHHHHHII')
+ZIP_EOCD = struct.Struct('<4sHHHHIIH')
+ZIP_ANCHOR = re.compile(rb'PK\x03\x04|PK\x01\x02')
+
+
+def _read(reader, offset, size):
+    data = reader.view(offset, size)
+    return bytes(data) if data is not None else b''
+
+
+def _jpeg_segment_ok(data, pos, marker, length):
+    """Check the fixed layout of table and scan headers, so a marker that is
+    really foreign data is caught here rather than by the jump it causes."""
+    if marker in (0xDC, 0xDD):  # DNL, DRI
+        return length == 4
+    if marker == 0xDA:  # SOS: 1-4 components, two bytes each
+        return 1 <= data[pos + 4] <= 4 and length == 6 + 2 * data[pos + 4]
+    if marker == 0xC4:  # DHT: table class 0-1, id 0-3
+        return data[pos + 4] & 0xEC == 0
+    if marker == 0xDB:  # DQT: 8- or 16-bit tables, id 0-3
+        table = pos + 4
+        end = pos + 2 + length
+        while table < end:
+            if data[table] & 0xEC:
+                return False
+            table += 1 + 64 * ((data[table] >> 4) + 1)
+        return table == end
+    return True
+
+
+def check_jpeg(data, next_rst=None):
+    """Walk the JPEG in `data` and report how far it stays consistent.
+
+    Segment lengths must chain from marker to marker, entropy-coded scans
+    may only contain stuffed bytes, restart markers in sequence (RST0-7,
+    wrapping) and the markers allowed between scans. Returns
+    (status, position, next_rst):
+      COMPLETE, length through EOI;
+      ERROR, offset of the first inconsistency;
+      TRUNCATED, len(data), and the restart marker expected next when
+      `data` ends inside a scan (None elsewhere).
+    With `next_rst`, `data` is taken to continue a scan.
+    """
+    size = len(data)
+    in_scan = next_rst is not None
+    if not in_scan:
+        if data[:3] != b'\xff\xd8\xff':
+            return ERROR, 0, None
+        pos = 2
+    else:
+        pos = 0
+
+    while True:
+        if in_scan:
+            match = JPEG_SCAN_MARKER.search(data, pos)
+            if match is None:
+                return TRUNCATED, size, next_rst
+            pos = match.start()
+            marker = data[pos + 1]
+            if 0xD0 <= marker <= 0xD7:
+                if marker - 0xD0 != next_rst:
+                    return ERROR, pos, None
+                next_rst = (next_rst + 1) & 7
+                pos += 2
+                continue
+            if marker == 0xD9:
+                return COMPLETE, pos + 2, None
+            if marker not in JPEG_SCAN_SEGMENTS:
+                return ERROR, pos, None
+            in_scan = False
+            next_rst = None
+
+        if pos + 4 > size:
+            return TRUNCATED, size, None
+        if data[pos] != 0xFF:
+            return ERROR, pos, None
+        marker = data[pos + 1]
+        if marker == 0xFF:  # fill byte
+            pos += 1
+            continue
+        if marker == 0xD9:
+            return COMPLETE, pos + 2, None
+        if marker not in JPEG_SEGMENTS:
+            return ERROR, pos, None
+        length = data[pos + 2] << 8 | data[pos + 3]
+        if length < 2:
+            return ERROR, pos, None
+        if pos + 2 + length > size:
+            return TRUNCATED, size, None
+        if not _jpeg_segment_ok(data, pos, marker, length):
+            return ERROR, pos, None
+        pos += 2 + length
+        if marker == 0xDA:
+            in_scan = True
+            next_rst = 0
+
+
+def _inflate_crc(body):
+    """CRC-32 of the inflated `body`, or None if it isn't one complete deflate stream."""
+    inflater = zlib.decompressobj(-15)
+    crc = 0
+    pending = body
+    try:
+        while pending and not inflater.eof:
+            crc = zlib.crc32(inflater.decompress(pending, INFLATE_PIECE), crc)
+            pending = inflater.unconsumed_tail
+        crc = zlib.crc32(inflater.flush(), crc)
+    except zlib.error:
+        return None
+    return crc if inflater.eof else None
+
+
+def _inflate_error(body, block_size):
+    """End of the first block of `body` where inflating fails, or None."""
+    inflater = zlib.decompressobj(-15)
+    for pos in range(0, len(body), block_size):
+        try:
+            inflater.decompress(body[pos:pos + block_size])
+        except zlib.error:
+            return pos + block_size
+        if inflater.eof and pos + block_size < len(body):
+            return pos + block_size  # the stream ended before the entry did
+    return None
+
+
+def zip_entry_ok(method, body, crc):
+    """Check an entry's data against its CRC; True for methods that can't be checked."""
+    if method == 0:
+        return zlib.crc32(body) == crc
+    if method == 8:
+        return _inflate_crc(body) == crc
+    return True
+
+
+def check_zip(data):
+    """Walk the ZIP in `data`: local entries with their CRCs, then the central directory.
+
+    Returns (status, position, entry) like check_jpeg. On an ERROR inside an
+    entry's data, `entry` is (header offset, data offset, compressed size,
+    CRC, method) and position is the header offset. Archives the walk can't
+    verify (data descriptors, ZIP64 sizes) are UNCHECKED.
+    """
+    size = len(data)
+    pos = 0
+    local_offsets = set()
+    while data[pos:pos + 4] == b'PK\x03\x04':
+        if pos + ZIP_LOCAL.size > size:
+            return TRUNCATED, size, None
+        (_, _, flags, method, _, _, crc, compressed, _,
+         name_length, extra_length) = ZIP_LOCAL.unpack_from(data, pos)
+        if flags & 0x08 or compressed == 0xFFFFFFFF:
+            return UNCHECKED, pos, None
+        start = pos + ZIP_LOCAL.size + name_length + extra_length
+        entry = (pos, start, compressed, crc, method)
+        if start + compressed > size or not zip_entry_ok(method, data[start:start + compressed], crc):
+            return ERROR, pos, entry
+        local_offsets.add(pos)
+        pos = start + compressed
+    if not local_offsets:
+        return ERROR, pos, None
+
+    directory = pos
+    entries = 0
+    while data[pos:pos + 4] == b'PK\x01\x02':
+        if pos + ZIP_CENTRAL.size > size:
+            return TRUNCATED, size, None
+        fields = ZIP_CENTRAL.unpack_from(data, pos)
+        if fields[16] not in local_offsets:
+            return ERROR, pos, None
+        pos += ZIP_CENTRAL.size + fields[10] + fields[11] + fields[12]
+        entries += 1
+    if pos + ZIP_EOCD.size > size:
+        return TRUNCATED, size, None
+    fields = ZIP_EOCD.unpack_from(data, pos)
+    if fields[0] != b'PK\x05\x06' or fields[6] != directory or fields[4] != entries:
+        return ERROR, pos, None
+    return COMPLETE, pos + ZIP_EOCD.size + fields[7], None
+
+
+def validate_jpeg(data):
+    status, _, _ = check_jpeg(data)
+    return status == COMPLETE
+
+
+def validate_zip(data):
+    status, _, _ = check_zip(data)
+    return None if status == UNCHECKED else status == COMPLETE
+
+
+def reassemble_jpeg(reader, offset, data, max_size, block_size=FRAGMENT_BLOCK, max_gap=FRAGMENT_GAP):
+    """Find the second fragment of a JPEG broken inside its entropy-coded scan.
+
+    Fragment one ends on a block boundary at or before the first
+    inconsistency; each candidate start of fragment two is checked with the
+    scan state at the split, so it has to carry on with the expected restart
+    marker and nothing but legal scan bytes until EOI. Candidates are cheap
+    to reject: only PROBE_SIZE bytes are read until one looks plausible.
+    Surviving candidates are scored by the stuffed bytes and restart markers
+    they contain, since foreign data reaches a stray EOI now and then; the
+    best score wins and JPEG_EVIDENCE of them ends the search early.
+    """
+    status, error, _ = check_jpeg(data)
+    if status != ERROR:
+        return None
+    last_split = error // block_size * block_size
+    first_split = max(block_size, last_split - SPLIT_WINDOW * block_size)
+    # Every probe is a slice of one read of the whole search window.
+    base = offset + first_split + block_size
+    window = reader.view(base, last_split - first_split + max_gap + PROBE_SIZE)
+    if not window:
+        return None
+    checked = {}
+
+    def continuation(start, next_rst, remaining):
+        key = (start, next_rst)
+        if key not in checked:
+            checked[key] = None
+            tail = window[start - base:start - base + min(PROBE_SIZE, remaining)]
+            status, length, _ = check_jpeg(tail, next_rst)
+            if status == TRUNCATED and JPEG_EVIDENCE_MARKER.search(tail) and len(tail) < remaining:
+                tail = _read(reader, start, remaining)
+                status, length, _ = check_jpeg(tail, next_rst)
+            if status == COMPLETE:
+                score = len(JPEG_EVIDENCE_MARKER.findall(tail, 0, length))
+                checked[key] = (score, length) if score >= JPEG_MIN_EVIDENCE else None
+        return checked[key]
+
+    best = None
+    for split in range(last_split, first_split - 1, -block_size):
+        status, _, next_rst = check_jpeg(memoryview(data)[:split])
+        if status != TRUNCATED or next_rst is None:
+            continue
+        for gap in range(block_size, max_gap + 1, block_size):
+            second = offset + split + gap
+            found = continuation(second, next_rst, max_size - split)
+            if found is None or (best is not None and found[0] <= best[0]):
+                continue
+            score, length = found
+            if validate_jpeg(bytes(data[:split]) + _read(reader, second, length)):
+                best = (score, [(offset, split), (second, length)])
+                if score >= JPEG_EVIDENCE:
+                    return best[1]
+    return best[1] if best else None
+
+
+def reassemble_zip(reader, offset, data, max_size, block_size=FRAGMENT_BLOCK, max_gap=FRAGMENT_GAP):
+    """Find the second fragment of a ZIP whose entry CRC or header chain breaks.
+
+    The structure after the break (the next local or central header) sits
+    at a known position of the reassembled file, so every gap is read off
+    the header signatures in the search window. For each gap, block-aligned
+    splits inside the broken entry are tried until its CRC matches; the
+    winner must then walk through to a consistent end of central directory.
+    """
+    status, error, entry = check_zip(data)
+    if status != ERROR:
+        return None
+    if entry is not None:
+        header, start, compressed, crc, method = entry
+        anchor = start + compressed
+        body = data[start:anchor]
+        failed = _inflate_error(body, block_size) if method == 8 else None
+        highest = min(start + failed, anchor - 1) if failed else anchor - 1
+        lowest = header
+    else:
+        anchor = highest = lowest = error
+    splits = [split for split in range(highest // block_size * block_size,
+                                       lowest // block_size * block_size - 1, -block_size)
+              if 0 < split < len(data)]
+    if not splits:
+        return None
+
+    search_start = offset + anchor + block_size
+    window = reader.view(search_start, max_gap)
+    if not window:
+        return None
+    for match in ZIP_ANCHOR.finditer(window):
+        gap = search_start + match.start() - offset - anchor
+        if gap % block_size:
+            continue
+        for split in splits:
+            second = offset + split + gap
+            if entry is not None:
+                rebuilt = bytes(data[:split]) + _read(reader, second, anchor - split)
+                if not zip_entry_ok(method, rebuilt[start:anchor], crc):
+                    continue
+            assembled = bytes(data[:split]) + _read(reader, second, max_size - split)
+            status, length, _ = check_zip(assembled)
+            if status == COMPLETE and length > split:
+                return [(offset, split), (second, length - split)]
+    return None
+
+
+VALIDATORS = {
+    'JPG': validate_jpeg,
+    'ZIP': validate_zip,
+    'XLSX': validate_zip,
+    'PPTX': validate_zip,
+}
+
+REASSEMBLERS = {
+    'JPG': reassemble_jpeg,
+    'ZIP': reassemble_zip,
+    'XLSX': reassemble_zip,
+    'PPTX': reassemble_zip,
+}
+
+
+def validate(file_type, data):
+    """True if `data` is a consistent file of `file_type`, False if broken, None if unknown."""
+    validator = VALIDATORS.get(file_type)
+    if validator is None:
+        return None
+    try:
+        return validator(data)
+    except (struct.error, ValueError, IndexError):
+        return False
+
+
+def reassemble(reader, file_type, offset, size, max_size, block_size=FRAGMENT_BLOCK,
+               max_gap=FRAGMENT_GAP):
+    """Bifragment gap carving for a carved file that fails validation.
+
+    `offset` and `size` are the carve as found by header/footer or length
+    resolution. Returns the (offset, length) extents of the two fragments,
+    or None when the carve validates, can't be checked or no second
+    fragment fits within `max_gap` bytes.
+    """
+    reassembler = REASSEMBLERS.get(file_type)
+    if reassembler is None:
+        return None
+    data = _read(reader, offset, size)
+    if validate(file_type, data) is not False:
+        return None
+    try:
+        return reassembler(reader, offset, data, max_size, block_size, max_gap)
+    except (struct.error, ValueError, IndexError):
+        return None
+
+
+def find_fragments(reader, candidates, block_size=FRAGMENT_BLOCK, max_gap=FRAGMENT_GAP):
+    """Reassemble the (file_type, offset, size, max_size) candidates that are fragmented.
+
+    Returns (file_type, offset, extents) for every file that was put back together.
+    """
+    found = []
+    for file_type, offset, size, max_size in candidates:
+        extents = reassemble(reader, file_type, offset, size, max_size, block_size, max_gap)
+        if extents:
+            found.append((file_type, offset, extents))
+    return found
+
+
+def reassemble_batch(evidence_path, candidates, options):
+    """Process-pool worker: find_fragments() over a batch with a reader of its own."""
+    reader = DiskReader(evidence_path, cache_size=options['cache_size'])
+    if not reader.open():
+        raise IOError(f"cannot open {evidence_path}")
+    try:
+        return find_fragments(reader, candidates, options['fragment_block'], options['fragment_gap'])
+    finally:
+        reader.close()
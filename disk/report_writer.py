@@ -0,0 +1,169 @@
+import json
+import sqlite3
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+    ARROW_AVAILABLE = True
+except ImportError:
+    ARROW_AVAILABLE = False
+    print("pyarrow not installed. Parquet/Arrow report export disabled.")
+
+
+REPORT_BATCH = 10000  # carved_files rows fetched and written per step
+REPORT_FORMATS = ('json', 'ndjson', 'parquet', 'arrow')
+
+# The file_type index covers the per-type summary (and the dedup totals taken
+# from it); recovery_time serves MIN/MAX; md5 and offset serve lookups.
+REPORT_INDEXES = (
+    'CREATE INDEX IF NOT EXISTS idx_carved_files_file_type ON carved_files (file_type, duplicate, size)',
+    'CREATE INDEX IF NOT EXISTS idx_carved_files_md5 ON carved_files (md5)',
+    'CREATE INDEX IF NOT EXISTS idx_carved_files_offset ON carved_files (offset)',
+    'CREATE INDEX IF NOT EXISTS idx_carved_files_recovery_time ON carved_files (recovery_time)',
+)
+
+FILE_TYPE_SUMMARY = '''
+    SELECT file_type,
+        COUNT(*) AS file_count,
+        SUM(size) AS total_size,
+        MAX(size) AS largest_file_size,
+        COALESCE(SUM(duplicate), 0) AS duplicate_hits,
+        COALESCE(SUM(CASE WHEN duplicate = 1 THEN size ELSE 0 END), 0) AS duplicate_bytes
+    FROM carved_files
+    GROUP BY file_type
+'''
+
+
+def ensure_indexes(conn):
+    """Create the carved_files indexes the report queries rely on."""
+    for statement in REPORT_INDEXES:
+        conn.execute(statement)
+
+
+def _indented(value, level=1):
+    return json.dumps(value, indent=4).replace('\n', '\n' + '    ' * level)
+
+
+class ReportWriter:
+    """Writes the case report from the case database without loading it whole.
+
+    The summary (per-type counts, recovery time range, deduplication) comes
+    from indexed aggregate queries and is written first; carved_files rows
+    are then streamed from the cursor REPORT_BATCH at a time, so memory stays
+    flat however many files were carved. Formats:
+
+    - json: one document shaped like the original report, rows as arrays
+      in `columns` order.
+    - ndjson: the summary on the first line, then one object per row.
+    - parquet / arrow: the rows as a columnar file (needs pyarrow); the
+      summary is returned but not written.
+    """
+    def __init__(self, db_path, batch_size=REPORT_BATCH):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.rows_written = 0
+
+    def summary(self, conn, header=None):
+        """Report header: `header` plus the aggregates over carved_files."""
+        file_types = conn.execute(FILE_TYPE_SUMMARY).fetchall()
+        earliest = conn.execute('SELECT MIN(recovery_time) FROM carved_files').fetchone()[0]
+        latest = conn.execute('SELECT MAX(recovery_time) FROM carved_files').fetchone()[0]
+        total = sum(row[1] for row in file_types)
+        duplicates = sum(row[4] for row in file_types)
+        report = dict(header or {})
+        report.update({
+            'total_files': total,
+            'file_type_summary': [
+                {
+                    'file_type': row[0],
+                    'file_count': row[1],
+                    'total_size': row[2],
+                    'largest_file_size': row[3]
+                }
+                for row in file_types
+            ],
+            'earliest_recovery_time': earliest,
+            'latest_recovery_time': latest,
+            'deduplication': {
+                'unique_files': total - duplicates,
+                'duplicate_hits': duplicates,
+                'dedup_ratio': duplicates / total if total else 0.0,
+                'bytes_saved': sum(row[5] for row in file_types)
+            },
+        })
+        return report
+
+    def batches(self, conn):
+        """(column names, row batches) for carved_files, in insertion order."""
+        cursor = conn.execute('SELECT * FROM carved_files')
+        columns = [description[0] for description in cursor.description]
+
+        def fetch():
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    return
+                yield rows
+        return columns, fetch()
+
+    def write(self, path, report_format='json', header=None):
+        """Write the report to `path`; returns the summary, or None if the format is unavailable."""
+        if report_format not in REPORT_FORMATS:
+            raise ValueError(f"unknown report format {report_format}")
+        if report_format in ('parquet', 'arrow') and not ARROW_AVAILABLE:
+            print(f"Cannot write a {report_format} report without pyarrow.")
+            return None
+        conn = sqlite3.connect(self.db_path)
+        try:
+            ensure_indexes(conn)
+            report = self.summary(conn, header)
+            columns, batches = self.batches(conn)
+            self.rows_written = 0
+            if report_format == 'json':
+                self._write_json(path, report, columns, batches)
+            elif report_format == 'ndjson':
+                self._write_ndjson(path, report, columns, batches)
+            else:
+                self._write_columnar(path, report_format, conn, columns, batches)
+        finally:
+            conn.close()
+        return report
+
+    def _write_json(self, path, report, columns, batches):
+        with open(path, 'w') as f:
+            f.write('{\n')
+            for key, value in report.items():
+                f.write(f'    {json.dumps(key)}: {_indented(value)},\n')
+            f.write(f'    "columns": {json.dumps(columns)},\n')
+            f.write('    "carved_files": [')
+            separator = '\n        '
+            for rows in batches:
+                f.write(separator + ',\n        '.join(json.dumps(row) for row in rows))
+                separator = ',\n        '
+                self.rows_written += len(rows)
+            f.write('\n    ]\n}\n' if self.rows_written else ']\n}\n')
+
+    def _write_ndjson(self, path, report, columns, batches):
+        with open(path, 'w') as f:
+            f.write(json.dumps(report) + '\n')
+            for rows in batches:
+                f.write(''.join(json.dumps(dict(zip(columns, row))) + '\n' for row in rows))
+                self.rows_written += len(rows)
+
+    def _write_columnar(self, path, report_format, conn, columns, batches):
+        declared = {row[1]: row[2].upper() for row in conn.execute('PRAGMA table_info(carved_files)')}
+        schema = pa.schema([(column, pa.int64() if declared.get(column, '').startswith('INT') else pa.string())
+                            for column in columns])
+        if report_format == 'parquet':
+            writer = pq.ParquetWriter(path, schema, compression='zstd')
+        else:
+            writer = pa.ipc.new_file(path, schema)
+        try:
+            for rows in batches:
+                arrays = [pa.array([row[i] for row in rows], type=field.type)
+                          for i, field in enumerate(schema)]
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+                self.rows_written += len(rows)
+        finally:
+            writer.close()
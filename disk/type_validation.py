@@ -0,0 +1,111 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import magic
+    MAGIC_AVAILABLE = True
+except ImportError:
+    MAGIC_AVAILABLE = False
+    print("python-magic not installed. File type detection will be limited.")
+
+
+MAGIC_HEAD = 4096  # bytes of each hit handed to libmagic
+MAGIC_WORKERS = 4
+
+# libmagic MIME type -> carver types it confirms, preferred type first.
+MIME_TYPES = {
+    'image/jpeg': ('JPG',),
+    'image/png': ('PNG',),
+    'application/pdf': ('PDF',),
+    'application/zip': ('ZIP', 'XLSX', 'PPTX'),
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': ('XLSX',),
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': ('PPTX',),
+    'application/x-ole-storage': ('DOC', 'XLS', 'PPT'),
+    'application/CDFV2': ('DOC', 'XLS', 'PPT'),
+    'application/msword': ('DOC',),
+    'application/vnd.ms-excel': ('XLS',),
+    'application/vnd.ms-powerpoint': ('PPT',),
+    'application/x-rar': ('RAR',),
+    'application/vnd.rar': ('RAR',),
+    'application/vnd.wordperfect': ('WP',),
+}
+# libmagic found no structure at all behind the header.
+UNKNOWN_MIME = 'application/octet-stream'
+
+
+class TypeValidator:
+    """Checks header hits with libmagic before they are carved.
+
+    The carver hands over every hit of a chunk at once; the first MAGIC_HEAD
+    bytes of each are identified on a thread pool (libmagic runs outside the
+    GIL, one magic handle per thread since handles aren't thread-safe).
+    A hit whose head libmagic can't identify at all is dropped, one that it
+    identifies as a sibling type sharing the same header (ZIP/XLSX/PPTX,
+    DOC/XLS/PPT) is reclassified, and anything else keeps the carver's type.
+    Errors from libmagic keep the hit, so validation never loses files.
+    """
+    def __init__(self, matcher, workers=MAGIC_WORKERS, head_size=MAGIC_HEAD):
+        self.head_size = head_size
+        self.signatures = {}
+        self.siblings = {}
+        for root in matcher.roots:
+            for sig in root['group']:
+                self.signatures[sig['type']] = sig
+                self.siblings[sig['type']] = [other['type'] for other in root['group']]
+        self.local = threading.local()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="magic") if workers > 1 else None
+        self.checked = 0
+        self.dropped = 0
+        self.reclassified = 0
+
+    def _mime(self, head):
+        handle = getattr(self.local, 'magic', None)
+        if handle is None:
+            handle = self.local.magic = magic.Magic(mime=True)
+        try:
+            return handle.from_buffer(bytes(head))
+        except Exception:
+            return None
+
+    def classify(self, file_type, mime):
+        """Carver type for a hit of `file_type` that libmagic calls `mime`; None to drop it."""
+        if mime is None:
+            return file_type
+        if mime == UNKNOWN_MIME:
+            return None
+        confirmed = MIME_TYPES.get(mime) or (('TXT',) if mime.startswith('text/') else None)
+        if confirmed is None or file_type in confirmed:
+            return file_type
+        for other in confirmed:
+            if other in self.siblings.get(file_type, ()):
+                return other
+        return None
+
+    def validate(self, hits):
+        """Validate a batch of (sig, head) pairs; returns the signature to carve each with, or None."""
+        if not hits:
+            return []
+        heads = [head[:self.head_size] for _, head in hits]
+        if self.pool is not None and len(heads) > 1:
+            mimes = list(self.pool.map(self._mime, heads))
+        else:
+            mimes = [self._mime(head) for head in heads]
+
+        result = []
+        for (sig, _), mime in zip(hits, mimes):
+            self.checked += 1
+            file_type = self.classify(sig['type'], mime)
+            if file_type is None:
+                self.dropped += 1
+                result.append(None)
+            elif file_type != sig['type']:
+                self.reclassified += 1
+                result.append(self.signatures[file_type])
+            else:
+                result.append(sig)
+        return result
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
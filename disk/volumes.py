@@ -0,0 +1,407 @@
+import struct
+import uuid
+import zlib
+
+
+MBR_TYPES = {
+    0x00: "Empty",
+    0x01: "FAT12",
+    0x04: "FAT16 (<32 MB)",
+    0x05: "Extended (CHS)",
+    0x06: "FAT16",
+    0x07: "NTFS/exFAT",
+    0x0B: "FAT32 (CHS)",
+    0x0C: "FAT32 (LBA)",
+    0x0E: "FAT16 (LBA)",
+    0x0F: "Extended (LBA)",
+    0x11: "Hidden FAT12",
+    0x14: "Hidden FAT16 (<32 MB)",
+    0x16: "Hidden FAT16",
+    0x17: "Hidden NTFS",
+    0x1B: "Hidden FAT32",
+    0x1C: "Hidden FAT32 (LBA)",
+    0x1E: "Hidden FAT16 (LBA)",
+    0x27: "Windows Recovery",
+    0x82: "Linux swap",
+    0x83: "Linux",
+    0x85: "Linux extended",
+    0x8E: "Linux LVM",
+    0xA5: "FreeBSD",
+    0xA8: "Apple UFS",
+    0xAF: "Apple HFS/HFS+",
+    0xEE: "GPT protective",
+    0xEF: "EFI System",
+    0xFD: "Linux RAID",
+}
+
+EXTENDED_TYPES = {0x05, 0x0F, 0x85}
+
+GPT_TYPES = {
+    "C12A7328-F81F-11D2-BA4B-00A0C93EC93B": "EFI System",
+    "E3C9E316-0B5C-4DB8-817D-F92DF00215AE": "Microsoft Reserved",
+    "EBD0A0A2-B9E5-4433-87C0-68B6B72699C7": "Basic Data",
+    "DE94BBA4-06D1-4D40-A16A-BFD50179D6AC": "Windows Recovery",
+    "5808C8AA-7E8F-42E0-85D2-E1E90434CFB3": "LDM Metadata",
+    "AF9B60A0-1431-4F62-BC68-3311714A69AD": "LDM Data",
+    "0FC63DAF-8483-4772-8E79-3D69D8477DE4": "Linux filesystem",
+    "0657FD6D-A4AB-43C4-84E5-0933C84B4F4F": "Linux swap",
+    "E6D6D379-F507-44C2-A23C-238F2A3DF928": "Linux LVM",
+    "A19D880F-05FC-4D3B-A006-743F0F84911E": "Linux RAID",
+    "48465300-0000-11AA-AA11-00306543ECAC": "Apple HFS+",
+    "7C3457EF-0000-11AA-AA11-00306543ECAC": "Apple APFS",
+    "21686148-6449-6E6F-744E-656564454649": "BIOS Boot",
+}
+
+MAX_LOGICAL_PARTITIONS = 128
+
+
+class Volume:
+    """One partition (or unpartitioned gap) on the evidence, in bytes."""
+    def __init__(self, index, scheme, type_code, type_name, start, size, name='', sector_size=512):
+        self.index = index
+        self.scheme = scheme          # 'MBR', 'EBR', 'GPT', 'VBR' or 'GAP'
+        self.type_code = type_code    # MBR type byte or GPT type GUID string
+        self.type_name = type_name
+        self.start = start
+        self.size = size
+        self.name = name
+        self.sector_size = sector_size
+        self.filesystem = None
+
+    @property
+    def end(self):
+        return self.start + self.size
+
+    @property
+    def start_sector(self):
+        return self.start // 512
+
+    @property
+    def size_sectors(self):
+        return self.size // 512
+
+    def __repr__(self):
+        label = self.filesystem or self.type_name
+        name = f" '{self.name}'" if self.name else ""
+        return (f"{self.scheme} #{self.index}: {label}{name}, Start Sector={self.start_sector}, "
+                f"Size={self.size_sectors} sectors")
+
+
+class VolumeMap:
+    """Partition map of an evidence file: volumes plus the space between them."""
+    def __init__(self, disk_size, scheme, volumes, errors=None):
+        self.disk_size = disk_size
+        self.scheme = scheme          # 'GPT', 'MBR', 'VBR' (no table, a filesystem at LBA 0) or None
+        self.volumes = volumes
+        self.errors = errors or []
+
+    def gaps(self, min_size=1024 * 1024):
+        """Unpartitioned extents larger than `min_size` bytes.
+
+        The default skips the alignment slack in front of the first partition,
+        which only holds the partition tables.
+        """
+        gaps = []
+        position = 0
+        for volume in sorted(self.volumes, key=lambda v: v.start):
+            if volume.start - position > min_size:
+                gaps.append(Volume(len(gaps) + 1, 'GAP', None, "Unpartitioned",
+                                   position, volume.start - position))
+            position = max(position, volume.end)
+        if self.disk_size - position > min_size:
+            gaps.append(Volume(len(gaps) + 1, 'GAP', None, "Unpartitioned",
+                               position, self.disk_size - position))
+        return gaps
+
+
+def _read(reader, offset, size):
+    data = reader.view(offset, size)
+    return bytes(data) if data is not None else b''
+
+
+def _mbr_entries(sector):
+    for slot in range(4):
+        entry = sector[446 + slot * 16:462 + slot * 16]
+        type_code = entry[4]
+        start, count = struct.unpack('<II', entry[8:16])
+        yield slot, type_code, start, count
+
+
+def _has_boot_signature(sector):
+    return len(sector) >= 512 and sector[510:512] == b'\x55\xaa'
+
+
+def parse_mbr(reader, sector=None):
+    """Primary MBR partitions plus logical partitions from the EBR chain."""
+    sector = sector if sector is not None else _read(reader, 0, 512)
+    volumes, errors = [], []
+    if not _has_boot_signature(sector):
+        return volumes, errors
+
+    for slot, type_code, start, count in _mbr_entries(sector):
+        if type_code == 0 or count == 0:
+            continue
+        if type_code in EXTENDED_TYPES:
+            logical, chain_errors = parse_ebr_chain(reader, start)
+            volumes.extend(logical)
+            errors.extend(chain_errors)
+            continue
+        volumes.append(Volume(slot + 1, 'MBR', type_code,
+                              MBR_TYPES.get(type_code, f"Unknown ({hex(type_code)})"),
+                              start * 512, count * 512))
+    return volumes, errors
+
+
+def parse_ebr_chain(reader, extended_start):
+    """Follow the extended boot record chain starting at `extended_start` (sectors)."""
+    volumes, errors = [], []
+    ebr_sector = extended_start
+    visited = set()
+    while len(volumes) < MAX_LOGICAL_PARTITIONS:
+        if ebr_sector in visited:
+            errors.append(f"EBR chain loops back to sector {ebr_sector}")
+            break
+        visited.add(ebr_sector)
+        ebr = _read(reader, ebr_sector * 512, 512)
+        if not _has_boot_signature(ebr):
+            errors.append(f"Invalid EBR at sector {ebr_sector}")
+            break
+
+        entries = list(_mbr_entries(ebr))
+        _, type_code, start, count = entries[0]
+        if type_code and count:
+            volumes.append(Volume(5 + len(volumes), 'EBR', type_code,
+                                  MBR_TYPES.get(type_code, f"Unknown ({hex(type_code)})"),
+                                  (ebr_sector + start) * 512, count * 512))
+        _, next_type, next_start, _ = entries[1]
+        if next_type not in EXTENDED_TYPES or next_start == 0:
+            break
+        # Links are relative to the start of the outermost extended partition.
+        ebr_sector = extended_start + next_start
+    return volumes, errors
+
+
+def _parse_gpt_header(reader, lba, sector_size):
+    header = _read(reader, lba * sector_size, sector_size)
+    if header[:8] != b'EFI PART':
+        return None, "no GPT signature"
+    header_size, header_crc = struct.unpack('<II', header[12:20])
+    if not 92 <= header_size <= sector_size:
+        return None, "bad GPT header size"
+    if struct.unpack('<Q', header[24:32])[0] != lba:
+        return None, "GPT header is not at its own LBA"
+    check = bytearray(header[:header_size])
+    check[16:20] = b'\0\0\0\0'
+    if zlib.crc32(check) != header_crc:
+        return None, "GPT header CRC mismatch"
+
+    entries_lba, count, entry_size, entries_crc = struct.unpack('<QIII', header[72:92])
+    if entry_size < 128 or count > 4096:
+        return None, "bad GPT entry table"
+    table = _read(reader, entries_lba * sector_size, count * entry_size)
+    if zlib.crc32(table) != entries_crc:
+        return None, "GPT partition entry CRC mismatch"
+    return (table, count, entry_size), None
+
+
+def _find_gpt_header(reader, lba_of, label, errors):
+    """First valid header at lba_of(sector_size) for 512 and 4096-byte sectors."""
+    for sector_size in (512, 4096):
+        parsed, error = _parse_gpt_header(reader, lba_of(sector_size), sector_size)
+        if parsed is not None:
+            return parsed, sector_size
+        if error != "no GPT signature":
+            errors.append(f"{label} GPT ({sector_size}-byte sectors): {error}")
+    return None, None
+
+
+def parse_gpt(reader, disk_size):
+    """GPT entries from the primary header, or from the backup header at the
+    last LBA when the primary is missing (wiped) or damaged."""
+    errors = []
+    parsed, sector_size = _find_gpt_header(reader, lambda size: 1, "Primary", errors)
+    if parsed is None:
+        found = len(errors)
+        parsed, sector_size = _find_gpt_header(reader, lambda size: disk_size // size - 1, "Backup", errors)
+        if parsed is None:
+            return None, errors or ["no GPT header found"]
+        if not found:
+            errors.append("Primary GPT: no GPT signature")
+        errors.append(f"Using the backup GPT header at the last {sector_size}-byte LBA")
+
+    table, count, entry_size = parsed
+    volumes = []
+    for index in range(count):
+        entry = table[index * entry_size:(index + 1) * entry_size]
+        if entry[:16] == b'\0' * 16:
+            continue
+        type_guid = str(uuid.UUID(bytes_le=entry[:16])).upper()
+        first_lba, last_lba = struct.unpack('<QQ', entry[32:48])
+        if last_lba < first_lba:
+            errors.append(f"GPT entry {index + 1} has a negative size")
+            continue
+        name = entry[56:128].decode('utf-16-le', errors='replace').rstrip('\0')
+        volumes.append(Volume(index + 1, 'GPT', type_guid, GPT_TYPES.get(type_guid, f"Unknown ({type_guid})"),
+                              first_lba * sector_size, (last_lba - first_lba + 1) * sector_size,
+                              name, sector_size))
+    return volumes, errors
+
+
+def detect_filesystem(reader, volume):
+    """Identify the filesystem from the volume boot sector, if recognizable."""
+    boot = _read(reader, volume.start, 512)
+    if len(boot) < 512:
+        return None
+    if boot[3:11] == b'NTFS    ':
+        return 'NTFS'
+    if boot[3:11] == b'EXFAT   ':
+        return 'exFAT'
+    if boot[82:90].startswith(b'FAT32'):
+        return 'FAT32'
+    if boot[54:62].startswith(b'FAT12'):
+        return 'FAT12'
+    if boot[54:62].startswith(b'FAT16') or boot[54:62].startswith(b'FAT'):
+        return 'FAT16'
+    if _read(reader, volume.start + 1080, 2) == b'\x53\xef':
+        return 'ext'
+    return None
+
+
+class FatGeometry:
+    """Layout of a FAT12/16/32 volume, decoded from its BIOS parameter block.
+
+    All offsets are absolute byte offsets into the evidence.
+    """
+    def __init__(self, boot, volume_offset, volume_size=None):
+        (self.bytes_per_sector, self.sectors_per_cluster, self.reserved_sectors, self.fat_count,
+         self.root_entries, total_sectors, _, fat_sectors) = struct.unpack_from('<HBHBHHBH', boot, 11)
+        if self.bytes_per_sector not in (512, 1024, 2048, 4096) or self.fat_count == 0 or \
+                self.sectors_per_cluster == 0 or self.sectors_per_cluster & (self.sectors_per_cluster - 1):
+            raise ValueError("not a FAT boot sector")
+        if total_sectors == 0:
+            total_sectors = struct.unpack_from('<I', boot, 32)[0]
+        self.root_cluster = 0
+        if fat_sectors == 0:
+            fat_sectors, = struct.unpack_from('<I', boot, 36)
+            self.root_cluster, = struct.unpack_from('<I', boot, 44)
+
+        sector = self.bytes_per_sector
+        root_sectors = (self.root_entries * 32 + sector - 1) // sector
+        first_data_sector = self.reserved_sectors + self.fat_count * fat_sectors + root_sectors
+        if fat_sectors == 0 or total_sectors <= first_data_sector:
+            raise ValueError("inconsistent FAT geometry")
+
+        self.volume_offset = volume_offset
+        self.volume_size = min(total_sectors * sector, volume_size or total_sectors * sector)
+        self.cluster_size = self.sectors_per_cluster * sector
+        self.cluster_count = (total_sectors - first_data_sector) // self.sectors_per_cluster
+        if self.cluster_count < 4085:
+            self.fat_type = 'FAT12'
+        elif self.cluster_count < 65525:
+            self.fat_type = 'FAT16'
+        else:
+            self.fat_type = 'FAT32'
+        self.fat_offset = volume_offset + self.reserved_sectors * sector
+        self.fat_size = fat_sectors * sector
+        self.root_dir_offset = self.fat_offset + self.fat_count * self.fat_size
+        self.root_dir_size = root_sectors * sector
+        self.data_offset = self.root_dir_offset + self.root_dir_size
+
+    def cluster_offset(self, cluster):
+        """Absolute offset of data cluster `cluster` (numbering starts at 2)."""
+        return self.data_offset + (cluster - 2) * self.cluster_size
+
+
+def fat_geometry(reader, volume):
+    """FatGeometry of `volume`, or None if it doesn't hold a FAT filesystem."""
+    boot = _read(reader, volume.start, 512)
+    if len(boot) < 512 or not _has_boot_signature(boot):
+        return None
+    try:
+        return FatGeometry(boot, volume.start, volume.size)
+    except (ValueError, struct.error):
+        return None
+
+
+class NtfsGeometry:
+    """Layout of an NTFS volume, decoded from its boot sector."""
+    def __init__(self, boot, volume_offset):
+        if boot[3:11] != b'NTFS    ':
+            raise ValueError("not an NTFS boot sector")
+        self.bytes_per_sector, sectors_per_cluster = struct.unpack_from('<HB', boot, 11)
+        if self.bytes_per_sector not in (512, 1024, 2048, 4096) or sectors_per_cluster == 0:
+            raise ValueError("inconsistent NTFS geometry")
+        # Values above 0x80 encode large clusters as a negative power of two.
+        if sectors_per_cluster > 0x80:
+            sectors_per_cluster = 1 << (256 - sectors_per_cluster)
+        self.cluster_size = self.bytes_per_sector * sectors_per_cluster
+        self.total_sectors, self.mft_cluster, self.mft_mirror_cluster = struct.unpack_from('<QQQ', boot, 40)
+        record_clusters, = struct.unpack_from('<b', boot, 64)
+        self.record_size = 1 << -record_clusters if record_clusters < 0 else record_clusters * self.cluster_size
+        self.volume_offset = volume_offset
+        self.volume_size = self.total_sectors * self.bytes_per_sector
+        self.cluster_count = self.volume_size // self.cluster_size
+        self.mft_offset = volume_offset + self.mft_cluster * self.cluster_size
+
+    def cluster_offset(self, cluster):
+        """Absolute offset of logical cluster `cluster`."""
+        return self.volume_offset + cluster * self.cluster_size
+
+
+def ntfs_geometry(reader, volume):
+    """NtfsGeometry of `volume`, or None if it doesn't hold NTFS."""
+    boot = _read(reader, volume.start, 512)
+    if len(boot) < 512:
+        return None
+    try:
+        return NtfsGeometry(boot, volume.start)
+    except (ValueError, struct.error):
+        return None
+
+
+def discover_volumes(reader):
+    """Build the partition map of an evidence file.
+
+    GPT is used when the MBR is protective (type 0xEE) or a valid GPT header
+    is present; otherwise MBR primaries and the EBR chain of any extended
+    partition are returned. An image that starts with a FAT, exFAT or NTFS
+    boot sector (a volume imaged without its disk) is one volume covering
+    the whole image; its boot signature would otherwise be taken for an
+    MBR. A disk without a recognizable table has no volumes, so its whole
+    extent shows up as a gap.
+    """
+    disk_size = reader.size
+    sector = _read(reader, 0, 512)
+    errors = []
+    volumes, scheme = [], None
+
+    whole = Volume(1, 'VBR', None, "Unpartitioned volume", 0, disk_size)
+    filesystem = detect_filesystem(reader, whole)
+    if filesystem in ('NTFS', 'exFAT') or (filesystem and filesystem.startswith('FAT')
+                                          and fat_geometry(reader, whole) is not None):
+        whole.filesystem = filesystem
+        return VolumeMap(disk_size, 'VBR', [whole], errors)
+
+    protective = _has_boot_signature(sector) and any(
+        type_code == 0xEE for _, type_code, _, _ in _mbr_entries(sector))
+    gpt_volumes, gpt_errors = parse_gpt(reader, disk_size)
+    if gpt_volumes is not None:
+        volumes, scheme = gpt_volumes, 'GPT'
+        errors.extend(gpt_errors)
+    else:
+        if protective:
+            errors.extend(gpt_errors)
+        mbr_volumes, mbr_errors = parse_mbr(reader, sector)
+        errors.extend(mbr_errors)
+        if mbr_volumes or _has_boot_signature(sector):
+            scheme = 'MBR'
+        volumes = [v for v in mbr_volumes if v.type_code != 0xEE]
+
+    for volume in volumes:
+        if volume.end > disk_size:
+            errors.append(f"{volume.scheme} #{volume.index} extends past the end of the image")
+            volume.size = max(0, disk_size - volume.start)
+        volume.filesystem = detect_filesystem(reader, volume)
+
+    volumes = [v for v in volumes if v.size > 0]
+    return VolumeMap(disk_size, scheme, volumes, errors)
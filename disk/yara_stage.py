@@ -0,0 +1,158 @@
+import os
+import hashlib
+
+try:
+    import yara
+    YARA_AVAILABLE = True
+except ImportError:
+    YARA_AVAILABLE = False
+    print("yara-python not installed. Pattern matching will be disabled.")
+
+
+RULE_EXTENSIONS = ('.yar', '.yara')
+YARA_OVERLAP = 64 * 1024  # bytes of the previous chunk rescanned for matches across the boundary
+
+_loaded_rules = {}  # compiled rules path -> yara.Rules, per process
+
+
+def rule_files(rules_dir):
+    """Sorted paths of the rule files under `rules_dir`."""
+    paths = []
+    for root, dirs, files in os.walk(rules_dir):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        paths.extend(os.path.join(root, name) for name in files
+                     if name.lower().endswith(RULE_EXTENSIONS))
+    return sorted(paths)
+
+
+def rules_digest(rules_dir, paths):
+    """SHA-256 over the relative names and contents of the rule files."""
+    digest = hashlib.sha256(yara.__version__.encode() if YARA_AVAILABLE else b'')
+    for path in paths:
+        digest.update(os.path.relpath(path, rules_dir).encode() + b'\0')
+        with open(path, 'rb') as rule_file:
+            digest.update(hashlib.sha256(rule_file.read()).digest())
+    return digest.hexdigest()
+
+
+def compile_rules(rules_dir, cache_dir):
+    """Compile every rule file under `rules_dir` once; return the compiled rules path.
+
+    Compiled rules are cached in `cache_dir` under the digest of the rule
+    sources, so unchanged rules are never recompiled and workers only load
+    the saved file. Each file gets its own namespace (its relative path).
+    Returns None when there are no rules or they fail to compile.
+    """
+    paths = rule_files(rules_dir)
+    if not paths:
+        print(f"No YARA rules found in {rules_dir}")
+        return None
+    compiled_path = os.path.join(cache_dir, f"{rules_digest(rules_dir, paths)}.yarc")
+    if os.path.exists(compiled_path):
+        return compiled_path
+
+    namespaces = {os.path.splitext(os.path.relpath(path, rules_dir))[0]: path for path in paths}
+    try:
+        rules = yara.compile(filepaths=namespaces)
+    except yara.Error as e:
+        print(f"Error compiling YARA rules: {e}")
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    partial_path = f"{compiled_path}.{os.getpid()}.part"
+    rules.save(partial_path)
+    os.replace(partial_path, compiled_path)
+    print(f"Compiled {len(paths)} YARA rule files to {compiled_path}")
+    return compiled_path
+
+
+def load_rules(compiled_path):
+    """yara.Rules for a compiled rules file, loaded once per process."""
+    rules = _loaded_rules.get(compiled_path)
+    if rules is None:
+        rules = _loaded_rules[compiled_path] = yara.load(compiled_path)
+    return rules
+
+
+def _instances(match):
+    """(identifier, offset, length) of every string instance in a yara match."""
+    for string in match.strings:
+        if isinstance(string, tuple):  # yara-python < 4.3
+            offset, identifier, data = string
+            yield identifier, offset, len(data)
+        else:
+            for instance in string.instances:
+                yield string.identifier, instance.offset, instance.matched_length
+
+
+def match_records(matches, base=0):
+    """Flatten yara matches into one dict per string instance, offsets shifted by `base`.
+
+    Rules that matched on their condition alone give a single record with
+    'offset' None.
+    """
+    records = []
+    for match in matches:
+        common = {'rule': match.rule, 'namespace': match.namespace, 'tags': ' '.join(match.tags)}
+        instances = list(_instances(match))
+        for identifier, offset, length in instances:
+            records.append(dict(common, string=identifier, offset=base + offset, length=length))
+        if not instances:
+            records.append(dict(common, string=None, offset=None, length=None))
+    return records
+
+
+class StreamScanner:
+    """Scans the raw image stream chunk by chunk during the carving pass.
+
+    Each chunk is scanned together with the last `overlap` bytes of the one
+    before, so strings that cross a chunk boundary are found; instances
+    that lie entirely in that overlap were already reported and are
+    dropped. Only string matches are kept (a rule's condition sees one chunk,
+    not a file), with absolute offsets, and, like the carver's
+    header_limit, instances starting at or past `limit` are left to whoever
+    owns that range. Gaps in the stream (skipped empty regions) reset the
+    overlap.
+    """
+    def __init__(self, rules, on_match, overlap=YARA_OVERLAP, limit=None):
+        self.rules = rules
+        self.on_match = on_match
+        self.overlap = overlap
+        self.limit = limit
+        self.tail = b''
+        self.next_offset = None
+        self.matches = 0
+
+    def feed(self, chunk, offset):
+        if offset != self.next_offset:
+            self.tail = b''
+        base = offset - len(self.tail)
+        data = self.tail + bytes(chunk)
+        for record in match_records(self.rules.match(data=data), base):
+            if record['offset'] is None or record['offset'] + record['length'] <= offset:
+                continue
+            if self.limit is not None and record['offset'] >= self.limit:
+                continue
+            self.matches += 1
+            self.on_match(record)
+        self.tail = data[-self.overlap:] if self.overlap else b''
+        self.next_offset = offset + len(chunk)
+
+
+class FileScanner:
+    """Scans carved files as the output pipeline finishes them.
+
+    Called from the pipeline's worker threads (yara releases the GIL while
+    scanning), with the in-memory buffer of small files or the path of
+    spilled ones. Offsets in the records are relative to the carved file.
+    """
+    def __init__(self, rules):
+        self.rules = rules
+
+    def __call__(self, data=None, path=None):
+        try:
+            if path is not None:
+                return match_records(self.rules.match(filepath=path))
+            return match_records(self.rules.match(data=bytes(data)))
+        except yara.Error as e:
+            print(f"Error scanning carved file with YARA: {e}")
+            return []
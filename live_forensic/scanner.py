@@ -6,6 +6,9 @@ import requests
 import platform
 from prettytable import PrettyTable
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'disk'))
+from hashset import HashSet
+
 
 def calculate_hashes(file_path):
     """Calculate MD5, SHA-1, and SHA-256 hashes for a given file.
@@ -53,7 +56,7 @@ def scan_file(file_path, malicious_hashes, malware_classification, table):
 
     Args:
         file_path (str): Path of the file to scan.
-        malicious_hashes (set): A set containing hash values for known malicious files.
+        malicious_hashes (set): A set (or hashset.HashSet) containing hash values for known malicious files.
         malware_classification (dict): A dictionary mapping hash values to malware types.
         table (PrettyTable): A pretty table object to display the results.
 
@@ -103,9 +106,13 @@ def scan_directory(directory, malicious_hashes, malware_classification, counter,
 
 
 if __name__ == "__main__":
-    url = "https://raw.githubusercontent.com/king04aman/Malware-Scanner/main/hashes.txt"
-    response = requests.get(url)
-    malicious_hashes = set(response.text.splitlines())
+    if len(sys.argv) > 1:
+        # A hash set file built with disk/hashset.py, looked up on disk.
+        malicious_hashes = HashSet(sys.argv[1])
+    else:
+        url = "https://raw.githubusercontent.com/king04aman/Malware-Scanner/main/hashes.txt"
+        response = requests.get(url)
+        malicious_hashes = set(response.text.splitlines())
 
     malware_classification = {
         "5e884898da28047151d0e56f8dc6292773603d0d6aabbdd62a11ef721d1542d8": "Ransomware",